@@ -0,0 +1,491 @@
+"""
+Batch generation of horoscopes from a JSONL or CSV file of `UserInput` records
+(`name`, `dob`, `code`, `horoscope_type`), e.g. lists of employees of a company.
+
+Records go through the same pipeline as `/api/horoscope/horoscope-pdf` split into
+stages connected by bounded queues - LLM generation, PDF rendering and storing to
+GridFS - so Gemini, Gotenberg and MongoDB work at the same time. Each stage has its
+own number of workers, the process-wide Gemini and Gotenberg limits still apply.
+
+With `--gemini-batch-size` the sections of that many records are generated together
+by Gemini batch jobs instead of interactive calls - cheaper and outside the interactive
+rate limits, but a job may take hours.
+
+Every finished record is appended to the checkpoint file, a repeated run with the
+same input skips records already done (failed ones are tried again). The manifest
+with the result of every record is written at the end.
+
+Usage:
+    python -m app.batch people.jsonl --code ABC123 --generate-workers 16
+    python -m app.batch people.csv --manifest people.manifest.json
+    python -m app.batch people.jsonl --gemini-batch-size 500
+"""
+
+import argparse
+import asyncio
+import csv
+import functools
+import hashlib
+import json
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Awaitable, Callable, Iterator, Optional
+
+from bson import ObjectId
+from loguru import logger
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pydantic import BaseModel, ConfigDict, Field, ValidationError
+
+from app.config import SERVER_SETTINGS
+from app.main import app, lifespan
+from app.models.horoscop import HoroscopeState, UserInput
+from app.utils.database import DB
+from app.utils.gemini_batch import GEMINI_BATCH
+from app.utils.horoscope_service import (
+    check_access_code,
+    generate_horoscope_content,
+    horoscope_document_factory,
+    horoscope_filename,
+    record_token_usage,
+    render_horoscope_html,
+    store_pdf,
+)
+from app.utils.http import GEMINI_CLIENT
+from app.utils.persistence_queue import iter_pdf_bytes
+from app.utils.section_checkpoints import SECTION_CHECKPOINTS
+from app.utils.template_process import generate_pdf
+
+
+class BatchRecord(BaseModel):
+    """Input record and the data passed between the stages."""
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    index: int
+    key: str
+    raw: dict
+    user_input: Optional[UserInput] = None
+    validation_code_id: Optional[ObjectId] = None
+    started_at: float = 0.0
+    start_time: datetime = Field(default_factory=datetime.now)
+    llm_result: Optional[HoroscopeState] = None
+    pdf: bytes = b""
+
+
+class BatchResult(BaseModel):
+    """Line of the checkpoint file and record of the manifest."""
+
+    index: int
+    key: str
+    name: str = ""
+    horoscope_type: str = ""
+    status: str
+    file_id: Optional[str] = None
+    filename: Optional[str] = None
+    error: Optional[str] = None
+    seconds: float = 0.0
+    input_tokens: int = 0
+    output_tokens: int = 0
+
+
+def error_detail(err: Exception) -> str:
+    return getattr(err, "detail", None) or str(err) or repr(err)
+
+
+def record_key(index: int, raw: dict) -> str:
+    """Position and content of the record, a changed input file is not resumed."""
+    content = json.dumps(raw, sort_keys=True, ensure_ascii=False)
+    return f"{index}:{hashlib.sha1(content.encode('utf-8')).hexdigest()[:12]}"
+
+
+def read_records(path: Path, input_format: str) -> Iterator[dict]:
+    with path.open(encoding="utf-8-sig", newline="") as f:
+        if input_format == "csv":
+            for row in csv.DictReader(f):
+                yield {
+                    name.strip(): (value or "").strip()
+                    for name, value in row.items()
+                    if name is not None
+                }
+            return
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError as err:
+                yield {"_error": f"Invalid JSON line: {err}"}
+
+
+class Checkpoint:
+    """Results of finished records, appended line by line as JSONL."""
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self.results: dict[str, BatchResult] = {}
+        if path.exists():
+            with path.open(encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        result = BatchResult.model_validate_json(line)
+                        self.results[result.key] = result
+        self._file = None
+
+    def done(self, key: str) -> bool:
+        result = self.results.get(key)
+        return result is not None and result.status == "done"
+
+    def record(self, result: BatchResult) -> None:
+        if self._file is None:
+            self._file = self.path.open("a", encoding="utf-8")
+        self.results[result.key] = result
+        self._file.write(result.model_dump_json() + "\n")
+        self._file.flush()
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class BatchRunner:
+    """
+    Generation pipeline of a batch.
+
+    - `generate_workers` records are generated by Gemini at once, or with
+      `gemini_batch_size` that many groups of records by Gemini batch jobs
+    - `render_workers` PDFs are rendered at once (bounded by the render pool as well)
+    - `store_workers` PDFs are uploaded to GridFS at once
+    - queues between the stages hold at most as many records as the next stage
+      has workers, so memory stays bounded however long the input is
+    """
+
+    def __init__(
+        self,
+        db: AsyncIOMotorDatabase,
+        checkpoint: Checkpoint,
+        generate_workers: int,
+        render_workers: int,
+        store_workers: int,
+        default_code: Optional[str] = None,
+        gemini_batch_size: int = 0,
+    ) -> None:
+        self.db = db
+        self.checkpoint = checkpoint
+        self.generate_workers = generate_workers
+        self.render_workers = render_workers
+        self.store_workers = store_workers
+        self.default_code = default_code
+        self.gemini_batch_size = gemini_batch_size
+
+        self._code_ids: dict[str, asyncio.Task] = {}
+        self.done = 0
+        self.failed = 0
+        self.skipped = 0
+        self._started_at = time.perf_counter()
+
+    async def run(self, records: Iterator[dict]) -> None:
+        generate_queue: asyncio.Queue[Optional[BatchRecord]] = asyncio.Queue(
+            self.generate_workers
+        )
+        render_queue: asyncio.Queue[Optional[BatchRecord]] = asyncio.Queue(
+            self.render_workers
+        )
+        store_queue: asyncio.Queue[Optional[BatchRecord]] = asyncio.Queue(
+            self.store_workers
+        )
+
+        generate = (
+            self._batch_worker
+            if self.gemini_batch_size
+            else functools.partial(self._worker, self._generate)
+        )
+        stages = [
+            (self.generate_workers, generate, generate_queue, render_queue),
+            (
+                self.render_workers,
+                functools.partial(self._worker, self._render),
+                render_queue,
+                store_queue,
+            ),
+            (
+                self.store_workers,
+                functools.partial(self._worker, self._store),
+                store_queue,
+                None,
+            ),
+        ]
+        workers = [
+            [asyncio.create_task(worker(source, target)) for _ in range(count)]
+            for count, worker, source, target in stages
+        ]
+
+        await self._feed(records, generate_queue)
+        # end of input goes through the stages one after another
+        for (count, _, source, target), tasks in zip(stages, workers):
+            for _ in range(count):
+                await source.put(None)
+            await asyncio.gather(*tasks)
+
+    async def _feed(
+        self, records: Iterator[dict], queue: asyncio.Queue[Optional[BatchRecord]]
+    ) -> None:
+        for index, raw in enumerate(records):
+            key = record_key(index, raw)
+            if self.checkpoint.done(key):
+                self.skipped += 1
+                continue
+            await queue.put(BatchRecord(index=index, key=key, raw=raw))
+
+    async def _worker(
+        self,
+        stage: Callable[[BatchRecord], Awaitable[None]],
+        source: asyncio.Queue[Optional[BatchRecord]],
+        target: Optional[asyncio.Queue[Optional[BatchRecord]]],
+    ) -> None:
+        while (record := await source.get()) is not None:
+            try:
+                await stage(record)
+            except Exception as err:
+                self._finish(record, error=error_detail(err))
+                continue
+            if target is not None:
+                await target.put(record)
+
+    async def _batch_worker(
+        self,
+        source: asyncio.Queue[Optional[BatchRecord]],
+        target: asyncio.Queue[Optional[BatchRecord]],
+    ) -> None:
+        """Generates records by groups of `gemini_batch_size` in Gemini batch jobs."""
+        end = False
+        while not end:
+            records: list[BatchRecord] = []
+            while len(records) < self.gemini_batch_size:
+                record = await source.get()
+                if record is None:
+                    end = True
+                    break
+                try:
+                    await self._prepare(record)
+                except Exception as err:
+                    self._finish(record, error=error_detail(err))
+                    continue
+                records.append(record)
+            if not records:
+                continue
+
+            try:
+                states = await GEMINI_BATCH.generate(
+                    GEMINI_CLIENT.session,
+                    [
+                        HoroscopeState(
+                            name=record.user_input.name,
+                            dob=record.user_input.dob,
+                            horoscope_type=record.user_input.horoscope_type,
+                        )
+                        for record in records
+                    ],
+                )
+            except Exception as err:
+                logger.exception(f"Gemini batch generation failed: {err!r}")
+                for record in records:
+                    self._finish(record, error=error_detail(err))
+                continue
+
+            for record, state in zip(records, states):
+                record.llm_result = state
+                record_token_usage(state, state.horoscope_type.value)
+                if state.error:
+                    self._finish(record, error=state.error)
+                else:
+                    await target.put(record)
+
+    async def _generate(self, record: BatchRecord) -> None:
+        await self._prepare(record)
+        record.llm_result = await generate_horoscope_content(record.user_input)
+
+    async def _prepare(self, record: BatchRecord) -> None:
+        """Validates the record and its access code."""
+        if "_error" in record.raw:
+            raise ValueError(record.raw["_error"])
+        try:
+            record.user_input = UserInput.model_validate(
+                {"code": self.default_code, **record.raw}
+            )
+        except ValidationError as err:
+            raise ValueError(f"Invalid record: {err.errors(include_url=False)}")
+
+        record.started_at = time.perf_counter()
+        record.start_time = datetime.now()
+        record.validation_code_id = await self._code_id(record.user_input.code)
+
+    async def _code_id(self, code: str) -> ObjectId:
+        # each code is checked once per batch, records share the lookup
+        if code not in self._code_ids:
+            self._code_ids[code] = asyncio.create_task(
+                check_access_code(self.db, code, datetime.now())
+            )
+        return await asyncio.shield(self._code_ids[code])
+
+    async def _render(self, record: BatchRecord) -> None:
+        html_content = await render_horoscope_html(record.llm_result)
+        record.pdf = await generate_pdf(html_content)
+
+    async def _store(self, record: BatchRecord) -> None:
+        filename = horoscope_filename(record.user_input.name, record.start_time)
+        file_id = await store_pdf(
+            self.db,
+            iter_pdf_bytes(record.pdf, SERVER_SETTINGS.PDF_CHUNK_SIZE),
+            filename,
+            {"validation_code_id": record.validation_code_id},
+            horoscope_document_factory(
+                record.llm_result, record.validation_code_id, record.start_time
+            ),
+        )
+        await SECTION_CHECKPOINTS.release(record.llm_result)
+        self._finish(record, file_id=file_id, filename=filename)
+
+    def _finish(
+        self,
+        record: BatchRecord,
+        file_id: Optional[ObjectId] = None,
+        filename: Optional[str] = None,
+        error: Optional[str] = None,
+    ) -> None:
+        llm_result = record.llm_result
+        self.checkpoint.record(
+            BatchResult(
+                index=record.index,
+                key=record.key,
+                name=str(record.raw.get("name", "")),
+                horoscope_type=str(record.raw.get("horoscope_type", "")),
+                status="failed" if error else "done",
+                file_id=str(file_id) if file_id else None,
+                filename=filename,
+                error=error,
+                seconds=(
+                    round(time.perf_counter() - record.started_at, 3)
+                    if record.started_at
+                    else 0.0
+                ),
+                input_tokens=llm_result.total_input_tokens if llm_result else 0,
+                output_tokens=llm_result.total_output_tokens if llm_result else 0,
+            )
+        )
+        # the PDF is not needed any more, the record may still wait in a queue
+        record.pdf = b""
+
+        if error:
+            self.failed += 1
+            logger.warning(f"Batch record {record.index} failed: {error}")
+        else:
+            self.done += 1
+        finished = self.done + self.failed
+        if finished % 10 == 0:
+            elapsed = time.perf_counter() - self._started_at
+            logger.info(
+                f"Batch progress: {self.done} done, {self.failed} failed, "
+                f"{finished / elapsed * 60:.1f} records/min"
+            )
+
+
+def write_manifest(path: Path, checkpoint: Checkpoint, runner: BatchRunner) -> dict:
+    results = sorted(checkpoint.results.values(), key=lambda result: result.index)
+    summary = {
+        "records": len(results),
+        "done": sum(result.status == "done" for result in results),
+        "failed": sum(result.status == "failed" for result in results),
+        "skipped_from_checkpoint": runner.skipped,
+        "input_tokens": sum(result.input_tokens for result in results),
+        "output_tokens": sum(result.output_tokens for result in results),
+    }
+    path.write_text(
+        json.dumps(
+            {
+                "summary": summary,
+                "results": [result.model_dump() for result in results],
+            },
+            indent=2,
+            ensure_ascii=False,
+        ),
+        encoding="utf-8",
+    )
+    return summary
+
+
+async def run_batch(args: argparse.Namespace) -> dict:
+    input_path = Path(args.input)
+    input_format = args.format or (
+        "csv" if input_path.suffix.lower() == ".csv" else "jsonl"
+    )
+    checkpoint = Checkpoint(Path(args.checkpoint or f"{input_path}.checkpoint.jsonl"))
+
+    # same resources as the API - HTTP clients, render pool, model catalog, ...
+    async with lifespan(app):
+        runner = BatchRunner(
+            DB.get_database(),
+            checkpoint,
+            generate_workers=args.generate_workers,
+            render_workers=args.render_workers,
+            store_workers=args.store_workers,
+            default_code=args.code,
+            gemini_batch_size=args.gemini_batch_size,
+        )
+        started_at = time.perf_counter()
+        try:
+            await runner.run(read_records(input_path, input_format))
+        finally:
+            checkpoint.close()
+
+    summary = write_manifest(
+        Path(args.manifest or f"{input_path}.manifest.json"), checkpoint, runner
+    )
+    summary["seconds"] = round(time.perf_counter() - started_at, 1)
+    return summary
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Batch generation of horoscopes")
+    parser.add_argument("input", help="JSONL or CSV file with UserInput records")
+    parser.add_argument("--format", choices=["jsonl", "csv"])
+    parser.add_argument("--code", help="access code of records without one")
+    parser.add_argument(
+        "--checkpoint", help="defaults to <input>.checkpoint.jsonl next to the input"
+    )
+    parser.add_argument(
+        "--manifest", help="defaults to <input>.manifest.json next to the input"
+    )
+    parser.add_argument(
+        "--generate-workers",
+        type=int,
+        default=8,
+        help="horoscopes generated by Gemini at once",
+    )
+    parser.add_argument(
+        "--render-workers",
+        type=int,
+        default=SERVER_SETTINGS.GOTENBERG_MAX_CONCURRENT_RENDERS,
+        help="PDFs rendered at once",
+    )
+    parser.add_argument(
+        "--store-workers", type=int, default=4, help="PDFs stored to GridFS at once"
+    )
+    parser.add_argument(
+        "--gemini-batch-size",
+        type=int,
+        default=0,
+        help="records generated together by Gemini batch jobs, 0 for interactive calls",
+    )
+    args = parser.parse_args()
+
+    summary = asyncio.run(run_batch(args))
+    print(json.dumps(summary, indent=2), file=sys.stdout)
+    if summary["failed"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
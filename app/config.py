@@ -1,3 +1,5 @@
+from typing import Literal
+
 from pydantic import Field
 from pydantic_settings import BaseSettings
 
@@ -17,17 +19,211 @@ class Settings(BaseSettings):
     )
     MONGO_DB_NAME: str = "db"
     MONGO_DB_URL: str = "mongodb://localhost:27017"
+    MONGO_ENSURE_INDEXES: bool = Field(
+        default=True, description="Create the declared indexes at startup."
+    )
 
     GEMINI_API_URL: str = (
         "https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-flash-lite:generateContent"
     )
     GEMINI_API_KEY: str = "your_api_key_here"
+    GEMINI_TOKEN_PRICES: dict[str, dict[str, float]] = Field(
+        default={},
+        description="USD per 1M tokens by model id, e.g. "
+        '{"gemini-2.5-flash-lite": {"input": 0.1, "output": 0.4}}, '
+        "used by the token cost metric.",
+    )
     REQUEST_RETRY_COUNT: int = 5
 
+    # Gemini admission control (0 disables the rate budget)
+    GEMINI_RPM_LIMIT: int = 1000
+    GEMINI_TPM_LIMIT: int = 1_000_000
+    GEMINI_ESTIMATED_OUTPUT_TOKENS: int = 800
+    GEMINI_BACKOFF_BASE: float = 1.0
+    GEMINI_BACKOFF_MAX: float = 30.0
+    GEMINI_MAX_ADMISSION_WAIT: float = 30.0
+    GEMINI_CIRCUIT_FAILURE_THRESHOLD: int = 5
+    GEMINI_CIRCUIT_OPEN_SECONDS: float = 30.0
+
+    # Gemini context caching of the system instruction and, for listed horoscope
+    # types, of the per-request prefix (contents smaller than MIN_TOKENS are not cached)
+    GEMINI_CONTEXT_CACHE_ENABLED: bool = False
+    GEMINI_CONTEXT_CACHE_TTL: int = 3600
+    GEMINI_CONTEXT_CACHE_PREFIX_TTL: int = 300
+    GEMINI_CONTEXT_CACHE_MIN_TOKENS: int = 1024
+    GEMINI_CONTEXT_CACHE_PREFIX_TYPES: list[str] = Field(
+        default=["HoroscopeProfi"],
+        description="Horoscope types caching the personal base prompt for the whole run.",
+    )
+
+    # stream section replies (streamGenerateContent), an interrupted stream falls back
+    # to generateContent; the deadline bounds one section incl. retries, not the wait
+    # for GENERATION_MAX_CONCURRENCY_GLOBAL (0 disables)
+    GEMINI_STREAMING: bool = False
+    GEMINI_STREAM_CHUNK_TIMEOUT: float = 30.0
+    GEMINI_SECTION_DEADLINE: float = 0.0
+
+    # model routing per section with fallback models on 429/503 or p95 latency
+    # above the SLO, models are checked against the catalog loaded at startup
+    GEMINI_MODELS_CATALOG: str = "gemini_models.json"
+    MODEL_ROUTING_ENABLED: bool = False
+    MODEL_ROUTING_DEFAULT: str = Field(
+        default="",
+        description="Default model id, empty for the model of GEMINI_API_URL.",
+    )
+    MODEL_ROUTING_SECTIONS: dict[str, str] = Field(
+        default={"personal_questions": "gemini-2.5-flash"},
+        description="Model id per section key, other sections use the default model.",
+    )
+    MODEL_ROUTING_FALLBACKS: dict[str, list[str]] = Field(
+        default={
+            "gemini-2.5-flash-lite": ["gemini-2.0-flash-lite"],
+            "gemini-2.5-flash": ["gemini-2.5-flash-lite"],
+        },
+        description="Alternate models tried in order when a model is unavailable or slow.",
+    )
+    MODEL_LATENCY_SLO: float = 20.0
+    MODEL_LATENCY_WINDOW: int = 200
+    MODEL_LATENCY_MIN_SAMPLES: int = 20
+
+    # hedged section calls - a second identical call once the first runs longer than
+    # the percentile of recent latencies of its model, at most BUDGET extra calls per call
+    GEMINI_HEDGING_ENABLED: bool = False
+    GEMINI_HEDGING_PERCENTILE: float = 95.0
+    GEMINI_HEDGING_MIN_DELAY: float = 1.0
+    GEMINI_HEDGING_BUDGET: float = 0.1
+
+    # Gemini Batch API (batchGenerateContent) of bulk generation - sections of many
+    # horoscopes in jobs of at most MAX_REQUESTS inlined requests, polled until done
+    GEMINI_BATCH_MAX_REQUESTS: int = 1000
+    GEMINI_BATCH_POLL_INTERVAL: float = 30.0
+    GEMINI_BATCH_TIMEOUT: float = 24 * 3600.0
+    GEMINI_BATCH_RETRY_INTERACTIVE: bool = Field(
+        default=True,
+        description="Sections failed in a batch job are generated by interactive calls.",
+    )
+    GEMINI_BATCH_PRICE_FACTOR: float = Field(
+        default=0.5,
+        description="Price of batch tokens relative to GEMINI_TOKEN_PRICES.",
+    )
+
+    # section generation: "sequential", "parallel" (bounded by the limits below)
+    # or "structured" (all sections in one call with a JSON response schema)
+    GENERATION_MODE: Literal["sequential", "parallel", "structured"] = "sequential"
+    GENERATION_MODE_OVERRIDES: dict[
+        str, Literal["sequential", "parallel", "structured"]
+    ] = Field(
+        default={},
+        description="Generation mode per horoscope type, e.g. {'HoroscopeProfi': 'structured'}.",
+    )
+    STRUCTURED_MIN_SECTION_LENGTH: int = 50
+    GENERATION_MAX_CONCURRENCY_PER_REQUEST: int = 4
+    GENERATION_MAX_CONCURRENCY_GLOBAL: int = 32
+
+    # executor of the workflow (validate -> enrich -> generate_outputs) - "langgraph"
+    # compiles the StateGraph at startup, "native" runs the same nodes and edges
+    # without importing langgraph (faster cold start, less memory per worker)
+    PIPELINE_EXECUTOR: Literal["langgraph", "native"] = "langgraph"
+
+    # sign-level section cache (zodiac + astro number + section + prompt version)
+    SECTION_CACHE_ENABLED: bool = False
+    SECTION_CACHE_VARIANTS: int = 3
+    SECTION_CACHE_TTL: int = 30 * 24 * 3600
+    SECTION_CACHE_MEMORY_SIZE: int = 2048
+    SECTION_CACHE_MEMORY_TTL: int = 3600
+    SECTION_CACHE_PERSONALIZED_KEYS: list[str] = Field(
+        default=["definition"],
+        description="Sections using name or date of birth, these always bypass the cache.",
+    )
+
+    # per-section checkpoints of a request keyed by a hash of code, name, date of birth
+    # and type - a repeated request regenerates only the sections still missing
+    SECTION_CHECKPOINT_ENABLED: bool = False
+    SECTION_CHECKPOINT_TTL: int = 24 * 3600
+    # render the PDF without the failed sections when none of them is critical
+    PARTIAL_RENDER_ENABLED: bool = False
+    PARTIAL_RENDER_CRITICAL_SECTIONS: list[str] = Field(
+        default=["definition"],
+        description="Sections a horoscope is never rendered without.",
+    )
+
+    # HTML templates - compiled at startup into a bytecode cache and checked for changes
+    # only with APP_DEBUG, documents with THREAD_MIN_SECTIONS sections render in a thread
+    TEMPLATE_MINIFY: bool = True
+    TEMPLATE_BYTECODE_CACHE_DIR: str = Field(
+        default="", description="Empty for the temporary directory of the system."
+    )
+    TEMPLATE_THREAD_MIN_SECTIONS: int = 6
+
     GOTENBERG_API_URL: str = "http://localhost:5001/forms/chromium/convert/html"
     GOTENBERG_AUTH_USERNAME: str = "gotenberg"
     GOTENBERG_AUTH_PASSWORD: str = "gotenberg"
 
+    # PDF rendering - "gotenberg" or in-process "weasyprint" (optional dependency,
+    # rendered in a pool of PDF_PROCESS_WORKERS processes), per-render timeout,
+    # page options (empty values keep backend defaults) and cache of rendered PDFs
+    PDF_BACKEND: Literal["gotenberg", "weasyprint"] = "gotenberg"
+    PDF_PROCESS_WORKERS: int = 2
+    GOTENBERG_MAX_CONCURRENT_RENDERS: int = 4
+    PDF_RENDER_TIMEOUT: float = 30.0
+    PDF_PAPER_WIDTH: str = Field(default="", description="Inches, e.g. 8.27 for A4.")
+    PDF_PAPER_HEIGHT: str = Field(default="", description="Inches, e.g. 11.7 for A4.")
+    PDF_PDFA: str = Field(default="", description="PDF/A format, e.g. PDF/A-2b.")
+    GOTENBERG_EXTRA_OPTIONS: dict[str, str] = Field(
+        default={},
+        description="Other form fields of the Chromium route, e.g. {'printBackground': 'true'}.",
+    )
+    PDF_CACHE_SIZE: int = 64
+    PDF_CACHE_MAX_BYTES: int = 64 * 1024 * 1024
+    # PDFs are streamed from the renderer to GridFS and the client in chunks of this
+    # size, it is also the GridFS chunk size of stored PDFs
+    PDF_CHUNK_SIZE: int = 255 * 1024
+
+    # access codes validated from a TTL cache (unknown codes are cached as invalid),
+    # lastUsed stamps are written in batches every FLUSH_INTERVAL seconds
+    ACCESS_CODE_CACHE_ENABLED: bool = False
+    ACCESS_CODE_CACHE_TTL: float = 300.0
+    ACCESS_CODE_CACHE_SIZE: int = 10_000
+    ACCESS_CODE_NEGATIVE_TTL: float = 60.0
+    ACCESS_CODE_NEGATIVE_CACHE_SIZE: int = 10_000
+    ACCESS_CODE_FLUSH_INTERVAL: float = 5.0
+
+    # token of the admin endpoints (sent in the X-Admin-Token header),
+    # the endpoints are disabled while it is empty
+    ADMIN_TOKEN: str = ""
+
+    # write-behind persistence - the PDF is returned right away, a background queue
+    # stores it with retries and spills to the on-disk journal when MongoDB is failing
+    PERSISTENCE_WRITE_BEHIND: bool = False
+    PERSISTENCE_QUEUE_SIZE: int = 100
+    PERSISTENCE_WORKERS: int = 2
+    PERSISTENCE_RETRIES: int = 3
+    PERSISTENCE_BACKOFF_BASE: float = 0.5
+    PERSISTENCE_BACKOFF_MAX: float = 10.0
+    PERSISTENCE_JOURNAL_DIR: str = "persistence_journal"
+    PERSISTENCE_REPLAY_INTERVAL: float = 30.0
+    PERSISTENCE_DRAIN_TIMEOUT: float = 20.0
+
+    # identical requests (code, name, dob, type) share one generation,
+    # a finished result is returned again for this many seconds
+    SINGLE_FLIGHT_RESULT_WINDOW: float = 60.0
+
+    # asynchronous jobs API - local worker pool with a bounded queue, unfinished jobs
+    # without a heartbeat of their process for STALE_AFTER seconds are failed
+    JOB_WORKERS: int = 4
+    JOB_QUEUE_SIZE: int = 100
+    JOB_STALE_AFTER: float = 120.0
+
+    # shared HTTP connection pools (created in lifespan)
+    HTTP_KEEPALIVE_TIMEOUT: float = 30.0
+    HTTP_DNS_CACHE_TTL: int = 300
+    HTTP_CONNECT_TIMEOUT: float = 10.0
+    GEMINI_HTTP_POOL_LIMIT: int = 100
+    GEMINI_HTTP_POOL_LIMIT_PER_HOST: int = 50
+    GEMINI_HTTP_TIMEOUT: float = 120.0
+    GOTENBERG_HTTP_POOL_LIMIT: int = 10
+    GOTENBERG_HTTP_TIMEOUT: float = 60.0
+
     class Config:
         env_file = ".env"
         env_file_encoding = "utf-8"
@@ -38,6 +234,9 @@ class DBCollectionNamesSetting(BaseSettings):
     ACCESS_CODES: str = "access_codes"
     HOROSCOPES: str = "horoscopes"
     HOROSCOPES_PDF: str = "horoscopes_pdf"
+    SECTION_CACHE: str = "section_cache"
+    HOROSCOPE_JOBS: str = "horoscope_jobs"
+    SECTION_CHECKPOINTS: str = "section_checkpoints"
 
 
 DB_NAMES = DBCollectionNamesSetting()
@@ -1,6 +1,5 @@
 from contextlib import asynccontextmanager
 
-import uvicorn
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import FileResponse
@@ -9,7 +8,19 @@ from loguru import logger
 
 from app.config import DB_NAMES, SERVER_SETTINGS
 from app.routers import api_router, status_router
+from app.utils.access_codes import ACCESS_CODES
 from app.utils.database import DB
+from app.utils.database.indexes import INDEX_MANAGER
+from app.utils.horoscope_process import warm_up_pipeline
+from app.utils.http import HTTP_CLIENTS
+from app.utils.job_queue import JOB_QUEUE
+from app.utils.metrics import InFlightMiddleware
+from app.utils.model_router import MODEL_ROUTER
+from app.utils.pdf_render import RENDER_POOL
+from app.utils.persistence_queue import PERSISTENCE_QUEUE
+from app.utils.section_cache import SECTION_CACHE
+from app.utils.section_checkpoints import SECTION_CHECKPOINTS
+from app.utils.template_engine import TEMPLATE_ENGINE
 
 app = FastAPI()
 
@@ -23,12 +34,44 @@ async def lifespan(app: FastAPI):
     logger.info("Database collection names:")
     logger.info(DB_NAMES.model_dump_json(indent=2))
 
+    for client in HTTP_CLIENTS:
+        await client.start()
+
+    MODEL_ROUTER.load(SERVER_SETTINGS.GEMINI_MODELS_CATALOG)
+
+    if SERVER_SETTINGS.MONGO_ENSURE_INDEXES:
+        INDEX_MANAGER.start(DB.get_database())
+
+    TEMPLATE_ENGINE.warm_up()
+    warm_up_pipeline()
+    await RENDER_POOL.start()
+
+    if SECTION_CACHE.enabled:
+        await SECTION_CACHE.ensure_indexes(DB.get_database())
+    if SECTION_CHECKPOINTS.enabled:
+        await SECTION_CHECKPOINTS.ensure_indexes(DB.get_database())
+
+    await ACCESS_CODES.start()
+    await PERSISTENCE_QUEUE.start()
+    await JOB_QUEUE.start()
+
     # Yield control to the application
     logger.info("Application is starting up...")
     yield
     logger.info("Application is shutting down...")
 
     # Shutdown
+    await INDEX_MANAGER.stop()
+    await JOB_QUEUE.stop()
+    # store horoscopes still waiting before the database connection is closed
+    await PERSISTENCE_QUEUE.stop()
+    await ACCESS_CODES.stop()
+
+    await RENDER_POOL.close()
+
+    for client in HTTP_CLIENTS:
+        await client.close()
+
     logger.info("MongoDB connection closed")
     DB.close_connection()
 
@@ -47,6 +90,7 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(InFlightMiddleware)
 
 
 # Include the API routers
@@ -63,6 +107,8 @@ async def serve_index():
 app.mount("/static", StaticFiles(directory="app/static"), name="static")
 
 if __name__ == "__main__":
+    import uvicorn
+
     uvicorn.run(
         "app.main:app",
         host=SERVER_SETTINGS.APP_HOST,
@@ -4,7 +4,7 @@ from typing import List, Optional
 
 from pydantic import BaseModel, Field
 
-from app.models import ObjectId
+from app.models import ObjectId, PydanticObjectId
 
 SYSTEM_PROMPT = (
     "You are a professional horoscope writer. Generate inspiring, supportive horoscopes with practical advice. Use a friendly yet professional tone. "
@@ -19,6 +19,14 @@ BASE_PROMPT_TEMPLATE = (
     "Vytvoř následující sekci:"
 )
 
+# Prompt for sections shared by everyone with the same sign and astrological number,
+# it intentionally omits name and date of birth so the output can be cached and reused.
+SIGN_PROMPT_TEMPLATE = (
+    "Na základě astrologického čísla {astro_number} a znamení zvěrokruhu {zodiac}, vytvoř text v češtině."
+    "Neuváděj jméno ani datum narození a vyvaruj se oslovení na začátku, tento výstup je jenom jednou z částí celého horoskopu."
+    "Vytvoř následující sekci:"
+)
+
 
 class HoroscopeSign(StrEnum):
     ARIES = "Aries"
@@ -146,6 +154,9 @@ class ContentResponse(BaseModel):
     error: Optional[str] = None
     input_tokens: int = 0
     output_tokens: int = 0
+    cached: bool = False
+    batch: bool = False
+    model: Optional[str] = None
 
 
 class HoroscopeState(BaseModel):
@@ -154,6 +165,8 @@ class HoroscopeState(BaseModel):
     name: str = ""
     dob: str = ""
     horoscope_type: HoroscopeType = HoroscopeType.BASIC
+    # key of the section checkpoints of the request
+    request_id: Optional[str] = None
 
     # processed data
     dt: Optional[datetime] = None
@@ -161,6 +174,7 @@ class HoroscopeState(BaseModel):
     astro_number: Optional[int] = None
     results: List[ContentResponse] = Field(default_factory=list)
     error: Optional[str] = None
+    failed_sections: List[str] = Field(default_factory=list)
     total_input_tokens: int = 0
     total_output_tokens: int = 0
 
@@ -175,8 +189,46 @@ class HoroscopeDB(HoroscopeState):
     file_id: Optional[ObjectId] = None
 
 
+class HoroscopePdf(BaseModel):
+    """Generated horoscope PDF stored in GridFS."""
+
+    filename: str
+    file_id: ObjectId
+
+    class Config:
+        arbitrary_types_allowed = True
+
+
 class UserInput(BaseModel):
     name: str
     dob: str
     code: str
     horoscope_type: HoroscopeType
+
+
+class JobStatus(StrEnum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+
+
+class HoroscopeJob(BaseModel):
+    """Asynchronous horoscope generation job as returned by the jobs API."""
+
+    id: PydanticObjectId = Field(validation_alias="_id")
+    status: JobStatus = JobStatus.QUEUED
+    stage: Optional[str] = None
+    sections_done: int = 0
+    sections_total: int = 0
+    horoscope_type: HoroscopeType
+    # access code the job was submitted with, never returned
+    validation_code_id: PydanticObjectId = Field(exclude=True)
+    file_id: Optional[PydanticObjectId] = None
+    filename: Optional[str] = None
+    error: Optional[str] = None
+    created_at: datetime
+    updated_at: datetime
+
+    class Config:
+        populate_by_name = True
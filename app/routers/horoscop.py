@@ -1,102 +1,301 @@
+import asyncio
+import json
 import urllib.parse
 from datetime import datetime
+from typing import AsyncIterator
 
-from fastapi import APIRouter, Depends, HTTPException, Response
-from loguru import logger
-from motor.motor_asyncio import AsyncIOMotorDatabase, AsyncIOMotorGridFSBucket
+from bson import ObjectId
+from fastapi import APIRouter, Depends, Header, HTTPException, Request
+from fastapi.responses import StreamingResponse
+from gridfs.errors import NoFile
+from starlette.background import BackgroundTask
 
-from app.config import DB_NAMES
-from app.models.horoscop import HoroscopeDB, UserInput
+from app.config import SERVER_SETTINGS
+from app.models import validate_ObjectId
+from app.models.horoscop import ContentResponse, HoroscopeJob, JobStatus, UserInput
 from app.utils.database import DB, AsyncIOMotorDatabase
-from app.utils.helper import debug_llm_result
-from app.utils.horoscope_process import run_horoscope_flow
-from app.utils.template_process import generate_html, generate_pdf
+from app.utils.horoscope_service import (
+    GENERATION_ERROR,
+    PdfStream,
+    check_access_code,
+    create_horoscope_once,
+    open_horoscope_pdf,
+)
+from app.utils.job_queue import JOB_QUEUE, JobQueueFull
+from app.utils.progress import PROGRESS, HoroscopeProgress
 
 router = APIRouter(prefix="/horoscope", tags=["horoscope"])
 
 
+def pdf_headers(filename: str) -> dict[str, str]:
+    return {
+        "Content-Disposition": f"attachment; filename*=UTF-8''{urllib.parse.quote(filename, safe="")}"
+    }
+
+
+async def access_code_id(
+    x_access_code: str = Header(description="Access code the horoscope was made with"),
+    db: AsyncIOMotorDatabase = Depends(DB.get_database),
+) -> ObjectId:
+    """Stored horoscopes are served only to the access code they were generated with."""
+    return await check_access_code(db, x_access_code, datetime.now())
+
+
 @router.post("/horoscope-pdf")
 async def create_horoscope_pdf(
     user_input: UserInput,
     db: AsyncIOMotorDatabase = Depends(DB.get_database),
-) -> Response:
-
+) -> StreamingResponse:
+    """
+    Generate horoscope PDF\n
+    ---
+    **return:** PDF file streamed to the client while it is rendered and stored,
+    errors before the first chunk are returned as HTTP errors, later ones abort the response
+    """
     start_time = datetime.now()
     # check validation code if exists
-    db_validation_code = await db[DB_NAMES.ACCESS_CODES].find_one_and_update(
-        {"code": user_input.code}, {"$set": {"lastUsed": start_time}}
+    validation_code_id = await check_access_code(db, user_input.code, start_time)
+
+    pdf_stream = PdfStream(put_timeout=SERVER_SETTINGS.PDF_RENDER_TIMEOUT)
+    generation = asyncio.create_task(
+        create_horoscope_once(
+            user_input, db, validation_code_id, start_time, pdf_stream
+        )
     )
+    started = asyncio.create_task(pdf_stream.started.wait())
+    try:
+        # first PDF chunk, or the end of a generation failed or shared with
+        # another request (then the stored PDF is streamed from GridFS)
+        await asyncio.wait([started, generation], return_when=asyncio.FIRST_COMPLETED)
+    except asyncio.CancelledError:
+        pdf_stream.detach()
+        raise
+    finally:
+        started.cancel()
+        # the generation outlives the request and gets stored anyway
+        generation.add_done_callback(lambda t: t.cancelled() or t.exception())
 
-    if not db_validation_code:
-        raise HTTPException(status_code=400, detail="Nevalidní přístupový kód.")
+    if pdf_stream.started.is_set():
+        return StreamingResponse(
+            pdf_stream,
+            media_type="application/pdf",
+            headers=pdf_headers(pdf_stream.filename),
+            background=BackgroundTask(pdf_stream.detach),
+        )
 
+    horoscope_pdf = generation.result()
     try:
-        llm_result = await run_horoscope_flow(
-            name=user_input.name,
-            dob=user_input.dob,
-            horoscope_type=user_input.horoscope_type,
+        filename, chunks = await open_horoscope_pdf(
+            db, horoscope_pdf.file_id, validation_code_id
         )
-    except Exception as e:
-        logger.error(f"Error during horoscope generation: {e}")
-        raise HTTPException(
-            status_code=500,
-            detail="Hvězdy momentálně nepřejí. Zkuste to prosím později.",
+    except NoFile:
+        raise HTTPException(status_code=404, detail="Horoskop nebyl nalezen.")
+    return StreamingResponse(
+        chunks, media_type="application/pdf", headers=pdf_headers(filename)
+    )
+
+
+class StreamProgress(HoroscopeProgress):
+    """Turns generation progress into Server-Sent Events."""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.events: asyncio.Queue[str] = asyncio.Queue()
+
+    def send(self, event: str, data: dict) -> None:
+        self.events.put_nowait(
+            f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
         )
-    """
-    llm_result = debug_llm_result()
-    """
 
-    logger.info(f"LLM processing time: {datetime.now() - start_time}")
+    def on_stage(self, stage: str) -> None:
+        self.send(
+            "stage",
+            {
+                "stage": stage,
+                "sections_done": self.sections_done,
+                "sections_total": self.sections_total,
+            },
+        )
 
-    """ 
-    with open(f"{user_input.name}_horoskop.json", "w", encoding="utf-8") as f:
-        f.write(llm_result.model_dump_json(indent=4, exclude_none=True)) 
-    """
+    def on_section(self, response: ContentResponse) -> None:
+        self.send(
+            "section",
+            {
+                **response.model_dump(exclude_none=True),
+                "sections_done": self.sections_done,
+                "sections_total": self.sections_total,
+            },
+        )
+
+    def on_section_delta(self, key: str, title: str, text: str, reset: bool) -> None:
+        self.send("delta", {"key": key, "title": title, "text": text, "reset": reset})
 
-    start_pdf = datetime.now()
 
-    if llm_result.error:
-        raise HTTPException(status_code=400, detail=llm_result.error)
+@router.post("/horoscope-stream")
+async def stream_horoscope(
+    request: Request,
+    user_input: UserInput,
+    db: AsyncIOMotorDatabase = Depends(DB.get_database),
+) -> StreamingResponse:
+    """
+    Generate horoscope and stream its progress as Server-Sent Events\n
+    ---
+    **events:** `stage`, `delta` (key, title, text chunk, `reset` when the text replaces
+    the chunks sent before) while a section is streamed,
+    `section` (key, title, content, token counts) for each finished section,
+    final `done` with `file_id` of the stored PDF or `error` with `detail`,
+    the PDF is downloaded with the access code in the `X-Access-Code` header
+    """
+    start_time = datetime.now()
+    validation_code_id = await check_access_code(db, user_input.code, start_time)
 
-    # Process html and generate PDF
-    html_content = generate_html(
-        {
-            **llm_result.model_dump(exclude_none=True),
-            "zodiac_cz": (
-                llm_result.zodiac.get_czech_name() if llm_result.zodiac else "Unknown"
-            ),
-        },
-        template_name="basic_template.html",
+    progress = StreamProgress()
+    progress.sections_total = len(user_input.horoscope_type.get_prompts())
+    token = PROGRESS.set(progress)
+    # the task copies the current context, so the pipeline reports to `progress`
+    generation = asyncio.create_task(
+        create_horoscope_once(user_input, db, validation_code_id, start_time)
     )
-    pdf_content = await generate_pdf(html_content)
-    end_time = datetime.now()
+    PROGRESS.reset(token)
 
-    filename = f"{user_input.name.replace(" ","_")}_{start_time.strftime("%Y-%m-%d_%H:%M:%S")}_horoskop.pdf"
+    async def events() -> AsyncIterator[str]:
+        try:
+            while not generation.done() or not progress.events.empty():
+                getter = asyncio.create_task(progress.events.get())
+                await asyncio.wait(
+                    [getter, generation], return_when=asyncio.FIRST_COMPLETED
+                )
+                if getter.done():
+                    yield getter.result()
+                else:
+                    getter.cancel()
 
-    # Store PDF to MongoDB gridfs
-    fs = AsyncIOMotorGridFSBucket(db, bucket_name=DB_NAMES.HOROSCOPES_PDF)
+            try:
+                horoscope_pdf = generation.result()
+            except HTTPException as err:
+                progress.send("error", {"detail": err.detail})
+            except Exception:
+                progress.send("error", {"detail": GENERATION_ERROR})
+            else:
+                progress.send(
+                    "done",
+                    {
+                        "file_id": str(horoscope_pdf.file_id),
+                        "filename": horoscope_pdf.filename,
+                        "url": request.url_for(
+                            "horoscope_file", file_id=str(horoscope_pdf.file_id)
+                        ).path,
+                    },
+                )
+            yield progress.events.get_nowait()
+        finally:
+            # client went away - the generation itself keeps running and gets stored
+            generation.add_done_callback(lambda t: t.cancelled() or t.exception())
 
-    file_id = await fs.upload_from_stream(
-        filename=filename,
-        source=pdf_content,
-        metadata={"validation_code_id": db_validation_code["_id"]},
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
     )
 
-    await db[DB_NAMES.HOROSCOPES].insert_one(
-        HoroscopeDB(
-            **llm_result.model_dump(exclude_none=True),
-            processing_time=(datetime.now() - start_time).total_seconds(),
-            validation_code_id=db_validation_code["_id"],
-            file_id=file_id,
-        ).model_dump(exclude_none=True)
+
+@router.get("/files/{file_id}")
+async def horoscope_file(
+    file_id: str,
+    validation_code_id: ObjectId = Depends(access_code_id),
+    db: AsyncIOMotorDatabase = Depends(DB.get_database),
+) -> StreamingResponse:
+    """
+    Download stored horoscope PDF\n
+    ---
+    **headers:** `X-Access-Code` - access code the horoscope was generated with\n
+    **return:** PDF file streamed from GridFS (or the write-behind queue)
+    """
+    try:
+        filename, chunks = await open_horoscope_pdf(
+            db, validate_ObjectId(file_id), validation_code_id
+        )
+    except (ValueError, NoFile):
+        raise HTTPException(status_code=404, detail="Horoskop nebyl nalezen.")
+
+    return StreamingResponse(
+        chunks, media_type="application/pdf", headers=pdf_headers(filename)
     )
 
-    logger.info(f"PDF processing time: {end_time - start_pdf}")
 
-    return Response(
-        content=pdf_content,
-        media_type="application/pdf",
-        headers={
-            "Content-Disposition": f"attachment; filename*=UTF-8''{urllib.parse.quote(filename, safe="")}"
-        },
+@router.post("/jobs", status_code=202)
+async def create_horoscope_job(
+    user_input: UserInput,
+    db: AsyncIOMotorDatabase = Depends(DB.get_database),
+) -> HoroscopeJob:
+    """
+    Submit horoscope generation job, returns immediately with the job id\n
+    ---
+    **return:** created job, poll `/horoscope/jobs/{job_id}` for its progress
+    with the access code in the `X-Access-Code` header
+    """
+    validation_code_id = await check_access_code(db, user_input.code, datetime.now())
+
+    try:
+        job = await JOB_QUEUE.submit(user_input, validation_code_id)
+    except JobQueueFull:
+        raise HTTPException(
+            status_code=503,
+            detail="Server je momentálně přetížen. Zkuste to prosím později.",
+        )
+
+    return HoroscopeJob.model_validate(job)
+
+
+async def get_job(job_id: str, validation_code_id: ObjectId) -> HoroscopeJob:
+    try:
+        job = await JOB_QUEUE.get(validate_ObjectId(job_id), validation_code_id)
+    except ValueError:
+        job = None
+
+    if not job:
+        raise HTTPException(status_code=404, detail="Úloha nebyla nalezena.")
+
+    return HoroscopeJob.model_validate(job)
+
+
+@router.get("/jobs/{job_id}")
+async def horoscope_job_status(
+    job_id: str, validation_code_id: ObjectId = Depends(access_code_id)
+) -> HoroscopeJob:
+    """
+    Status of horoscope generation job\n
+    ---
+    **headers:** `X-Access-Code` - access code the job was submitted with\n
+    **return:** job with its stage and section progress
+    """
+    return await get_job(job_id, validation_code_id)
+
+
+@router.get("/jobs/{job_id}/pdf")
+async def horoscope_job_pdf(
+    job_id: str,
+    validation_code_id: ObjectId = Depends(access_code_id),
+    db: AsyncIOMotorDatabase = Depends(DB.get_database),
+) -> StreamingResponse:
+    """
+    Download PDF of finished horoscope generation job\n
+    ---
+    **headers:** `X-Access-Code` - access code the job was submitted with\n
+    **return:** PDF file streamed from GridFS (or the write-behind queue)
+    """
+    job = await get_job(job_id, validation_code_id)
+
+    if job.status == JobStatus.FAILED:
+        raise HTTPException(status_code=400, detail=job.error)
+    if job.status != JobStatus.DONE or job.file_id is None:
+        raise HTTPException(status_code=409, detail="Horoskop ještě není připraven.")
+
+    try:
+        filename, chunks = await open_horoscope_pdf(db, job.file_id, validation_code_id)
+    except NoFile:
+        raise HTTPException(status_code=404, detail="Horoskop nebyl nalezen.")
+
+    return StreamingResponse(
+        chunks, media_type="application/pdf", headers=pdf_headers(filename)
     )
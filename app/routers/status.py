@@ -1,10 +1,41 @@
-from fastapi import APIRouter, HTTPException
+import secrets
+from typing import Optional
 
+from fastapi import APIRouter, Depends, Header, HTTPException
+from fastapi.responses import PlainTextResponse
+
+from app.config import SERVER_SETTINGS
+from app.utils.access_codes import ACCESS_CODES
 from app.utils.database import DB
+from app.utils.database.indexes import INDEX_MANAGER
+from app.utils.gemini_admission import GEMINI_ADMISSION
+from app.utils.gemini_batch import GEMINI_BATCH
+from app.utils.gemini_context_cache import GEMINI_CONTEXT_CACHE
+from app.utils.hedging import HEDGING
+from app.utils.horoscope_service import HOROSCOPE_FLIGHTS
+from app.utils.http import HTTP_CLIENTS
+from app.utils.job_queue import JOB_QUEUE
+from app.utils.metrics import METRICS
+from app.utils.model_router import MODEL_ROUTER
+from app.utils.pdf_render import RENDER_POOL
+from app.utils.persistence_queue import PERSISTENCE_QUEUE
+from app.utils.section_cache import SECTION_CACHE
+from app.utils.section_checkpoints import SECTION_CHECKPOINTS
+from app.utils.template_engine import TEMPLATE_ENGINE
 
 router = APIRouter(prefix="/status", tags=["Status"])
 
 
+def require_admin_token(x_admin_token: Optional[str] = Header(default=None)) -> None:
+    """Admin endpoints change server state, they need `ADMIN_TOKEN`."""
+    if not SERVER_SETTINGS.ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Administrace není povolena.")
+    if x_admin_token is None or not secrets.compare_digest(
+        x_admin_token.encode("utf-8"), SERVER_SETTINGS.ADMIN_TOKEN.encode("utf-8")
+    ):
+        raise HTTPException(status_code=403, detail="Neplatný administrátorský token.")
+
+
 @router.get("/health")
 def health() -> dict[str, str]:
     """
@@ -27,3 +58,190 @@ async def readiness() -> dict[str, str]:
         return {"status": "ok"}
     else:
         raise HTTPException(status_code=503, detail="Connection to database failed")
+
+
+@router.get("/http-pools")
+def http_pools() -> list[dict]:
+    """
+    Statistics of shared HTTP connection pools (Gemini, Gotenberg)\n
+    ---
+    **return:** list of pool counters, `queued_*` values show pool saturation
+    """
+    return [client.stats() for client in HTTP_CLIENTS]
+
+
+@router.get("/section-cache")
+def section_cache() -> dict:
+    """
+    Statistics of the sign-level section cache\n
+    ---
+    **return:** hit/miss counters of the cache
+    """
+    return SECTION_CACHE.stats()
+
+
+@router.get("/section-checkpoints")
+def section_checkpoints() -> dict:
+    """
+    Statistics of per-section checkpoints of requests\n
+    ---
+    **return:** resumed requests, restored and saved sections
+    """
+    return SECTION_CHECKPOINTS.stats()
+
+
+@router.get("/single-flight")
+def single_flight() -> dict:
+    """
+    Statistics of coalesced horoscope requests\n
+    ---
+    **return:** number of leaders, coalesced requests and result window hits
+    """
+    return HOROSCOPE_FLIGHTS.stats()
+
+
+@router.get("/jobs")
+def jobs() -> dict:
+    """
+    State of the local horoscope job worker pool\n
+    ---
+    **return:** queue depth and job counters
+    """
+    return JOB_QUEUE.stats()
+
+
+@router.get("/gemini")
+def gemini() -> dict:
+    """
+    State of Gemini admission control\n
+    ---
+    **return:** circuit breaker state, remaining rate budgets and throttling counters
+    """
+    return GEMINI_ADMISSION.stats()
+
+
+@router.get("/gemini-context-cache")
+def gemini_context_cache() -> dict:
+    """
+    State of Gemini context caching\n
+    ---
+    **return:** active cached contents and hit/miss counters
+    """
+    return GEMINI_CONTEXT_CACHE.stats()
+
+
+@router.get("/gemini-batch")
+def gemini_batch() -> dict:
+    """
+    State of Gemini batch jobs of bulk generation\n
+    ---
+    **return:** running jobs, job and request counters and token usage
+    """
+    return GEMINI_BATCH.stats()
+
+
+@router.get("/models")
+def models() -> dict:
+    """
+    State of Gemini model routing\n
+    ---
+    **return:** rolling p50/p95 latency and error counters per model, fallback counters
+    """
+    return MODEL_ROUTER.stats()
+
+
+@router.get("/hedging")
+def hedging() -> dict:
+    """
+    State of hedged Gemini calls\n
+    ---
+    **return:** hedge rate, win rate of hedges and remaining hedging budget
+    """
+    return HEDGING.stats()
+
+
+@router.get("/pdf-render")
+def pdf_render() -> dict:
+    """
+    State of the PDF render pool\n
+    ---
+    **return:** backend, queued and running conversions, queue wait, render latency and PDF cache counters
+    """
+    return RENDER_POOL.stats()
+
+
+@router.get("/templates")
+def templates() -> dict:
+    """
+    State of the HTML template engine\n
+    ---
+    **return:** renders on the event loop and in threads, render latency and template sizes before and after minification
+    """
+    return TEMPLATE_ENGINE.stats()
+
+
+@router.get("/persistence")
+def persistence() -> dict:
+    """
+    State of the write-behind persistence queue\n
+    ---
+    **return:** queue depth, journaled horoscopes, age of the oldest pending horoscope and store lag
+    """
+    return PERSISTENCE_QUEUE.stats()
+
+
+@router.get("/indexes")
+async def indexes() -> dict:
+    """
+    Indexes of the application collections\n
+    ---
+    **return:** existing, missing and unused (`$indexStats`) indexes per collection and index creation errors
+    """
+    return await INDEX_MANAGER.report(DB.get_database())
+
+
+@router.get("/query-plans")
+async def query_plans() -> list[dict]:
+    """
+    Query plans of the hot queries (access code check, horoscope and PDF lookups)\n
+    ---
+    **return:** winning plan stages and used indexes per query, `collscan` marks a query without index
+    """
+    return await INDEX_MANAGER.explain(DB.get_database())
+
+
+@router.get("/access-codes")
+def access_codes() -> dict:
+    """
+    State of the access code cache\n
+    ---
+    **return:** cached valid/invalid codes, hit rate and batched lastUsed writes
+    """
+    return ACCESS_CODES.stats()
+
+
+@router.post("/access-codes/invalidate", dependencies=[Depends(require_admin_token)])
+async def invalidate_access_codes(code: Optional[str] = None) -> dict:
+    """
+    Drop access code from the cache of this server process, e.g. after it was revoked or created\n
+    ---
+    **headers:** `X-Admin-Token` - the configured `ADMIN_TOKEN`\n
+    **code:** access code, all cached codes are dropped without it\n
+    **return:** cache state after the invalidation, other worker processes keep
+    their cached codes until `ACCESS_CODE_CACHE_TTL` (`ACCESS_CODE_NEGATIVE_TTL`) expires
+    """
+    ACCESS_CODES.invalidate(code)
+    await ACCESS_CODES.flush()
+    return ACCESS_CODES.stats()
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+def metrics() -> PlainTextResponse:
+    """
+    Latency histograms, token counters and in-flight gauges in the Prometheus text format\n
+    ---
+    **return:** metrics of this server process since its start
+    """
+    return PlainTextResponse(
+        METRICS.render(), media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
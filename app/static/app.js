@@ -21,6 +21,9 @@ function horoscopeApp() {
     loadingProgress: 0,
     pdfBlob: null,
 
+    // Sections already generated (streamed from the server)
+    sections: [],
+
     // Validation errors
     errors: {
       name: "",
@@ -181,6 +184,7 @@ function horoscopeApp() {
       this.showSuccess = false;
       this.showError = false;
       this.errorMessage = "";
+      this.sections = [];
 
       // Start progress animation
       const progressInterval = this.startProgressAnimation();
@@ -196,8 +200,8 @@ function horoscopeApp() {
 
         console.log("Sending request:", payload);
 
-        // Send POST request
-        const response = await fetch("/api/horoscope/horoscope-pdf", {
+        // Send POST request, progress is streamed back as Server-Sent Events
+        const response = await fetch("/api/horoscope/horoscope-stream", {
           method: "POST",
           headers: {
             "Content-Type": "application/json",
@@ -205,10 +209,6 @@ function horoscopeApp() {
           body: JSON.stringify(payload),
         });
 
-        // Complete progress bar
-        clearInterval(progressInterval);
-        this.loadingProgress = 100;
-
         if (!response.ok) {
           // Handle error response
           let errorMsg = "Chyba při generování horoskopu.";
@@ -226,8 +226,22 @@ function horoscopeApp() {
           throw new Error(errorMsg);
         }
 
-        // Get PDF blob
-        this.pdfBlob = await response.blob();
+        const fileUrl = await this.readHoroscopeStream(response);
+
+        // Get PDF blob, stored horoscopes are served only with their access code
+        const pdfResponse = await fetch(fileUrl, {
+          headers: {
+            "X-Access-Code": payload.code,
+          },
+        });
+        if (!pdfResponse.ok) {
+          throw new Error("Chyba při stahování horoskopu.");
+        }
+        this.pdfBlob = await pdfResponse.blob();
+
+        // Complete progress bar
+        clearInterval(progressInterval);
+        this.loadingProgress = 100;
 
         // Show success state
         this.isLoading = false;
@@ -249,6 +263,72 @@ function horoscopeApp() {
       }
     },
 
+    /**
+     * Read Server-Sent Events of the horoscope generation
+     * @param {Response} response - Streaming response of the generation
+     * @returns {Promise<string>} URL of the generated PDF
+     */
+    async readHoroscopeStream(response) {
+      const reader = response.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = "";
+
+      while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+
+        let boundary;
+        while ((boundary = buffer.indexOf("\n\n")) !== -1) {
+          const rawEvent = buffer.slice(0, boundary);
+          buffer = buffer.slice(boundary + 2);
+
+          let eventName = "message";
+          let data = "";
+          for (const line of rawEvent.split("\n")) {
+            if (line.startsWith("event:")) eventName = line.slice(6).trim();
+            if (line.startsWith("data:")) data += line.slice(5).trim();
+          }
+          const payload = data ? JSON.parse(data) : {};
+
+          if (eventName === "delta") {
+            // section still being streamed - append text to its preview,
+            // a reset (interrupted stream generated again) replaces it
+            const partial = this.sections.find((s) => s.key === payload.key);
+            if (partial) {
+              partial.content = payload.reset
+                ? payload.text
+                : partial.content + payload.text;
+            } else {
+              this.sections = [
+                ...this.sections,
+                { key: payload.key, title: payload.title, content: payload.text },
+              ];
+            }
+          } else if (eventName === "section") {
+            const index = this.sections.findIndex((s) => s.key === payload.key);
+            this.sections =
+              index === -1
+                ? [...this.sections, payload]
+                : this.sections.map((s, i) => (i === index ? payload : s));
+            const sectionProgress = Math.round(
+              (payload.sections_done / payload.sections_total) * 90
+            );
+            this.loadingProgress = Math.max(
+              this.loadingProgress,
+              sectionProgress
+            );
+          } else if (eventName === "done") {
+            return payload.url;
+          } else if (eventName === "error") {
+            throw new Error(this.formatErrorMessage(payload.detail));
+          }
+        }
+      }
+
+      throw new Error("Spojení se serverem bylo přerušeno.");
+    },
+
     /**
      * Format error message for display
      * @param {string|array} detail - Error detail from API
@@ -326,6 +406,7 @@ function horoscopeApp() {
       this.errorMessage = "";
       this.loadingProgress = 0;
       this.pdfBlob = null;
+      this.sections = [];
 
       console.log("Form reset");
     },
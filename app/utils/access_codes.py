@@ -0,0 +1,216 @@
+import asyncio
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Optional
+
+from bson import ObjectId
+from fastapi import HTTPException
+from loguru import logger
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import UpdateOne
+from pymongo.errors import PyMongoError
+
+from app.config import DB_NAMES, SERVER_SETTINGS
+from app.utils.database import DB
+from app.utils.single_flight import SingleFlight
+
+INVALID_CODE_ERROR = "Nevalidní přístupový kód."
+
+
+class TtlCache:
+    """LRU of at most `size` entries, each valid for `ttl` seconds."""
+
+    def __init__(self, size: int, ttl: float) -> None:
+        self.size = size
+        self.ttl = ttl
+        self._entries: OrderedDict[str, tuple[float, Optional[ObjectId]]] = (
+            OrderedDict()
+        )
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: str) -> bool:
+        entry = self._entries.get(key)
+        if entry is None:
+            return False
+        if entry[0] < time.monotonic():
+            del self._entries[key]
+            return False
+        self._entries.move_to_end(key)
+        return True
+
+    def get(self, key: str) -> Optional[ObjectId]:
+        return self._entries[key][1] if key in self else None
+
+    def set(self, key: str, value: Optional[ObjectId]) -> None:
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+
+    def pop(self, key: str) -> None:
+        self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+
+class AccessCodeService:
+    """
+    Validation of access codes without a MongoDB round-trip on the common path.
+
+    - valid codes are cached for `ttl` seconds, unknown codes for `negative_ttl`
+      seconds in a separate cache, so guessing codes cannot evict valid ones
+    - concurrent lookups of the same uncached code share one query
+    - `lastUsed` stamps are collected and written by one `bulk_write` every
+      `flush_interval` seconds (and on shutdown)
+    - revoked codes are dropped with `invalidate` (in this process only, other
+      workers keep them), otherwise they stay valid for at most `ttl` seconds
+    """
+
+    def __init__(
+        self,
+        ttl: float,
+        negative_ttl: float,
+        max_size: int,
+        negative_max_size: int,
+        flush_interval: float,
+    ) -> None:
+        self.flush_interval = flush_interval
+
+        self._valid = TtlCache(max_size, ttl)
+        self._invalid = TtlCache(negative_max_size, negative_ttl)
+        self._lookups: SingleFlight[Optional[ObjectId]] = SingleFlight("access-code", 0)
+        self._last_used: dict[ObjectId, datetime] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.flushes = 0
+        self.flushed_updates = 0
+        self.flush_failures = 0
+
+    @property
+    def enabled(self) -> bool:
+        return SERVER_SETTINGS.ACCESS_CODE_CACHE_ENABLED
+
+    async def start(self) -> None:
+        self._flush_task = asyncio.create_task(
+            self._flush_loop(), name="access-code-flush"
+        )
+
+    async def stop(self) -> None:
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            await asyncio.gather(self._flush_task, return_exceptions=True)
+            self._flush_task = None
+        await self.flush()
+
+    async def validate(
+        self, db: AsyncIOMotorDatabase, code: str, used_at: datetime
+    ) -> ObjectId:
+        """
+        Validates the access code and schedules stamping of its last usage
+
+        :return: id of the access code
+        """
+        if code in self._valid:
+            self.hits += 1
+            code_id = self._valid.get(code)
+        elif code in self._invalid:
+            self.negative_hits += 1
+            code_id = None
+        else:
+            self.misses += 1
+            code_id = await self._lookups.run(code, lambda: self._lookup(db, code))
+
+        if code_id is None:
+            raise HTTPException(status_code=400, detail=INVALID_CODE_ERROR)
+
+        self._last_used[code_id] = max(used_at, self._last_used.get(code_id, used_at))
+        return code_id
+
+    async def _lookup(self, db: AsyncIOMotorDatabase, code: str) -> Optional[ObjectId]:
+        document = await db[DB_NAMES.ACCESS_CODES].find_one({"code": code}, {"_id": 1})
+        if document is None:
+            self._invalid.set(code, None)
+            return None
+        self._valid.set(code, document["_id"])
+        return document["_id"]
+
+    def invalidate(self, code: Optional[str] = None) -> None:
+        """
+        Forget cached code (revoked or newly created one), all codes without `code`
+        """
+        self.invalidations += 1
+        if code is None:
+            self._valid.clear()
+            self._invalid.clear()
+        else:
+            self._valid.pop(code)
+            self._invalid.pop(code)
+
+    async def _flush_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as err:
+                logger.exception(f"Access code lastUsed flush crashed: {err}")
+
+    async def flush(self) -> None:
+        """Write collected `lastUsed` stamps, kept for the next flush on failure."""
+        if not self._last_used:
+            return
+        pending, self._last_used = self._last_used, {}
+        try:
+            await DB.get_database()[DB_NAMES.ACCESS_CODES].bulk_write(
+                [
+                    UpdateOne({"_id": code_id}, {"$max": {"lastUsed": used_at}})
+                    for code_id, used_at in pending.items()
+                ],
+                ordered=False,
+            )
+        except PyMongoError as err:
+            self.flush_failures += 1
+            logger.warning(f"Access code lastUsed flush failed: {err!r}")
+            for code_id, used_at in pending.items():
+                self._last_used[code_id] = max(
+                    used_at, self._last_used.get(code_id, used_at)
+                )
+            return
+        self.flushes += 1
+        self.flushed_updates += len(pending)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.negative_hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "valid_codes": len(self._valid),
+            "invalid_codes": len(self._invalid),
+            "hits": self.hits,
+            "negative_hits": self.negative_hits,
+            "misses": self.misses,
+            "hit_rate": (
+                round((self.hits + self.negative_hits) / lookups, 4) if lookups else 0.0
+            ),
+            "coalesced": self._lookups.coalesced,
+            "invalidations": self.invalidations,
+            "pending_last_used": len(self._last_used),
+            "flushes": self.flushes,
+            "flushed_updates": self.flushed_updates,
+            "flush_failures": self.flush_failures,
+        }
+
+
+ACCESS_CODES = AccessCodeService(
+    ttl=SERVER_SETTINGS.ACCESS_CODE_CACHE_TTL,
+    negative_ttl=SERVER_SETTINGS.ACCESS_CODE_NEGATIVE_TTL,
+    max_size=SERVER_SETTINGS.ACCESS_CODE_CACHE_SIZE,
+    negative_max_size=SERVER_SETTINGS.ACCESS_CODE_NEGATIVE_CACHE_SIZE,
+    flush_interval=SERVER_SETTINGS.ACCESS_CODE_FLUSH_INTERVAL,
+)
@@ -0,0 +1,250 @@
+import asyncio
+from typing import Any, Optional
+
+from bson import ObjectId
+from loguru import logger
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pydantic import BaseModel
+from pymongo.errors import ConnectionFailure, OperationFailure, PyMongoError
+
+from app.config import DB_NAMES
+
+
+class IndexSpec(BaseModel):
+    """Index the application relies on."""
+
+    collection: str
+    keys: list[tuple[str, int]]
+    name: str
+    unique: bool = False
+
+
+class HotQuery(BaseModel):
+    """Query run on every request, its plan is checked by `explain`."""
+
+    name: str
+    collection: str
+    filter: dict[str, Any]
+    sort: Optional[dict[str, int]] = None
+
+
+def gridfs_files(bucket: str) -> str:
+    return f"{bucket}.files"
+
+
+def gridfs_chunks(bucket: str) -> str:
+    return f"{bucket}.chunks"
+
+
+REQUIRED_INDEXES = [
+    IndexSpec(
+        collection=DB_NAMES.ACCESS_CODES,
+        keys=[("code", 1)],
+        name="code_unique",
+        unique=True,
+    ),
+    IndexSpec(
+        collection=DB_NAMES.HOROSCOPES,
+        keys=[("validation_code_id", 1)],
+        name="validation_code_id",
+    ),
+    IndexSpec(
+        collection=DB_NAMES.HOROSCOPES,
+        keys=[("created_at", -1)],
+        name="created_at",
+    ),
+    IndexSpec(
+        collection=DB_NAMES.HOROSCOPES,
+        keys=[("file_id", 1)],
+        name="file_id",
+    ),
+    IndexSpec(
+        collection=gridfs_files(DB_NAMES.HOROSCOPES_PDF),
+        keys=[("metadata.validation_code_id", 1)],
+        name="metadata_validation_code_id",
+    ),
+    # created by the GridFS driver on the first upload, declared to be reported
+    IndexSpec(
+        collection=gridfs_files(DB_NAMES.HOROSCOPES_PDF),
+        keys=[("filename", 1), ("uploadDate", 1)],
+        name="filename_1_uploadDate_1",
+    ),
+    IndexSpec(
+        collection=gridfs_chunks(DB_NAMES.HOROSCOPES_PDF),
+        keys=[("files_id", 1), ("n", 1)],
+        name="files_id_1_n_1",
+        unique=True,
+    ),
+]
+
+HOT_QUERIES = [
+    HotQuery(
+        name="access code check",
+        collection=DB_NAMES.ACCESS_CODES,
+        filter={"code": "ABC123"},
+    ),
+    HotQuery(
+        name="horoscopes of access code",
+        collection=DB_NAMES.HOROSCOPES,
+        filter={"validation_code_id": ObjectId()},
+        sort={"created_at": -1},
+    ),
+    HotQuery(
+        name="horoscope of PDF (write-behind upsert)",
+        collection=DB_NAMES.HOROSCOPES,
+        filter={"file_id": ObjectId()},
+    ),
+    HotQuery(
+        name="PDFs of access code",
+        collection=gridfs_files(DB_NAMES.HOROSCOPES_PDF),
+        filter={"metadata.validation_code_id": ObjectId()},
+    ),
+    HotQuery(
+        name="section cache lookup",
+        collection=DB_NAMES.SECTION_CACHE,
+        filter={"key": ""},
+    ),
+]
+
+
+def plan_summary(plan: dict) -> dict:
+    """
+    Stages of a winning plan from the leaf up, e.g. `IXSCAN` -> `FETCH`
+
+    :return: stages and names of used indexes
+    """
+    stages: list[str] = []
+    indexes: list[str] = []
+    # slot based engine nests the classic plan
+    inputs = [plan.get("queryPlan", plan)]
+    while inputs:
+        stage = inputs.pop()
+        stages.insert(0, stage.get("stage", "?"))
+        if "indexName" in stage:
+            indexes.append(stage["indexName"])
+        if "inputStage" in stage:
+            inputs.append(stage["inputStage"])
+        inputs.extend(stage.get("inputStages", []))
+    return {"stages": stages, "indexes": indexes, "collscan": "COLLSCAN" in stages}
+
+
+class IndexManager:
+    """
+    Declared indexes of the application collections.
+
+    - `ensure` creates missing indexes, a failing index (e.g. duplicate access codes
+      for the unique index) or unreachable MongoDB is logged and reported; `start`
+      runs it in the background so the server starts without waiting for MongoDB
+    - `report` lists missing indexes and indexes without any use since the last restart
+      of MongoDB (`$indexStats`)
+    - `explain` shows query plans of the hot queries
+    """
+
+    def __init__(self, indexes: list[IndexSpec], hot_queries: list[HotQuery]) -> None:
+        self.indexes = indexes
+        self.hot_queries = hot_queries
+        self.errors: dict[str, str] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def collections(self) -> list[str]:
+        return sorted({index.collection for index in self.indexes})
+
+    def start(self, db: AsyncIOMotorDatabase) -> None:
+        self._task = asyncio.create_task(self.ensure(db), name="ensure-indexes")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def ensure(self, db: AsyncIOMotorDatabase) -> None:
+        created = 0
+        for index in self.indexes:
+            try:
+                await db[index.collection].create_index(
+                    index.keys, name=index.name, unique=index.unique
+                )
+                created += 1
+            except OperationFailure as err:
+                # e.g. duplicate keys or the same keys indexed under another name
+                self.errors[f"{index.collection}.{index.name}"] = str(err)
+                logger.error(
+                    f"Index {index.collection}.{index.name} not created: {err}"
+                )
+            except ConnectionFailure as err:
+                # the remaining indexes would each wait for the server selection timeout
+                self.errors["connection"] = str(err)
+                logger.error(f"Indexes not ensured, MongoDB is unreachable: {err}")
+                break
+            except PyMongoError as err:
+                self.errors[f"{index.collection}.{index.name}"] = str(err)
+                logger.error(
+                    f"Index {index.collection}.{index.name} not created: {err}"
+                )
+        logger.info(f"Indexes ensured ({created}/{len(self.indexes)})")
+
+    async def report(self, db: AsyncIOMotorDatabase) -> dict:
+        """
+        Missing and unused indexes of the application collections
+
+        :return: per collection existing, missing and unused indexes
+        """
+        collections = {}
+        for name in self.collections():
+            existing = {
+                info["name"]: list(info["key"].items())
+                async for info in db[name].list_indexes()
+            }
+            missing = [
+                index.name
+                for index in self.indexes
+                if index.collection == name and index.keys not in existing.values()
+            ]
+            collections[name] = {
+                "indexes": sorted(existing),
+                "missing": missing,
+                "unused": await self._unused(db, name),
+            }
+        return {"collections": collections, "errors": self.errors}
+
+    async def _unused(self, db: AsyncIOMotorDatabase, name: str) -> Optional[list[str]]:
+        try:
+            stats = await db[name].aggregate([{"$indexStats": {}}]).to_list(None)
+        except PyMongoError as err:
+            logger.debug(f"$indexStats of {name} not available: {err}")
+            return None
+        return sorted(
+            stat["name"]
+            for stat in stats
+            if stat["name"] != "_id_" and stat["accesses"]["ops"] == 0
+        )
+
+    async def explain(self, db: AsyncIOMotorDatabase) -> list[dict]:
+        """
+        Query plans of the hot queries
+
+        :return: winning plan summary per query, `collscan` marks a missing index
+        """
+        plans = []
+        for query in self.hot_queries:
+            command: dict[str, Any] = {"find": query.collection, "filter": query.filter}
+            if query.sort:
+                command["sort"] = query.sort
+            result: dict[str, Any] = {
+                "name": query.name,
+                "collection": query.collection,
+                "filter": sorted(query.filter),
+            }
+            try:
+                explained = await db.command(
+                    {"explain": command, "verbosity": "queryPlanner"}
+                )
+                result.update(plan_summary(explained["queryPlanner"]["winningPlan"]))
+            except (PyMongoError, KeyError) as err:
+                result["error"] = repr(err)
+            plans.append(result)
+        return plans
+
+
+INDEX_MANAGER = IndexManager(REQUIRED_INDEXES, HOT_QUERIES)
@@ -0,0 +1,282 @@
+import asyncio
+import random
+import re
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from enum import StrEnum
+from typing import Mapping, Optional
+
+from loguru import logger
+
+from app.config import SERVER_SETTINGS
+
+
+class GeminiUnavailableError(Exception):
+    """Gemini API is considered unhealthy or over budget, the call was not sent."""
+
+
+class CircuitState(StrEnum):
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+
+class TokenBucket:
+    """
+    Budget refilled continuously at `per_minute` units per minute.
+    Debts are allowed (after reconciling real usage), later callers then wait longer.
+    """
+
+    def __init__(self, per_minute: int) -> None:
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.tokens = self.capacity
+        self._updated = time.monotonic()
+
+    @property
+    def enabled(self) -> bool:
+        return self.capacity > 0
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(
+            self.capacity, self.tokens + (now - self._updated) * self.rate
+        )
+        self._updated = now
+
+    def wait_time(self, amount: float) -> float:
+        if not self.enabled:
+            return 0.0
+        self._refill()
+        # a request larger than the whole budget waits only for a full bucket
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def take(self, amount: float) -> None:
+        if self.enabled:
+            self._refill()
+            self.tokens = min(max(self.tokens - amount, -self.capacity), self.capacity)
+
+
+def parse_retry_hint(
+    headers: Mapping[str, str], data: Optional[dict]
+) -> Optional[float]:
+    """
+    Seconds the server asks us to wait, from `Retry-After` header or
+    `google.rpc.RetryInfo` in the error body.
+
+    :return: delay in seconds or None
+    """
+    retry_after = headers.get("Retry-After")
+    if retry_after:
+        try:
+            return max(float(retry_after), 0.0)
+        except ValueError:
+            try:
+                retry_at = parsedate_to_datetime(retry_after)
+                return max((retry_at - datetime.now(timezone.utc)).total_seconds(), 0.0)
+            except (TypeError, ValueError):
+                pass
+
+    if isinstance(data, dict):
+        details = (data.get("error") or {}).get("details") or []
+        for detail in details:
+            if not isinstance(detail, dict):
+                continue
+            if detail.get("@type", "").endswith("google.rpc.RetryInfo"):
+                match = re.fullmatch(r"([\d.]+)s", str(detail.get("retryDelay", "")))
+                if match:
+                    return float(match.group(1))
+    return None
+
+
+class GeminiAdmissionController:
+    """
+    Process-wide admission control of Gemini calls.
+
+    - requests-per-minute and tokens-per-minute token buckets, the token estimate
+      taken before a call is reconciled with `usageMetadata` afterwards
+    - server retry hints pause admission of all callers, not only the one that got them
+    - jittered exponential backoff honoring server hints
+    - circuit breaker failing fast while the upstream is unhealthy
+    """
+
+    def __init__(
+        self,
+        rpm_limit: int,
+        tpm_limit: int,
+        backoff_base: float,
+        backoff_max: float,
+        max_admission_wait: float,
+        failure_threshold: int,
+        open_seconds: float,
+    ) -> None:
+        self.requests = TokenBucket(rpm_limit)
+        self.tokens = TokenBucket(tpm_limit)
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.max_admission_wait = max_admission_wait
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+
+        self._lock = asyncio.Lock()
+        self._state = CircuitState.CLOSED
+        self._opened_at = 0.0
+        # start of the half-open probe, a probe never settled (cancelled by hedging,
+        # a section deadline or a failed sibling) expires after `open_seconds`
+        self._probe_started_at: Optional[float] = None
+        self._consecutive_failures = 0
+        self._paused_until = 0.0
+
+        self.admitted = 0
+        self.rejected = 0
+        self.throttled_seconds = 0.0
+        self.failures = 0
+        self.circuit_opened = 0
+        self.last_retry_hint: Optional[float] = None
+
+    @property
+    def state(self) -> CircuitState:
+        if (
+            self._state == CircuitState.OPEN
+            and time.monotonic() - self._opened_at >= self.open_seconds
+        ):
+            self._state = CircuitState.HALF_OPEN
+            self._probe_started_at = None
+        return self._state
+
+    @property
+    def _probe_in_flight(self) -> bool:
+        return (
+            self._probe_started_at is not None
+            and time.monotonic() - self._probe_started_at < self.open_seconds
+        )
+
+    def _check_circuit(self) -> None:
+        state = self.state
+        if state == CircuitState.OPEN or (
+            state == CircuitState.HALF_OPEN and self._probe_in_flight
+        ):
+            self.rejected += 1
+            raise GeminiUnavailableError("Gemini circuit breaker is open")
+
+    async def acquire(self, estimated_tokens: int) -> None:
+        """
+        Wait until the call fits into the budgets, raises `GeminiUnavailableError`
+        when the circuit is open or the wait would be too long
+        """
+        self._check_circuit()
+        waited = 0.0
+        async with self._lock:
+            while True:
+                self._check_circuit()
+                wait = max(
+                    self.requests.wait_time(1),
+                    self.tokens.wait_time(estimated_tokens),
+                    self._paused_until - time.monotonic(),
+                )
+                if wait <= 0:
+                    break
+                if waited + wait > self.max_admission_wait:
+                    self.rejected += 1
+                    raise GeminiUnavailableError(
+                        f"Gemini admission would wait {waited + wait:.1f}s"
+                    )
+                await asyncio.sleep(wait)
+                waited += wait
+                self.throttled_seconds += wait
+
+            self.requests.take(1)
+            self.tokens.take(estimated_tokens)
+            if self.state == CircuitState.HALF_OPEN:
+                self._probe_started_at = time.monotonic()
+            self.admitted += 1
+
+    def record_success(self, estimated_tokens: int, used_tokens: int) -> None:
+        # settle the estimate with the real usage reported by the API
+        self.tokens.take(used_tokens - estimated_tokens)
+        self._consecutive_failures = 0
+        self._probe_started_at = None
+        if self._state != CircuitState.CLOSED:
+            logger.info("Gemini circuit breaker closed")
+        self._state = CircuitState.CLOSED
+
+    def record_failure(
+        self, retry_hint: Optional[float] = None, count: bool = True
+    ) -> None:
+        """
+        Record failed call, `count=False` for errors not caused by upstream health
+        (e.g. 400 Bad Request)
+        """
+        self._probe_started_at = None
+        if retry_hint is not None:
+            self.last_retry_hint = retry_hint
+            self._paused_until = max(self._paused_until, time.monotonic() + retry_hint)
+        if not count:
+            return
+
+        self.failures += 1
+        self._consecutive_failures += 1
+        if self._state == CircuitState.HALF_OPEN or (
+            self._state == CircuitState.CLOSED
+            and self._consecutive_failures >= self.failure_threshold
+        ):
+            self._state = CircuitState.OPEN
+            self._opened_at = time.monotonic()
+            self.circuit_opened += 1
+            logger.warning(
+                f"Gemini circuit breaker opened after {self._consecutive_failures} failures"
+            )
+
+    def backoff_delay(self, attempt: int, retry_hint: Optional[float] = None) -> float:
+        """
+        Delay before next attempt - server hint if present, otherwise exponential
+        backoff with full jitter
+
+        :return: delay in seconds
+        """
+        if retry_hint is not None:
+            return min(
+                retry_hint + random.uniform(0, self.backoff_base), self.backoff_max
+            )
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2**attempt))
+
+    def stats(self) -> dict:
+        return {
+            "circuit_state": self.state,
+            "consecutive_failures": self._consecutive_failures,
+            "paused_for_seconds": round(
+                max(self._paused_until - time.monotonic(), 0.0), 3
+            ),
+            "requests_budget": (
+                round(self.requests.tokens, 1) if self.requests.enabled else None
+            ),
+            "tokens_budget": (
+                round(self.tokens.tokens, 1) if self.tokens.enabled else None
+            ),
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "throttled_seconds": round(self.throttled_seconds, 3),
+            "failures": self.failures,
+            "circuit_opened": self.circuit_opened,
+            "last_retry_hint": self.last_retry_hint,
+        }
+
+
+GEMINI_ADMISSION = GeminiAdmissionController(
+    rpm_limit=SERVER_SETTINGS.GEMINI_RPM_LIMIT,
+    tpm_limit=SERVER_SETTINGS.GEMINI_TPM_LIMIT,
+    backoff_base=SERVER_SETTINGS.GEMINI_BACKOFF_BASE,
+    backoff_max=SERVER_SETTINGS.GEMINI_BACKOFF_MAX,
+    max_admission_wait=SERVER_SETTINGS.GEMINI_MAX_ADMISSION_WAIT,
+    failure_threshold=SERVER_SETTINGS.GEMINI_CIRCUIT_FAILURE_THRESHOLD,
+    open_seconds=SERVER_SETTINGS.GEMINI_CIRCUIT_OPEN_SECONDS,
+)
+
+
+def estimate_tokens(prompt: str) -> int:
+    """Rough token estimate of a call before it is sent (prompt + expected output)."""
+    return len(prompt) // 4 + SERVER_SETTINGS.GEMINI_ESTIMATED_OUTPUT_TOKENS
@@ -0,0 +1,70 @@
+import asyncio
+import json
+from typing import AsyncIterator
+
+import aiohttp
+
+from app.config import SERVER_SETTINGS
+
+GEMINI_DEFAULT_MODEL = "gemini-2.5-flash-lite"
+
+
+def gemini_base_url() -> str:
+    """
+    Base of the Gemini REST API derived from `GEMINI_API_URL`,
+    e.g. `https://generativelanguage.googleapis.com/v1beta`
+
+    :return: base URL without trailing slash
+    """
+    url = SERVER_SETTINGS.GEMINI_API_URL
+    if "/models/" in url:
+        return url.split("/models/", 1)[0]
+    return url.rstrip("/")
+
+
+def gemini_model() -> str:
+    """
+    Model configured in `GEMINI_API_URL`
+
+    :return: model id without the `models/` prefix
+    """
+    url = SERVER_SETTINGS.GEMINI_API_URL
+    if "/models/" not in url:
+        return GEMINI_DEFAULT_MODEL
+    return url.split("/models/", 1)[1].split(":", 1)[0]
+
+
+def gemini_model_url(model: str, method: str = "generateContent") -> str:
+    return f"{gemini_base_url()}/models/{model}:{method}"
+
+
+def gemini_headers() -> dict[str, str]:
+    return {
+        "Content-Type": "application/json",
+        "x-goog-api-key": SERVER_SETTINGS.GEMINI_API_KEY,
+    }
+
+
+async def iter_stream_chunks(
+    response: aiohttp.ClientResponse, chunk_timeout: float
+) -> AsyncIterator[dict]:
+    """
+    Parses Server-Sent Events of `streamGenerateContent?alt=sse`, raises
+    `asyncio.TimeoutError` when no line arrives within `chunk_timeout` seconds
+
+    :return: iterator of `GenerateContentResponse` chunks
+    """
+    data_lines: list[str] = []
+    while True:
+        line = await asyncio.wait_for(response.content.readline(), chunk_timeout)
+        if not line:
+            break
+        line = line.decode("utf-8").rstrip("\r\n")
+        if line.startswith("data:"):
+            data_lines.append(line[5:].strip())
+        elif not line and data_lines:
+            yield json.loads("\n".join(data_lines))
+            data_lines = []
+
+    if data_lines:
+        yield json.loads("\n".join(data_lines))
@@ -0,0 +1,477 @@
+"""
+Bulk section generation with the Gemini Batch API
+(https://ai.google.dev/gemini-api/docs/batch-mode).
+
+Section prompts of many horoscopes are sent as inlined requests of
+`batchGenerateContent` jobs - one job per model and at most `GEMINI_BATCH_MAX_REQUESTS`
+requests - and the jobs are polled until they finish. Batch tokens are cheaper and
+do not count against the interactive rate limits, but a job may take hours, so the
+batch mode is meant for offline workloads only (`python -m app.batch --gemini-batch-size`).
+"""
+
+import asyncio
+import time
+import uuid
+from typing import Optional
+
+import aiohttp
+from loguru import logger
+from pydantic import BaseModel
+
+from app.config import SERVER_SETTINGS
+from app.models.horoscop import ContentResponse, HoroscopeState, PromptObj
+from app.utils.gemini_admission import GEMINI_ADMISSION, parse_retry_hint
+from app.utils.gemini_api import gemini_base_url, gemini_headers, gemini_model_url
+from app.utils.horoscope_process import (
+    build_base_prompt,
+    build_gemini_payload,
+    build_sign_prompt,
+    collect_results,
+    enrich_state,
+    generate_section,
+    input_validator,
+)
+from app.utils.metrics import GEMINI_BATCH_JOB_SECONDS
+from app.utils.model_router import MODEL_ROUTER
+from app.utils.section_cache import SECTION_CACHE, section_cache_key
+
+TERMINAL_STATES = {"SUCCEEDED", "FAILED", "CANCELLED", "EXPIRED"}
+
+
+class GeminiBatchFailed(Exception):
+    """Batch job could not be submitted or did not succeed."""
+
+
+class BatchSection(BaseModel):
+    """Section prompt of one horoscope of the batch."""
+
+    id: str
+    state_index: int
+    key: str
+    model: str
+    prompt: str
+    cache_key: Optional[str] = None
+
+
+def batch_state(operation: dict) -> str:
+    """
+    State of the batch operation without its prefix,
+    `BATCH_STATE_SUCCEEDED` (REST) or `JOB_STATE_SUCCEEDED` (SDK) -> `SUCCEEDED`
+    """
+    if operation.get("error"):
+        return "FAILED"
+    state = str((operation.get("metadata") or {}).get("state", ""))
+    if not state:
+        return "SUCCEEDED" if operation.get("done") else "PENDING"
+    return state.rsplit("_STATE_", 1)[-1]
+
+
+def inlined_responses(operation: dict) -> list[dict]:
+    """Responses of a finished job, in the order of its requests."""
+    output = (
+        operation.get("response")
+        or (operation.get("metadata") or {}).get("output")
+        or {}
+    )
+    responses = output.get("inlinedResponses") or []
+    if isinstance(responses, dict):
+        responses = responses.get("inlinedResponses") or []
+    return responses
+
+
+class GeminiBatchGenerator:
+    """
+    Generates sections of many horoscopes in Gemini batch jobs.
+
+    - sections served by the sign-level section cache are not requested
+    - jobs of different models and chunks run at the same time
+    - sections failed in a job are generated by interactive calls
+      with `GEMINI_BATCH_RETRY_INTERACTIVE`
+    """
+
+    def __init__(self, max_requests: int, poll_interval: float, timeout: float) -> None:
+        self.max_requests = max_requests
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+
+        # job name -> last known state
+        self._active: dict[str, str] = {}
+
+        self.jobs_submitted = 0
+        self.jobs_succeeded = 0
+        self.jobs_failed = 0
+        self.requests = 0
+        self.failed_requests = 0
+        self.cached_sections = 0
+        self.interactive_retries = 0
+        self.polls = 0
+        self.input_tokens = 0
+        self.output_tokens = 0
+
+    async def generate(
+        self, session: aiohttp.ClientSession, states: list[HoroscopeState]
+    ) -> list[HoroscopeState]:
+        """
+        Validates and enriches the states and generates all their sections
+
+        :return: states with the generated sections, or with `error`
+        """
+        prompts: list[dict[str, PromptObj]] = []
+        base_prompts: list[str] = []
+        sections: list[BatchSection] = []
+        responses: dict[str, ContentResponse] = {}
+
+        for index, state in enumerate(states):
+            state = enrich_state(input_validator(state))
+            prompts_to_run = {} if state.error else state.horoscope_type.get_prompts()
+            if not state.error and not prompts_to_run:
+                state.error = "Neznámý typ horoskopu."
+            prompts.append(prompts_to_run)
+            base_prompts.append(build_base_prompt(state) if prompts_to_run else "")
+
+            for key, data in prompts_to_run.items():
+                section = await self._section(
+                    state, index, key, data, base_prompts[index], responses
+                )
+                if section is not None:
+                    sections.append(section)
+
+        jobs: dict[str, list[BatchSection]] = {}
+        for section in sections:
+            jobs.setdefault(section.model, []).append(section)
+        results = await asyncio.gather(
+            *(
+                self._run_job(session, model, chunk[i : i + self.max_requests])
+                for model, chunk in jobs.items()
+                for i in range(0, len(chunk), self.max_requests)
+            )
+        )
+        for result in results:
+            responses.update(result)
+
+        # batch results are paid for already, cached before anything else can fail
+        for section in sections:
+            response = responses[section.id]
+            if section.cache_key and response.batch and not response.error:
+                await SECTION_CACHE.put(section.cache_key, response)
+
+        failed = [section for section in sections if responses[section.id].error]
+        if failed and SERVER_SETTINGS.GEMINI_BATCH_RETRY_INTERACTIVE:
+            logger.warning(
+                f"{len(failed)} sections failed in Gemini batch jobs, "
+                "generating them by interactive calls."
+            )
+            self.interactive_retries += len(failed)
+            retried = await asyncio.gather(
+                *(
+                    generate_section(
+                        session,
+                        states[section.state_index],
+                        section.key,
+                        prompts[section.state_index][section.key],
+                        base_prompts[section.state_index],
+                    )
+                    for section in failed
+                ),
+                return_exceptions=True,
+            )
+            for section, response in zip(failed, retried):
+                if isinstance(response, BaseException):
+                    logger.error(
+                        f"Interactive retry of section '{section.id}' failed: {response!r}"
+                    )
+                    response = ContentResponse(
+                        key=section.key, error="Nepodařilo se vygenerovat odpověď."
+                    )
+                responses[section.id] = response
+
+        return [
+            collect_results(
+                state,
+                prompts[index],
+                [responses[f"{index}/{key}"] for key in prompts[index]],
+            )
+            for index, state in enumerate(states)
+        ]
+
+    async def _section(
+        self,
+        state: HoroscopeState,
+        index: int,
+        key: str,
+        data: PromptObj,
+        base_prompt: str,
+        responses: dict[str, ContentResponse],
+    ) -> Optional[BatchSection]:
+        """
+        Request of the section, sections found in the section cache go to `responses`
+
+        :return: section to request or None
+        """
+        section_id = f"{index}/{key}"
+        model = MODEL_ROUTER.candidates(key)[0]
+        cacheable = (
+            SECTION_CACHE.enabled
+            and state.zodiac is not None
+            and state.astro_number is not None
+            and key not in SERVER_SETTINGS.SECTION_CACHE_PERSONALIZED_KEYS
+        )
+        if not cacheable:
+            return BatchSection(
+                id=section_id,
+                state_index=index,
+                key=key,
+                model=model,
+                prompt=f"{base_prompt} {data.prompt}",
+            )
+
+        cache_key = section_cache_key(
+            state.zodiac,
+            state.astro_number,
+            key,
+            data.prompt,
+            MODEL_ROUTER.routed_model(key),
+        )
+        cached = await SECTION_CACHE.get(cache_key, key)
+        if cached is not None:
+            self.cached_sections += 1
+            responses[section_id] = cached
+            return None
+        return BatchSection(
+            id=section_id,
+            state_index=index,
+            key=key,
+            model=model,
+            prompt=f"{build_sign_prompt(state)} {data.prompt}",
+            cache_key=cache_key,
+        )
+
+    async def _run_job(
+        self,
+        session: aiohttp.ClientSession,
+        model: str,
+        sections: list[BatchSection],
+    ) -> dict[str, ContentResponse]:
+        """
+        Submits the sections as one job and waits for it
+
+        :return: response of every section by its id, errors included
+        """
+        started_at = time.perf_counter()
+        state = "FAILED"
+        try:
+            operation = await self._submit(session, model, sections)
+            operation = await self._wait(session, operation)
+            state = "SUCCEEDED"
+        except GeminiBatchFailed as err:
+            self.jobs_failed += 1
+            logger.error(str(err))
+            return {
+                section.id: ContentResponse(
+                    key=section.key, error=f"Dávkové generování selhalo: {err}"
+                )
+                for section in sections
+            }
+        finally:
+            GEMINI_BATCH_JOB_SECONDS.observe(
+                time.perf_counter() - started_at, state=state
+            )
+
+        self.jobs_succeeded += 1
+        items: dict[str, dict] = {}
+        for position, item in enumerate(inlined_responses(operation)):
+            section_id = (item.get("metadata") or {}).get("key")
+            if section_id is None and position < len(sections):
+                section_id = sections[position].id
+            items[section_id] = item
+
+        await self._delete(session, operation["name"])
+        return {
+            section.id: self._content_response(section, model, items.get(section.id))
+            for section in sections
+        }
+
+    def _content_response(
+        self, section: BatchSection, model: str, item: Optional[dict]
+    ) -> ContentResponse:
+        if item is None or "response" not in item:
+            self.failed_requests += 1
+            message = (item or {}).get("error", {}).get("message", "missing response")
+            return ContentResponse(
+                key=section.key, error=f"Dávkový požadavek selhal: {message}"
+            )
+
+        data: dict = item["response"]
+        text_content = "".join(
+            part.get("text", "")
+            for part in (data.get("candidates") or [{}])[0]
+            .get("content", {})
+            .get("parts", [])
+        )
+        if not text_content:
+            self.failed_requests += 1
+            return ContentResponse(
+                key=section.key, error="Nepodařilo se vygenerovat odpověď."
+            )
+
+        usage_metadata: dict = data.get("usageMetadata", {})
+        input_tokens = usage_metadata.get("promptTokenCount", 0)
+        output_tokens = usage_metadata.get("candidatesTokenCount", 0)
+        self.input_tokens += input_tokens
+        self.output_tokens += output_tokens
+        return ContentResponse(
+            key=section.key,
+            content=text_content,
+            input_tokens=input_tokens,
+            output_tokens=output_tokens,
+            batch=True,
+            model=model,
+        )
+
+    async def _submit(
+        self,
+        session: aiohttp.ClientSession,
+        model: str,
+        sections: list[BatchSection],
+    ) -> dict:
+        payload = {
+            "batch": {
+                "displayName": f"horoscope-sections-{uuid.uuid4().hex[:12]}",
+                "inputConfig": {
+                    "requests": {
+                        "requests": [
+                            {
+                                "request": build_gemini_payload(section.prompt),
+                                "metadata": {"key": section.id},
+                            }
+                            for section in sections
+                        ]
+                    }
+                },
+            }
+        }
+        operation = await self._call(
+            session, "POST", gemini_model_url(model, "batchGenerateContent"), payload
+        )
+        self.jobs_submitted += 1
+        self.requests += len(sections)
+        logger.info(
+            f"Submitted Gemini batch job {operation['name']} of {len(sections)} "
+            f"sections for {model}"
+        )
+        return operation
+
+    async def _wait(self, session: aiohttp.ClientSession, operation: dict) -> dict:
+        """
+        Polls the job until it ends, a job running longer than `timeout` is cancelled
+
+        :return: operation of the succeeded job
+        """
+        name = operation["name"]
+        deadline = time.monotonic() + self.timeout
+        try:
+            while (state := batch_state(operation)) not in TERMINAL_STATES:
+                self._active[name] = state
+                if time.monotonic() > deadline:
+                    await self.cancel(session, name)
+                    raise GeminiBatchFailed(
+                        f"Gemini batch job {name} did not finish in {self.timeout:.0f}s"
+                    )
+                await asyncio.sleep(self.poll_interval)
+                self.polls += 1
+                try:
+                    operation = await self._call(
+                        session, "GET", f"{gemini_base_url()}/{name}"
+                    )
+                except GeminiBatchFailed as err:
+                    logger.warning(f"Polling Gemini batch job {name} failed: {err}")
+        except asyncio.CancelledError:
+            await asyncio.shield(self.cancel(session, name))
+            raise
+        finally:
+            self._active.pop(name, None)
+
+        if state != "SUCCEEDED":
+            raise GeminiBatchFailed(
+                f"Gemini batch job {name} ended in state {state}: "
+                f"{operation.get('error')}"
+            )
+        logger.info(f"Gemini batch job {name} succeeded")
+        return operation
+
+    async def cancel(self, session: aiohttp.ClientSession, name: str) -> None:
+        try:
+            await self._call(session, "POST", f"{gemini_base_url()}/{name}:cancel", {})
+        except GeminiBatchFailed as err:
+            logger.warning(f"Cancelling Gemini batch job {name} failed: {err}")
+
+    async def _delete(self, session: aiohttp.ClientSession, name: str) -> None:
+        # results are read, the job would be kept by the API for days otherwise
+        try:
+            await self._call(session, "DELETE", f"{gemini_base_url()}/{name}")
+        except GeminiBatchFailed as err:
+            logger.debug(f"Deleting Gemini batch job {name} failed: {err}")
+
+    async def _call(
+        self,
+        session: aiohttp.ClientSession,
+        method: str,
+        url: str,
+        payload: Optional[dict] = None,
+    ) -> dict:
+        """
+        REST call of the batch API, rate limiting and server errors are retried
+
+        :return: response body
+        """
+        for attempt in range(SERVER_SETTINGS.REQUEST_RETRY_COUNT):
+            retry_hint = None
+            try:
+                async with session.request(
+                    method, url, headers=gemini_headers(), json=payload
+                ) as response:
+                    try:
+                        data: dict = await response.json(content_type=None)
+                    except ValueError:
+                        data = {"error": {"message": await response.text()}}
+                    if response.status == 200:
+                        return data or {}
+
+                    error = f"status {response.status}: {str(data)[:200]}"
+                    if response.status != 429 and response.status < 500:
+                        raise GeminiBatchFailed(f"{method} {url} failed with {error}")
+                    retry_hint = parse_retry_hint(response.headers, data)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as err:
+                error = repr(err)
+
+            if attempt < SERVER_SETTINGS.REQUEST_RETRY_COUNT - 1:
+                delay = GEMINI_ADMISSION.backoff_delay(attempt, retry_hint)
+                logger.warning(
+                    f"{method} {url} failed with {error}. "
+                    f"Retrying in {delay:.1f} seconds..."
+                )
+                await asyncio.sleep(delay)
+
+        raise GeminiBatchFailed(f"{method} {url} failed with {error}")
+
+    def stats(self) -> dict:
+        return {
+            "active_jobs": dict(self._active),
+            "jobs_submitted": self.jobs_submitted,
+            "jobs_succeeded": self.jobs_succeeded,
+            "jobs_failed": self.jobs_failed,
+            "requests": self.requests,
+            "failed_requests": self.failed_requests,
+            "cached_sections": self.cached_sections,
+            "interactive_retries": self.interactive_retries,
+            "polls": self.polls,
+            "input_tokens": self.input_tokens,
+            "output_tokens": self.output_tokens,
+        }
+
+
+GEMINI_BATCH = GeminiBatchGenerator(
+    max_requests=SERVER_SETTINGS.GEMINI_BATCH_MAX_REQUESTS,
+    poll_interval=SERVER_SETTINGS.GEMINI_BATCH_POLL_INTERVAL,
+    timeout=SERVER_SETTINGS.GEMINI_BATCH_TIMEOUT,
+)
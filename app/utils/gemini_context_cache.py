@@ -0,0 +1,265 @@
+import asyncio
+import math
+import time
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import AsyncIterator, Optional
+
+import aiohttp
+from loguru import logger
+from pydantic import BaseModel
+
+from app.config import SERVER_SETTINGS
+from app.models.horoscop import SYSTEM_PROMPT, HoroscopeType
+from app.utils.gemini_api import gemini_base_url, gemini_headers
+
+
+class CachedContentRejected(Exception):
+    """Gemini refused the referenced cached content (expired, deleted or invalid)."""
+
+    def __init__(self, name: str) -> None:
+        super().__init__(f"Cached content {name} was rejected")
+        self.name = name
+
+
+class CachedContentHandle(BaseModel):
+    name: str
+    model: str
+    expires_at: float
+
+
+# per-request prefix cache active for the current generation (base prompt, handle)
+ACTIVE_PREFIX: ContextVar[Optional[tuple[str, CachedContentHandle]]] = ContextVar(
+    "gemini_active_prefix", default=None
+)
+
+
+class GeminiContextCache:
+    """
+    Manages Gemini cached contents (https://ai.google.dev/api/caching).
+
+    - the static system instruction is cached once per model and reused by every
+      section call until shortly before it expires
+    - optionally the per-request prefix (system instruction + personal base prompt)
+      is cached for the duration of one generation, section calls then send only
+      the section prompt
+
+    Contents below `min_tokens` are not cached, the API refuses them anyway.
+    """
+
+    def __init__(
+        self, ttl: int, prefix_ttl: int, min_tokens: int, refresh_margin: int = 60
+    ) -> None:
+        self.ttl = ttl
+        self.prefix_ttl = prefix_ttl
+        self.min_tokens = min_tokens
+        self.refresh_margin = refresh_margin
+
+        self._system: dict[str, CachedContentHandle] = {}
+        self._system_disabled_until: dict[str, float] = {}
+        self._lock = asyncio.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.created = 0
+        self.create_failures = 0
+        self.skipped_small = 0
+        self.invalidated = 0
+        self.deleted = 0
+        self.cached_tokens = 0
+
+    @property
+    def enabled(self) -> bool:
+        return SERVER_SETTINGS.GEMINI_CONTEXT_CACHE_ENABLED
+
+    def _valid(self, handle: Optional[CachedContentHandle]) -> bool:
+        return (
+            handle is not None
+            and handle.expires_at - self.refresh_margin > time.monotonic()
+        )
+
+    def _too_small(self, contents: list[dict]) -> bool:
+        # the API refuses contents below the minimal token count of the model
+        text = SYSTEM_PROMPT + "".join(
+            part.get("text", "") for c in contents for part in c["parts"]
+        )
+        return len(text) // 4 < self.min_tokens
+
+    async def _create(
+        self,
+        session: aiohttp.ClientSession,
+        model: str,
+        contents: list[dict],
+        ttl: int,
+    ) -> Optional[CachedContentHandle]:
+        if self._too_small(contents):
+            self.skipped_small += 1
+            return None
+
+        payload = {
+            "model": f"models/{model}",
+            "systemInstruction": {"parts": [{"text": SYSTEM_PROMPT}]},
+            "ttl": f"{ttl}s",
+        }
+        if contents:
+            payload["contents"] = contents
+
+        try:
+            async with session.post(
+                f"{gemini_base_url()}/cachedContents",
+                headers=gemini_headers(),
+                json=payload,
+            ) as response:
+                data: dict = await response.json(content_type=None)
+                if response.status != 200:
+                    self.create_failures += 1
+                    logger.warning(
+                        f"Creating Gemini cached content failed with status {response.status}: "
+                        f"{str(data)[:200]}"
+                    )
+                    return None
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as err:
+            self.create_failures += 1
+            logger.warning(f"Creating Gemini cached content failed: {err!r}")
+            return None
+
+        self.created += 1
+        return CachedContentHandle(
+            name=data["name"], model=model, expires_at=time.monotonic() + ttl
+        )
+
+    async def delete(self, session: aiohttp.ClientSession, name: str) -> None:
+        try:
+            async with session.delete(
+                f"{gemini_base_url()}/{name}", headers=gemini_headers()
+            ) as response:
+                if response.status == 200:
+                    self.deleted += 1
+        except (aiohttp.ClientError, asyncio.TimeoutError) as err:
+            logger.debug(f"Deleting Gemini cached content {name} failed: {err!r}")
+
+    async def system_instruction(
+        self, session: aiohttp.ClientSession, model: str
+    ) -> Optional[str]:
+        """
+        Name of the cached system instruction for the model, created on first use
+
+        :return: cached content name or None when caching is not possible
+        """
+        if not self.enabled:
+            return None
+
+        handle = self._system.get(model)
+        if self._valid(handle):
+            self.hits += 1
+            return handle.name
+
+        if self._system_disabled_until.get(model, 0.0) > time.monotonic():
+            self.misses += 1
+            return None
+
+        async with self._lock:
+            handle = self._system.get(model)
+            if not self._valid(handle):
+                handle = await self._create(session, model, [], self.ttl)
+                if handle is None:
+                    # static prompt - too small now means too small until restart,
+                    # a failed request is tried again later
+                    self._system_disabled_until[model] = (
+                        math.inf if self._too_small([]) else time.monotonic() + 300
+                    )
+                    self._system.pop(model, None)
+                    self.misses += 1
+                    return None
+                self._system[model] = handle
+
+        self.hits += 1
+        return handle.name
+
+    def invalidate(self, name: str) -> None:
+        """
+        Forget cached content refused by the API (expired or deleted)
+        """
+        self.invalidated += 1
+        for model, handle in list(self._system.items()):
+            if handle.name == name:
+                del self._system[model]
+
+    @asynccontextmanager
+    async def request_prefix(
+        self,
+        session: aiohttp.ClientSession,
+        model: str,
+        horoscope_type: HoroscopeType,
+        base_prompt: str,
+    ) -> AsyncIterator[None]:
+        """
+        Cache system instruction with the personal base prompt for the duration
+        of one generation, when enabled for the horoscope type
+        """
+        if (
+            not self.enabled
+            or horoscope_type.value
+            not in SERVER_SETTINGS.GEMINI_CONTEXT_CACHE_PREFIX_TYPES
+        ):
+            yield
+            return
+
+        handle = await self._create(
+            session,
+            model,
+            [{"role": "user", "parts": [{"text": base_prompt}]}],
+            self.prefix_ttl,
+        )
+        if handle is None:
+            self.misses += 1
+            yield
+            return
+
+        token = ACTIVE_PREFIX.set((base_prompt, handle))
+        try:
+            yield
+        finally:
+            ACTIVE_PREFIX.reset(token)
+            await self.delete(session, handle.name)
+
+    def active_prefix(self, base_prompt: str, model: str) -> Optional[str]:
+        """
+        Name of the prefix cache of the running generation
+
+        :return: cached content name or None
+        """
+        active = ACTIVE_PREFIX.get()
+        if active is None:
+            return None
+        prefix, handle = active
+        if prefix != base_prompt or handle.model != model or not self._valid(handle):
+            return None
+        self.hits += 1
+        return handle.name
+
+    def record_usage(self, usage_metadata: dict) -> None:
+        self.cached_tokens += usage_metadata.get("cachedContentTokenCount", 0)
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "system_caches": {
+                model: handle.name for model, handle in self._system.items()
+            },
+            "hits": self.hits,
+            "misses": self.misses,
+            "created": self.created,
+            "create_failures": self.create_failures,
+            "skipped_small": self.skipped_small,
+            "invalidated": self.invalidated,
+            "deleted": self.deleted,
+            "cached_tokens": self.cached_tokens,
+        }
+
+
+GEMINI_CONTEXT_CACHE = GeminiContextCache(
+    ttl=SERVER_SETTINGS.GEMINI_CONTEXT_CACHE_TTL,
+    prefix_ttl=SERVER_SETTINGS.GEMINI_CONTEXT_CACHE_PREFIX_TTL,
+    min_tokens=SERVER_SETTINGS.GEMINI_CONTEXT_CACHE_MIN_TOKENS,
+)
@@ -0,0 +1,131 @@
+import asyncio
+from typing import Awaitable, Callable, Optional
+
+from loguru import logger
+
+from app.config import SERVER_SETTINGS
+from app.models.horoscop import ContentResponse
+from app.utils.model_router import MODEL_ROUTER, latency_key
+
+
+class HedgingPolicy:
+    """
+    Hedged Gemini calls - when a call runs longer than the `percentile` of recent
+    latencies of its model, a second identical call is sent, the first successful one
+    wins and the other is cancelled.
+
+    Extra calls are bounded by `budget`: every call earns `budget` credits (up to
+    `max_credits`), a hedge costs one credit. Latencies and credits are kept per kind
+    of call, a slow structured call neither delays nor pays for hedges of sections.
+    """
+
+    def __init__(
+        self,
+        percentile: float,
+        min_delay: float,
+        budget: float,
+        max_credits: float = 10.0,
+    ) -> None:
+        self.percentile = percentile
+        self.min_delay = min_delay
+        self.budget = budget
+        self.max_credits = max_credits
+        self._credits: dict[str, float] = {}
+
+        self.calls = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.budget_exhausted = 0
+
+    @property
+    def enabled(self) -> bool:
+        return SERVER_SETTINGS.GEMINI_HEDGING_ENABLED
+
+    def delay(self, model: str, kind: str = "section") -> Optional[float]:
+        """
+        Time after which the call of the model is hedged
+
+        :return: seconds or None while there are not enough latency samples
+        """
+        key = latency_key(model, kind)
+        if MODEL_ROUTER.samples(key) < MODEL_ROUTER.min_samples:
+            return None
+        return max(MODEL_ROUTER.percentile(key, self.percentile), self.min_delay)
+
+    def _take_credit(self, kind: str) -> bool:
+        if self._credits[kind] < 1.0:
+            self.budget_exhausted += 1
+            return False
+        self._credits[kind] -= 1.0
+        return True
+
+    async def run(
+        self,
+        model: str,
+        call: Callable[[bool], Awaitable[ContentResponse]],
+        kind: str = "section",
+    ) -> ContentResponse:
+        """
+        Run `call(True)`, hedged by `call(False)` when it is slow
+
+        :return: response of the first call finished without error
+        """
+        if not self.enabled:
+            return await call(True)
+
+        self.calls += 1
+        self._credits[kind] = min(
+            self._credits.get(kind, 0.0) + self.budget, self.max_credits
+        )
+
+        delay = self.delay(model, kind)
+        if delay is None:
+            return await call(True)
+
+        primary = asyncio.create_task(call(True))
+        pending: set[asyncio.Task] = {primary}
+        try:
+            done, pending = await asyncio.wait(pending, timeout=delay)
+            if done or not self._take_credit(kind):
+                return await primary
+
+            self.hedges += 1
+            logger.debug(f"Hedging call of {model} after {delay:.2f}s")
+            pending.add(asyncio.create_task(call(False)))
+
+            fallback: Optional[asyncio.Task] = None
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    if task.exception() is None and task.result().error is None:
+                        if task is not primary:
+                            self.hedge_wins += 1
+                        return task.result()
+                    fallback = fallback or task
+
+            # neither call succeeded, report the first failure
+            return fallback.result()
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "calls": self.calls,
+            "hedges": self.hedges,
+            "hedge_rate": round(self.hedges / self.calls, 4) if self.calls else 0.0,
+            "hedge_wins": self.hedge_wins,
+            "win_rate": round(self.hedge_wins / self.hedges, 4) if self.hedges else 0.0,
+            "budget_exhausted": self.budget_exhausted,
+            "credits": {kind: round(c, 2) for kind, c in self._credits.items()},
+        }
+
+
+HEDGING = HedgingPolicy(
+    percentile=SERVER_SETTINGS.GEMINI_HEDGING_PERCENTILE,
+    min_delay=SERVER_SETTINGS.GEMINI_HEDGING_MIN_DELAY,
+    budget=SERVER_SETTINGS.GEMINI_HEDGING_BUDGET,
+)
@@ -1,29 +1,76 @@
 import asyncio
+import functools
+import inspect
 import json
+import time
+from contextlib import asynccontextmanager
 from datetime import datetime
-from typing import List
+from typing import AsyncIterator, Callable, List, Optional
 
 import aiohttp
-from langgraph.graph import END, StateGraph
 from loguru import logger
 
 from app.config import SERVER_SETTINGS
 from app.models.horoscop import (
     BASE_PROMPT_TEMPLATE,
+    SIGN_PROMPT_TEMPLATE,
     SYSTEM_PROMPT,
     ContentResponse,
     HoroscopeState,
     HoroscopeType,
+    PromptObj,
 )
+from app.utils.gemini_admission import (
+    GEMINI_ADMISSION,
+    estimate_tokens,
+    parse_retry_hint,
+)
+from app.utils.gemini_api import (
+    gemini_headers,
+    gemini_model,
+    gemini_model_url,
+    iter_stream_chunks,
+)
+from app.utils.gemini_context_cache import (
+    GEMINI_CONTEXT_CACHE,
+    CachedContentRejected,
+)
+from app.utils.hedging import HEDGING
 from app.utils.helper import (
     astrological_number,
     get_zodiac,
     validate_dob,
     validate_name,
 )
+from app.utils.http import GEMINI_CLIENT
+from app.utils.metrics import (
+    GEMINI_ATTEMPTS,
+    GEMINI_RETRIES,
+    NODE_SECONDS,
+    SECTION_SECONDS,
+    timed,
+)
+from app.utils.model_router import (
+    MODEL_FALLBACK_STATUSES,
+    MODEL_ROUTER,
+    GeminiModelUnavailable,
+)
+from app.utils.progress import (
+    report_section,
+    report_section_delta,
+    report_sections_total,
+    report_stage,
+)
+from app.utils.section_cache import SECTION_CACHE, section_cache_key
+from app.utils.section_checkpoints import SECTION_CHECKPOINTS
+
+RETRYABLE_STATUSES = {404, 429, 500, 502, 503, 504}
+# statuses meaning the referenced cached content is gone or unusable
+CACHE_REJECTED_STATUSES = {400, 403, 404}
 
 
 def input_validator(state: HoroscopeState) -> HoroscopeState:
+    report_stage("validate")
     if not validate_name(state.name):
         state.error = "Neplatné jméno. Jméno nesmí být prázdné."
         return state
@@ -36,16 +83,51 @@ def input_validator(state: HoroscopeState) -> HoroscopeState:
 
 
 def enrich_state(state: HoroscopeState) -> HoroscopeState:
+    report_stage("enrich")
     if state.dt:
         state.zodiac = get_zodiac(state.dt.day, state.dt.month)
         state.astro_number = astrological_number(state.dob)
     return state
 
 
+def build_gemini_payload(
+    user_prompt: str,
+    generation_config: Optional[dict] = None,
+    cached_content: Optional[str] = None,
+) -> dict:
+    """Request body of generateContent / streamGenerateContent."""
+    if cached_content is None:
+        payload = {
+            "contents": [{"parts": [{"text": user_prompt}]}],
+            "tools": [],  # "tools": [{"google_search": {}}],
+            "systemInstruction": {"parts": [{"text": SYSTEM_PROMPT}]},
+        }
+    else:
+        # system instruction and tools are part of the cached content
+        payload = {
+            "contents": [{"role": "user", "parts": [{"text": user_prompt}]}],
+            "cachedContent": cached_content,
+        }
+
+    # TODO: try different temperature values - default for gemini-2.5-flash is 1.0
+    payload["generationConfig"] = {"candidateCount": 1, **(generation_config or {})}
+    return payload
+
+
+def estimate_gemini_tokens(user_prompt: str, cached_content: Optional[str]) -> int:
+    if cached_content is None:
+        return estimate_tokens(SYSTEM_PROMPT + user_prompt)
+    return estimate_tokens(user_prompt)
+
+
 async def generate_content_gemini(
     session: aiohttp.ClientSession,
     key: str,
     user_prompt: str,
+    generation_config: Optional[dict] = None,
+    cached_content: Optional[str] = None,
+    model: Optional[str] = None,
+    fallback: bool = False,
 ) -> ContentResponse:
     """Generates content using the Gemini API.
 
@@ -55,29 +137,40 @@ async def generate_content_gemini(
         session (aiohttp.ClientSession): The HTTP session to use for the request.
         key (str): A unique key to identify the prompt.
         user_prompt (str): The prompt text to send to the Gemini API.
+        generation_config (dict, optional): Extra generation config options, e.g. response schema.
+        cached_content (str, optional): Cached content holding the system instruction
+            (and possibly the prompt prefix), raises `CachedContentRejected` when refused.
+        model (str, optional): Model id, defaults to the model of `GEMINI_API_URL`.
+        fallback (bool): Raise `GeminiModelUnavailable` on 429/503 instead of retrying,
+            the caller continues with another model.
     """
     time_start = datetime.now()
     logger.debug(f"Running generation for '{key}' at {time_start.isoformat()}")
 
-    # TODO: try different temperature values - default for gemini-2.5-flash is 1.0
+    payload = build_gemini_payload(user_prompt, generation_config, cached_content)
+    estimated_tokens = estimate_gemini_tokens(user_prompt, cached_content)
+
     for attempt in range(SERVER_SETTINGS.REQUEST_RETRY_COUNT):
+        # waits for the shared budget, fails fast while the circuit is open
+        await GEMINI_ADMISSION.acquire(estimated_tokens)
+        retry_hint = None
         try:
             async with session.post(
-                SERVER_SETTINGS.GEMINI_API_URL,
-                headers={
-                    "Content-Type": "application/json",
-                    "x-goog-api-key": SERVER_SETTINGS.GEMINI_API_KEY,
-                },
-                json={
-                    "contents": [{"parts": [{"text": user_prompt}]}],
-                    "tools": [],  # "tools": [{"google_search": {}}],
-                    "systemInstruction": {"parts": [{"text": SYSTEM_PROMPT}]},
-                    "generationConfig": {
-                        "candidateCount": 1,
-                    },
-                },
+                gemini_model_url(model) if model else SERVER_SETTINGS.GEMINI_API_URL,
+                headers=gemini_headers(),
+                json=payload,
             ) as response:
-                data: dict = await response.json()
+                try:
+                    data: dict = await response.json(content_type=None)
+                except ValueError:
+                    data = {"error": {"message": await response.text()}}
+
+                if (
+                    cached_content is not None
+                    and response.status in CACHE_REJECTED_STATUSES
+                ):
+                    GEMINI_ADMISSION.record_failure(count=False)
+                    raise CachedContentRejected(cached_content)
 
                 if response.status != 200:
                     response_preview = json.dumps(data, indent=2, ensure_ascii=False)[
@@ -87,6 +180,7 @@ async def generate_content_gemini(
                         f"Gemini API error for key '{key}': Status {response.status}. "
                         f"Response: {response_preview}"
                     )
+                    retry_hint = parse_retry_hint(response.headers, data)
                     response.raise_for_status()
 
                 """ with open(
@@ -106,6 +200,12 @@ async def generate_content_gemini(
                 usage_metadata: dict = data.get("usageMetadata", {})
                 input_tokens = usage_metadata.get("promptTokenCount", 0)
                 output_tokens = usage_metadata.get("candidatesTokenCount", 0)
+                GEMINI_CONTEXT_CACHE.record_usage(usage_metadata)
+                GEMINI_ADMISSION.record_success(
+                    estimated_tokens,
+                    usage_metadata.get("totalTokenCount", input_tokens + output_tokens),
+                )
+                GEMINI_ATTEMPTS.observe(attempt + 1, key=key)
 
                 return ContentResponse(
                     key=key,
@@ -116,38 +216,57 @@ async def generate_content_gemini(
                 )
 
         except aiohttp.ClientResponseError as err:
-            # Try to get response body for better debugging
-            response_body = ""
-            try:
-                response_body = await err.history[0].text() if err.history else ""
-            except Exception:
-                response_body = f"(unable to read response body)"
+            if fallback and err.status in MODEL_FALLBACK_STATUSES:
+                # the retry hint belongs to this model, the fallback need not wait
+                GEMINI_ADMISSION.record_failure()
+                raise GeminiModelUnavailable(model or gemini_model(), err.status)
 
-            if (
-                err.status in {404, 429, 500, 503}
-                and attempt < SERVER_SETTINGS.REQUEST_RETRY_COUNT - 1
-            ):
-                delay = 2**attempt
-                await asyncio.sleep(delay)
+            retryable = err.status in RETRYABLE_STATUSES
+            # only rate limiting and server errors say something about upstream health
+            GEMINI_ADMISSION.record_failure(
+                retry_hint, count=err.status == 429 or err.status >= 500
+            )
+
+            if retryable and attempt < SERVER_SETTINGS.REQUEST_RETRY_COUNT - 1:
+                GEMINI_RETRIES.inc(key=key, reason=str(err.status))
+                delay = GEMINI_ADMISSION.backoff_delay(attempt, retry_hint)
                 logger.warning(
                     f"Generation for key '{key}' failed with status {err.status}. "
-                    f"Response: {response_body[:200] if response_body else 'N/A'}. "
-                    f"Retrying in {delay} seconds..."
+                    f"Retrying in {delay:.1f} seconds..."
                 )
+                await asyncio.sleep(delay)
                 continue
 
             else:
                 logger.error(
                     f"Generation for key '{key}' failed with status {err.status}. "
-                    f"Error: {err}. Response body: {response_body}"
+                    f"Error: {err}."
                 )
+                GEMINI_ATTEMPTS.observe(attempt + 1, key=key)
                 raise err
+
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as err:
+            GEMINI_ADMISSION.record_failure()
+
+            if attempt < SERVER_SETTINGS.REQUEST_RETRY_COUNT - 1:
+                GEMINI_RETRIES.inc(key=key, reason=type(err).__name__)
+                delay = GEMINI_ADMISSION.backoff_delay(attempt)
+                logger.warning(
+                    f"Generation for key '{key}' failed with {err!r}. "
+                    f"Retrying in {delay:.1f} seconds..."
+                )
+                await asyncio.sleep(delay)
+                continue
+            GEMINI_ATTEMPTS.observe(attempt + 1, key=key)
+            raise err
+
         finally:
             time_end = datetime.now()
             logger.debug(
                 f"Generation for key '{key}' ended in {time_end.isoformat()}, it takes {time_end - time_start}"
             )
 
+    GEMINI_ATTEMPTS.observe(SERVER_SETTINGS.REQUEST_RETRY_COUNT, key=key)
     return ContentResponse(
         key=key,
         content="",
@@ -157,51 +276,431 @@ async def generate_content_gemini(
     )
 
 
-async def generate_all_outputs(state: HoroscopeState) -> HoroscopeState:
+class GeminiStreamInterrupted(Exception):
+    """Streamed reply failed or ended before its final chunk."""
 
-    prompts_to_run = state.horoscope_type.get_prompts()
 
-    if not prompts_to_run:
-        state.error = "Neznámý typ horoskopu."
-        return state
+async def generate_content_streaming(
+    session: aiohttp.ClientSession,
+    key: str,
+    user_prompt: str,
+    generation_config: Optional[dict] = None,
+    cached_content: Optional[str] = None,
+    model: Optional[str] = None,
+    fallback: bool = False,
+    on_text: Optional[Callable[[str, bool], None]] = None,
+) -> ContentResponse:
+    """Generates content using `streamGenerateContent`, text chunks are passed
+    to `on_text` as they arrive and token usage is taken from the final chunk.
+    An interrupted stream falls back to `generate_content_gemini`, `on_text` then
+    gets the rest of the text, or the whole new text with `reset` when it does not
+    continue the text passed so far.
+
+    REST documentation: https://ai.google.dev/api/generate-content#method:-models.streamgeneratecontent
+    """
+    payload = build_gemini_payload(user_prompt, generation_config, cached_content)
+    estimated_tokens = estimate_gemini_tokens(user_prompt, cached_content)
+
+    await GEMINI_ADMISSION.acquire(estimated_tokens)
+    parts: List[str] = []
+    usage_metadata: dict = {}
+    finish_reason = None
+    try:
+        async with session.post(
+            gemini_model_url(model or gemini_model(), "streamGenerateContent"),
+            params={"alt": "sse"},
+            headers=gemini_headers(),
+            json=payload,
+        ) as response:
+            if response.status != 200:
+                try:
+                    data = await response.json(content_type=None)
+                except ValueError:
+                    data = None
+                if (
+                    cached_content is not None
+                    and response.status in CACHE_REJECTED_STATUSES
+                ):
+                    GEMINI_ADMISSION.record_failure(count=False)
+                    raise CachedContentRejected(cached_content)
+
+                if fallback and response.status in MODEL_FALLBACK_STATUSES:
+                    GEMINI_ADMISSION.record_failure()
+                    raise GeminiModelUnavailable(
+                        model or gemini_model(), response.status
+                    )
+
+                GEMINI_ADMISSION.record_failure(
+                    parse_retry_hint(response.headers, data),
+                    count=response.status == 429 or response.status >= 500,
+                )
+                raise GeminiStreamInterrupted(f"status {response.status}")
+
+            async for chunk in iter_stream_chunks(
+                response, SERVER_SETTINGS.GEMINI_STREAM_CHUNK_TIMEOUT
+            ):
+                candidate: dict = (chunk.get("candidates") or [{}])[0]
+                text = "".join(
+                    part.get("text", "")
+                    for part in candidate.get("content", {}).get("parts", [])
+                )
+                if text:
+                    parts.append(text)
+                    if on_text is not None:
+                        on_text(text, False)
+                finish_reason = candidate.get("finishReason") or finish_reason
+                usage_metadata = chunk.get("usageMetadata") or usage_metadata
+
+        if finish_reason is None:
+            GEMINI_ADMISSION.record_failure(count=False)
+            raise GeminiStreamInterrupted("stream ended without finish reason")
+
+    except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as err:
+        GEMINI_ADMISSION.record_failure(count=not isinstance(err, ValueError))
+        interrupted = repr(err)
+    except GeminiStreamInterrupted as err:
+        interrupted = str(err)
+    else:
+        interrupted = None
 
-    base_prompt = BASE_PROMPT_TEMPLATE.format(
+    if interrupted is not None:
+        logger.warning(
+            f"Streamed generation for key '{key}' interrupted ({interrupted}), "
+            "falling back to non-streaming request."
+        )
+        response = await generate_content_gemini(
+            session,
+            key,
+            user_prompt,
+            generation_config,
+            cached_content,
+            model,
+            fallback,
+        )
+        sent = "".join(parts)
+        if on_text is not None and sent and response.error is None:
+            if response.content.startswith(sent):
+                if response.content != sent:
+                    on_text(response.content[len(sent) :], False)
+            else:
+                on_text(response.content, True)
+        return response
+
+    input_tokens = usage_metadata.get("promptTokenCount", 0)
+    output_tokens = usage_metadata.get("candidatesTokenCount", 0)
+    GEMINI_CONTEXT_CACHE.record_usage(usage_metadata)
+    GEMINI_ADMISSION.record_success(
+        estimated_tokens,
+        usage_metadata.get("totalTokenCount", input_tokens + output_tokens),
+    )
+
+    return ContentResponse(
+        key=key,
+        content="".join(parts),
+        error=None,
+        input_tokens=input_tokens,
+        output_tokens=output_tokens,
+    )
+
+
+async def generate_content_with_model(
+    session: aiohttp.ClientSession,
+    key: str,
+    prefix: str,
+    prompt: str,
+    model: str,
+    fallback: bool = False,
+    generation_config: Optional[dict] = None,
+    on_text: Optional[Callable[[str, bool], None]] = None,
+) -> ContentResponse:
+    """Generates content of `prefix` + `prompt` with the model, referencing a Gemini
+    context cache when one is available - the per-request prefix cache of the running
+    generation or the shared system instruction cache. A refused cache is forgotten
+    and the call is repeated with the full prompt.
+
+    With `GEMINI_STREAMING` the reply is streamed and its text chunks passed to `on_text`.
+    """
+    if SERVER_SETTINGS.GEMINI_STREAMING:
+        generate = functools.partial(
+            generate_content_streaming, model=model, fallback=fallback, on_text=on_text
+        )
+    else:
+        generate = functools.partial(
+            generate_content_gemini, model=model, fallback=fallback
+        )
+
+    full_prompt = f"{prefix} {prompt}"
+
+    cached_content = GEMINI_CONTEXT_CACHE.active_prefix(prefix, model)
+    user_prompt = prompt
+    if cached_content is None:
+        cached_content = await GEMINI_CONTEXT_CACHE.system_instruction(session, model)
+        user_prompt = full_prompt
+
+    if cached_content is None:
+        return await generate(session, key, full_prompt, generation_config)
+
+    try:
+        return await generate(
+            session, key, user_prompt, generation_config, cached_content
+        )
+    except CachedContentRejected as err:
+        logger.warning(f"{err}, generating '{key}' without context cache.")
+        GEMINI_CONTEXT_CACHE.invalidate(err.name)
+        return await generate(session, key, full_prompt, generation_config)
+
+
+async def generate_content_cached(
+    session: aiohttp.ClientSession,
+    key: str,
+    prefix: str,
+    prompt: str,
+    generation_config: Optional[dict] = None,
+    on_text: Optional[Callable[[str, bool], None]] = None,
+    kind: str = "section",
+) -> ContentResponse:
+    """Generates content of `prefix` + `prompt` with the model chosen by the model
+    router, moving on to the next candidate model when one is unavailable (429/503).
+    Slow calls are hedged when enabled. Latency of each model is recorded for the
+    routing and hedging policies, separately for each `kind` of call.
+    """
+    models = MODEL_ROUTER.candidates(key)
+    for index, model in enumerate(models):
+        time_start = time.perf_counter()
+
+        def call(primary: bool, model: str = model, index: int = index):
+            # only the primary call streams text to the progress listener
+            return generate_content_with_model(
+                session,
+                key,
+                prefix,
+                prompt,
+                model,
+                fallback=index < len(models) - 1,
+                generation_config=generation_config,
+                on_text=on_text if primary else None,
+            )
+
+        try:
+            response = await HEDGING.run(model, call, kind)
+        except GeminiModelUnavailable as err:
+            MODEL_ROUTER.record_unavailable(model)
+            logger.warning(f"{err}, generating '{key}' with {models[index + 1]}.")
+            continue
+        except BaseException:
+            MODEL_ROUTER.record(
+                model, time.perf_counter() - time_start, ok=False, kind=kind
+            )
+            raise
+
+        MODEL_ROUTER.record(
+            model,
+            time.perf_counter() - time_start,
+            ok=response.error is None,
+            kind=kind,
+        )
+        response.model = model
+        return response
+
+
+def build_base_prompt(state: HoroscopeState) -> str:
+    return BASE_PROMPT_TEMPLATE.format(
         name=state.name,
         dob=state.dob,
         astro_number=state.astro_number,
         zodiac=state.zodiac.get_czech_name() if state.zodiac else "Unknown",
     )
 
-    async with aiohttp.ClientSession() as session:
-        tasks = {}
-        for key, data in prompts_to_run.items():
-            full_prompt = f"{base_prompt} {data.prompt}"
-            tasks[key] = generate_content_gemini(session, key, full_prompt)
 
-        results: List[ContentResponse] = await asyncio.gather(*tasks.values())
+def build_sign_prompt(state: HoroscopeState) -> str:
+    return SIGN_PROMPT_TEMPLATE.format(
+        astro_number=state.astro_number,
+        zodiac=state.zodiac.get_czech_name() if state.zodiac else "Unknown",
+    )
 
-        # Collect results
-        for key, response in zip(tasks.keys(), results):
 
-            if response.error is not None:
-                error_msg = (
-                    f"Error in generating response for key {key}: {response.error}"
-                )
-                if state.error is None:
-                    state.error = error_msg
-                else:
-                    state.error += f"\n{error_msg}"
+def collect_results(
+    state: HoroscopeState,
+    prompts_to_run: dict[str, PromptObj],
+    results: List[ContentResponse],
+) -> HoroscopeState:
+    """Appends generated sections to the state in the order of `prompts_to_run`
+    and accumulates token usage and errors.
+    """
+    for key, response in zip(prompts_to_run.keys(), results):
 
-                continue
+        if response.error is not None:
+            error_msg = f"Error in generating response for key {key}: {response.error}"
+            if state.error is None:
+                state.error = error_msg
+            else:
+                state.error += f"\n{error_msg}"
+            state.failed_sections.append(key)
 
-            response.title = prompts_to_run[key].title
-            state.results.append(response)
-            state.total_input_tokens += response.input_tokens
-            state.total_output_tokens += response.output_tokens
+            continue
+
+        response.title = prompts_to_run[key].title
+        state.results.append(response)
+        state.total_input_tokens += response.input_tokens
+        state.total_output_tokens += response.output_tokens
 
     return state
 
 
+# process-wide cap of Gemini section calls running at the same time
+global_generation_limit = asyncio.Semaphore(
+    SERVER_SETTINGS.GENERATION_MAX_CONCURRENCY_GLOBAL
+)
+
+
+@asynccontextmanager
+async def section_generation_slot() -> AsyncIterator[None]:
+    """Waits for the process-wide limit, `GEMINI_SECTION_DEADLINE` starts only after
+    that, so sections queued under load do not time out before calling Gemini."""
+    async with global_generation_limit:
+        async with asyncio.timeout(SERVER_SETTINGS.GEMINI_SECTION_DEADLINE or None):
+            yield
+
+
+async def generate_section(
+    session: aiohttp.ClientSession,
+    state: HoroscopeState,
+    key: str,
+    data: PromptObj,
+    base_prompt: str,
+) -> ContentResponse:
+    """Generates one section and reports it as finished to the progress listener,
+    a section whose generation fails or does not finish within `GEMINI_SECTION_DEADLINE`
+    (the wait for the global limit not counted) ends with an error response, so the other
+    sections go on and the partial render policy can apply.
+    Sections saved by an earlier attempt of the request are restored instead."""
+    response = SECTION_CHECKPOINTS.restore(key)
+    if response is not None:
+        response.title = data.title
+        report_section(response)
+        return response
+
+    try:
+        with SECTION_SECONDS.time(key=key):
+            response = await generate_section_content(
+                session, state, key, data, base_prompt
+            )
+    except TimeoutError:
+        logger.warning(
+            f"Section '{key}' exceeded deadline of {SERVER_SETTINGS.GEMINI_SECTION_DEADLINE}s."
+        )
+        response = ContentResponse(
+            key=key, content="", error="Vypršel časový limit generování sekce."
+        )
+    except Exception as err:
+        logger.error(f"Generation of section '{key}' failed: {err!r}")
+        response = ContentResponse(
+            key=key, content="", error="Nepodařilo se vygenerovat odpověď."
+        )
+    response.title = data.title
+    await SECTION_CHECKPOINTS.save(response)
+    report_section(response)
+    return response
+
+
+async def generate_section_content(
+    session: aiohttp.ClientSession,
+    state: HoroscopeState,
+    key: str,
+    data: PromptObj,
+    base_prompt: str,
+) -> ContentResponse:
+    """Generates content of one section, sections not depending on name or date
+    of birth are served from the sign-level section cache when it is enabled.
+    """
+
+    def on_text(text: str, reset: bool) -> None:
+        report_section_delta(key, data.title, text, reset)
+
+    cacheable = (
+        SECTION_CACHE.enabled
+        and state.zodiac is not None
+        and state.astro_number is not None
+        and key not in SERVER_SETTINGS.SECTION_CACHE_PERSONALIZED_KEYS
+    )
+
+    if not cacheable:
+        async with section_generation_slot():
+            return await generate_content_cached(
+                session, key, base_prompt, data.prompt, on_text=on_text
+            )
+
+    cache_key = section_cache_key(
+        state.zodiac,
+        state.astro_number,
+        key,
+        data.prompt,
+        MODEL_ROUTER.routed_model(key),
+    )
+    cached = await SECTION_CACHE.get(cache_key, key)
+    if cached is not None:
+        logger.debug(f"Section '{key}' served from cache ({cache_key})")
+        return cached
+
+    async with section_generation_slot():
+        response = await generate_content_cached(
+            session, key, build_sign_prompt(state), data.prompt, on_text=on_text
+        )
+    if response.error is None and response.content:
+        await SECTION_CACHE.put(cache_key, response)
+    return response
+
+
+async def generate_sections_parallel(
+    session: aiohttp.ClientSession,
+    state: HoroscopeState,
+    prompts_to_run: dict[str, PromptObj],
+    base_prompt: str,
+) -> List[ContentResponse]:
+    """Generates sections concurrently, bounded by the per-request limit.
+
+    :return: responses in the order of `prompts_to_run`
+    """
+    request_limit = asyncio.Semaphore(
+        SERVER_SETTINGS.GENERATION_MAX_CONCURRENCY_PER_REQUEST
+    )
+
+    async def run_limited(key: str, data: PromptObj) -> ContentResponse:
+        async with request_limit:
+            return await generate_section(session, state, key, data, base_prompt)
+
+    tasks = [
+        asyncio.create_task(run_limited(key, data))
+        for key, data in prompts_to_run.items()
+    ]
+
+    try:
+        # gather keeps the order of the prompts, failed sections come back as errors
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        # cancelled - do not keep spending tokens on an abandoned horoscope
+        for task in tasks:
+            task.cancel()
+        raise
+
+
+async def generate_all_outputs(state: HoroscopeState) -> HoroscopeState:
+
+    logger.debug("Starting parallel generation of outputs.")
+
+    prompts_to_run = state.horoscope_type.get_prompts()
+
+    if not prompts_to_run:
+        state.error = "Neznámý typ horoskopu."
+        return state
+
+    results = await generate_sections_parallel(
+        GEMINI_CLIENT.session, state, prompts_to_run, build_base_prompt(state)
+    )
+
+    return collect_results(state, prompts_to_run, results)
+
+
 async def generate_all_outputs_one_by_one(state: HoroscopeState) -> HoroscopeState:
 
     logger.debug("Starting sequential generation of outputs.")
@@ -212,71 +711,324 @@ async def generate_all_outputs_one_by_one(state: HoroscopeState) -> HoroscopeSta
         state.error = "Neznámý typ horoskopu."
         return state
 
-    base_prompt = BASE_PROMPT_TEMPLATE.format(
-        name=state.name,
-        dob=state.dob,
-        astro_number=state.astro_number,
-        zodiac=state.zodiac.get_czech_name() if state.zodiac else "Unknown",
+    base_prompt = build_base_prompt(state)
+
+    session = GEMINI_CLIENT.session
+    results: List[ContentResponse] = []
+    for key, data in prompts_to_run.items():
+        res = await generate_section(session, state, key, data, base_prompt)
+        results.append(res)
+
+    return collect_results(state, prompts_to_run, results)
+
+
+def build_structured_prompt(prompts: dict[str, PromptObj]) -> str:
+    sections = "\n".join(
+        f'- "{key}" ({data.title}): {data.prompt}' for key, data in prompts.items()
+    )
+    return (
+        f"Všechny následující sekce najednou. Každou sekci vytvoř jako samostatný "
+        f"text ve formátu HTML a vrať ji pod odpovídajícím klíčem JSON objektu:\n{sections}"
     )
 
-    async with aiohttp.ClientSession() as session:
-        results: List[ContentResponse] = []
-        for key, data in prompts_to_run.items():
-            full_prompt = f"{base_prompt} {data.prompt}"
-            res = await generate_content_gemini(session, key, full_prompt)
-            results.append(res)
 
-        # Collect results
-        for key, response in zip(prompts_to_run.keys(), results):
+def build_sections_schema(prompts: dict[str, PromptObj]) -> dict:
+    return {
+        "type": "OBJECT",
+        "properties": {key: {"type": "STRING"} for key in prompts},
+        "required": list(prompts),
+        "propertyOrdering": list(prompts),
+    }
+
+
+def parse_structured_sections(content: str, keys: List[str]) -> dict[str, str]:
+    """Parses JSON reply of the structured call.
+
+    :return: valid section texts by key, invalid or missing sections are left out
+    """
+    try:
+        data = json.loads(content)
+    except ValueError:
+        return {}
+    if not isinstance(data, dict):
+        return {}
+
+    return {
+        key: data[key].strip()
+        for key in keys
+        if isinstance(data.get(key), str)
+        and len(data[key].strip()) >= SERVER_SETTINGS.STRUCTURED_MIN_SECTION_LENGTH
+    }
+
+
+def split_tokens(total: int, weights: List[int]) -> List[int]:
+    """Splits token count of a shared call proportionally to `weights`."""
+    if sum(weights) == 0:
+        weights = [1] * len(weights)
+    shares = [total * weight // sum(weights) for weight in weights]
+    shares[-1] += total - sum(shares)
+    return shares
 
-            if response.error is not None:
-                error_msg = (
-                    f"Error in generating response for key {key}: {response.error}"
-                )
-                if state.error is None:
-                    state.error = error_msg
-                else:
-                    state.error += f"\n{error_msg}"
 
+async def generate_structured_sections(
+    session: aiohttp.ClientSession,
+    state: HoroscopeState,
+    base_prompt: str,
+    requested: dict[str, PromptObj],
+    sign_level: bool,
+) -> dict[str, ContentResponse]:
+    """Generates the requested sections with one Gemini call using a JSON response
+    schema, sections missing or invalid in the reply are re-requested one by one.
+    Sign-level sections are generated from the sign prompt and stored to the section cache.
+
+    :return: responses by section key
+    """
+    try:
+        async with global_generation_limit:
+            combined = await generate_content_cached(
+                session,
+                "structured",
+                build_sign_prompt(state) if sign_level else base_prompt,
+                build_structured_prompt(requested),
+                generation_config={
+                    "responseMimeType": "application/json",
+                    "responseSchema": build_sections_schema(requested),
+                },
+                kind="structured",
+            )
+    except Exception as err:
+        # all sections are re-requested one by one
+        logger.error(f"Structured generation failed: {err!r}")
+        combined = ContentResponse(key="structured", error=repr(err))
+
+    responses: dict[str, ContentResponse] = {}
+    sections = parse_structured_sections(combined.content, list(requested))
+    for key, content in sections.items():
+        response = ContentResponse(
+            key=key,
+            title=requested[key].title,
+            content=content,
+            model=combined.model,
+        )
+        await SECTION_CHECKPOINTS.save(response)
+        report_section(response)
+        responses[key] = response
+
+    missing = {k: v for k, v in requested.items() if k not in sections}
+    if missing:
+        logger.warning(
+            f"Structured reply is missing valid sections {list(missing)}, re-requesting them."
+        )
+        retried = await generate_sections_parallel(session, state, missing, base_prompt)
+        responses.update(zip(missing, retried))
+
+    # tokens of the shared call are attributed proportionally to section length
+    weights = [len(sections.get(key, "")) for key in requested]
+    input_shares = split_tokens(combined.input_tokens, weights)
+    output_shares = split_tokens(combined.output_tokens, weights)
+    for key, input_share, output_share in zip(requested, input_shares, output_shares):
+        responses[key].input_tokens += input_share
+        responses[key].output_tokens += output_share
+
+    # re-requested sections were cached by `generate_section_content`
+    if sign_level:
+        for key in sections:
+            cache_key = section_cache_key(
+                state.zodiac,
+                state.astro_number,
+                key,
+                requested[key].prompt,
+                MODEL_ROUTER.routed_model("structured"),
+            )
+            await SECTION_CACHE.put(cache_key, responses[key])
+
+    return responses
+
+
+async def generate_all_outputs_structured(state: HoroscopeState) -> HoroscopeState:
+    """Generates all sections with one structured Gemini call, or two when the section
+    cache is enabled - sign-level sections then get their own call with the sign prompt
+    (as in the other modes), so they can be cached and shared.
+    """
+
+    logger.debug("Starting structured generation of outputs.")
+
+    prompts_to_run = state.horoscope_type.get_prompts()
+
+    if not prompts_to_run:
+        state.error = "Neznámý typ horoskopu."
+        return state
+
+    base_prompt = build_base_prompt(state)
+    session = GEMINI_CLIENT.session
+    responses: dict[str, ContentResponse] = {}
+    cacheable = (
+        SECTION_CACHE.enabled
+        and state.zodiac is not None
+        and state.astro_number is not None
+    )
+
+    # sections of an earlier attempt are not requested again
+    for key, data in prompts_to_run.items():
+        restored = SECTION_CHECKPOINTS.restore(key)
+        if restored is not None:
+            restored.title = data.title
+            report_section(restored)
+            responses[key] = restored
+
+    # sign-level sections already in the cache are not requested at all
+    if cacheable:
+        for key, data in prompts_to_run.items():
+            if (
+                key in SERVER_SETTINGS.SECTION_CACHE_PERSONALIZED_KEYS
+                or key in responses
+            ):
                 continue
+            # texts of the combined call are cached under its model
+            cache_key = section_cache_key(
+                state.zodiac,
+                state.astro_number,
+                key,
+                data.prompt,
+                MODEL_ROUTER.routed_model("structured"),
+            )
+            cached = await SECTION_CACHE.get(cache_key, key)
+            if cached is not None:
+                cached.title = data.title
+                report_section(cached)
+                responses[key] = cached
 
-            response.title = prompts_to_run[key].title
-            state.results.append(response)
-            state.total_input_tokens += response.input_tokens
-            state.total_output_tokens += response.output_tokens
+    requested = {k: v for k, v in prompts_to_run.items() if k not in responses}
+    sign_level = {
+        key: data
+        for key, data in requested.items()
+        if cacheable and key not in SERVER_SETTINGS.SECTION_CACHE_PERSONALIZED_KEYS
+    }
+    personal = {k: v for k, v in requested.items() if k not in sign_level}
+
+    groups = [(sign_level, True), (personal, False)]
+    for generated in await asyncio.gather(
+        *(
+            generate_structured_sections(
+                session, state, base_prompt, group, is_sign_level
+            )
+            for group, is_sign_level in groups
+            if group
+        )
+    ):
+        responses.update(generated)
+
+    return collect_results(
+        state, prompts_to_run, [responses[key] for key in prompts_to_run]
+    )
 
-    return state
+
+GENERATION_MODES = {
+    "sequential": generate_all_outputs_one_by_one,
+    "parallel": generate_all_outputs,
+    "structured": generate_all_outputs_structured,
+}
+
+
+def generation_mode(horoscope_type: HoroscopeType) -> str:
+    return SERVER_SETTINGS.GENERATION_MODE_OVERRIDES.get(
+        horoscope_type.value, SERVER_SETTINGS.GENERATION_MODE
+    )
+
+
+async def generate_outputs(state: HoroscopeState) -> HoroscopeState:
+    """Runs section generation in the mode selected by `GENERATION_MODE`,
+    or by `GENERATION_MODE_OVERRIDES` for the horoscope type."""
+    report_sections_total(len(state.horoscope_type.get_prompts()))
+    report_stage("generate")
+    async with (
+        SECTION_CHECKPOINTS.resume(state.request_id),
+        GEMINI_CONTEXT_CACHE.request_prefix(
+            GEMINI_CLIENT.session,
+            MODEL_ROUTER.candidates("")[0],
+            state.horoscope_type,
+            build_base_prompt(state),
+        ),
+    ):
+        return await GENERATION_MODES[generation_mode(state.horoscope_type)](state)
 
 
 def should_continue(state: HoroscopeState) -> str:
     return "end" if state.error else "continue"
 
 
-workflow = StateGraph(HoroscopeState)
-workflow.add_node("validate", input_validator)
-workflow.add_node("enrich", enrich_state)
-# workflow.add_node("generate_outputs", generate_all_outputs)
-workflow.add_node("generate_outputs", generate_all_outputs_one_by_one)
-workflow.set_entry_point("validate")
-workflow.add_conditional_edges(
-    "validate", should_continue, {"continue": "enrich", "end": END}
-)
-workflow.add_edge("enrich", "generate_outputs")
-workflow.add_edge("generate_outputs", END)
-compiled_graph = workflow.compile()
+# nodes of the workflow, run by either executor
+WORKFLOW_NODES = {
+    "validate": timed(NODE_SECONDS, node="validate")(input_validator),
+    "enrich": timed(NODE_SECONDS, node="enrich")(enrich_state),
+    "generate_outputs": timed(NODE_SECONDS, node="generate_outputs")(generate_outputs),
+}
+
+
+@functools.cache
+def compiled_graph():
+    """LangGraph workflow compiled on first use, langgraph (with langchain) is most
+    of the import time of the application."""
+    from langgraph.graph import END, StateGraph
+
+    workflow = StateGraph(HoroscopeState)
+    for name, node in WORKFLOW_NODES.items():
+        workflow.add_node(name, node)
+    workflow.set_entry_point("validate")
+    workflow.add_conditional_edges(
+        "validate", should_continue, {"continue": "enrich", "end": END}
+    )
+    workflow.add_edge("enrich", "generate_outputs")
+    workflow.add_edge("generate_outputs", END)
+    return workflow.compile()
+
+
+def warm_up_pipeline() -> None:
+    """Compiles the LangGraph workflow at startup instead of the first request."""
+    if SERVER_SETTINGS.PIPELINE_EXECUTOR != "langgraph":
+        return
+    started_at = time.perf_counter()
+    compiled_graph()
+    logger.info(
+        f"LangGraph workflow compiled in {time.perf_counter() - started_at:.3f}s"
+    )
+
+
+async def run_node(name: str, state: HoroscopeState) -> HoroscopeState:
+    result = WORKFLOW_NODES[name](state)
+    if inspect.isawaitable(result):
+        result = await result
+    return result
+
+
+async def run_native_pipeline(state: HoroscopeState) -> HoroscopeState:
+    """Runs the workflow without LangGraph - the same nodes and the same
+    `should_continue` edge after validation."""
+    state = await run_node("validate", state)
+    if should_continue(state) == "end":
+        return state
+    state = await run_node("enrich", state)
+    return await run_node("generate_outputs", state)
 
 
 async def run_horoscope_flow(
-    name: str, dob: str, horoscope_type: HoroscopeType
+    name: str,
+    dob: str,
+    horoscope_type: HoroscopeType,
+    request_id: Optional[str] = None,
 ) -> HoroscopeState:
-    user_state = HoroscopeState(name=name, dob=dob, horoscope_type=horoscope_type)
-    final_state_dict = await compiled_graph.ainvoke(user_state)
+    user_state = HoroscopeState(
+        name=name, dob=dob, horoscope_type=horoscope_type, request_id=request_id
+    )
+    if SERVER_SETTINGS.PIPELINE_EXECUTOR == "native":
+        return await run_native_pipeline(user_state)
+    final_state_dict = await compiled_graph().ainvoke(user_state)
     return HoroscopeState.model_validate(final_state_dict)
 
 
 if __name__ == "__main__":
 
-    draw_mmd = compiled_graph.get_graph().draw_mermaid()
+    draw_mmd = compiled_graph().get_graph().draw_mermaid()
 
     with open("horoscope_workflow.mmd", "w", encoding="utf-8") as f:
         f.write(draw_mmd)
@@ -0,0 +1,464 @@
+import asyncio
+import time
+from datetime import datetime
+from typing import AsyncIterator, Callable, Hashable, Optional, Union
+
+from bson import ObjectId
+from fastapi import HTTPException
+from gridfs.errors import NoFile
+from loguru import logger
+from motor.motor_asyncio import (
+    AsyncIOMotorDatabase,
+    AsyncIOMotorGridFSBucket,
+    AsyncIOMotorGridOut,
+)
+
+from app.config import DB_NAMES, SERVER_SETTINGS
+from app.models.horoscop import HoroscopeDB, HoroscopePdf, HoroscopeState, UserInput
+from app.utils.access_codes import ACCESS_CODES, INVALID_CODE_ERROR
+from app.utils.helper import debug_llm_result
+from app.utils.horoscope_process import run_horoscope_flow
+from app.utils.metrics import (
+    GRIDFS_UPLOAD_SECONDS,
+    HOROSCOPE_PHASE_SECONDS,
+    HOROSCOPES_IN_FLIGHT,
+    INPUT_TOKENS,
+    MONGO_INSERT_SECONDS,
+    OUTPUT_TOKENS,
+    PARTIAL_RENDERS,
+    TOKEN_COST,
+    token_cost,
+)
+from app.utils.persistence_queue import (
+    PERSISTENCE_QUEUE,
+    PendingHoroscope,
+    iter_pdf_bytes,
+)
+from app.utils.progress import PROGRESS, ProgressFanout, report_stage
+from app.utils.section_checkpoints import SECTION_CHECKPOINTS, checkpoint_request_id
+from app.utils.single_flight import SingleFlight
+from app.utils.template_process import generate_html, generate_pdf_stream
+
+GENERATION_ERROR = "Hvězdy momentálně nepřejí. Zkuste to prosím později."
+
+HOROSCOPE_FLIGHTS: SingleFlight[HoroscopePdf] = SingleFlight(
+    name="horoscope",
+    result_window=SERVER_SETTINGS.SINGLE_FLIGHT_RESULT_WINDOW,
+)
+# progress of the in-flight generations, reported to every request sharing them
+FLIGHT_PROGRESS: dict[Hashable, ProgressFanout] = {}
+
+
+class PdfStreamAborted(Exception):
+    """PDF failed after its first chunk was sent, the response can only be cut off."""
+
+
+class PdfStream:
+    """
+    PDF chunks for the client of the request that renders the horoscope.
+
+    At most `max_chunks` chunks wait for the client, a slower client slows down
+    the render. A client gone away (`detach`, or not reading for `put_timeout`
+    seconds) stops receiving chunks, the PDF is still stored to GridFS.
+    """
+
+    def __init__(self, max_chunks: int = 2, put_timeout: float = 30.0) -> None:
+        self.filename = ""
+        self.started = asyncio.Event()
+        self.detached = False
+        self.put_timeout = put_timeout
+        self._chunks: asyncio.Queue[Union[bytes, BaseException, None]] = asyncio.Queue(
+            max_chunks
+        )
+
+    def start(self, filename: str) -> None:
+        self.filename = filename
+        self.started.set()
+
+    async def put(self, chunk: bytes) -> None:
+        if self.detached:
+            return
+        try:
+            await asyncio.wait_for(self._chunks.put(chunk), self.put_timeout)
+        except TimeoutError:
+            logger.warning(f"Client of {self.filename} stopped reading the PDF")
+            self.detach()
+
+    async def finish(self) -> None:
+        await self.put(None)
+
+    def fail(self, err: BaseException) -> None:
+        """Abort the client response, chunks not sent yet are dropped."""
+        if self.detached:
+            return
+        self._drain()
+        detail = getattr(err, "detail", None) or repr(err)
+        self._chunks.put_nowait(
+            PdfStreamAborted(f"PDF {self.filename} aborted - {detail}")
+        )
+
+    def detach(self) -> None:
+        self.detached = True
+        self._drain()
+
+    def _drain(self) -> None:
+        # also wakes up the renderer waiting in `put`
+        while not self._chunks.empty():
+            self._chunks.get_nowait()
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        try:
+            while True:
+                item = await self._chunks.get()
+                if item is None:
+                    return
+                if isinstance(item, BaseException):
+                    raise item
+                yield item
+        finally:
+            self.detach()
+
+
+def request_key(user_input: UserInput) -> tuple[str, str, str, str]:
+    return (
+        user_input.code,
+        user_input.name.strip(),
+        user_input.dob.strip(),
+        user_input.horoscope_type.value,
+    )
+
+
+async def check_access_code(
+    db: AsyncIOMotorDatabase, code: str, start_time: datetime
+) -> ObjectId:
+    """Validates the access code and stamps its last usage.
+
+    :return: id of the access code
+    """
+    if ACCESS_CODES.enabled:
+        return await ACCESS_CODES.validate(db, code, start_time)
+
+    db_validation_code = await db[DB_NAMES.ACCESS_CODES].find_one_and_update(
+        {"code": code}, {"$set": {"lastUsed": start_time}}
+    )
+
+    if not db_validation_code:
+        raise HTTPException(status_code=400, detail=INVALID_CODE_ERROR)
+
+    return db_validation_code["_id"]
+
+
+def horoscope_filename(name: str, start_time: datetime) -> str:
+    return f"{name.replace(" ","_")}_{start_time.strftime("%Y-%m-%d_%H:%M:%S")}_horoskop.pdf"
+
+
+async def create_horoscope(
+    user_input: UserInput,
+    db: AsyncIOMotorDatabase,
+    validation_code_id: ObjectId,
+    start_time: datetime,
+    pdf_stream: Optional[PdfStream] = None,
+) -> HoroscopePdf:
+    """Runs the whole pipeline - LLM generation, HTML/PDF rendering and storing
+    the PDF to GridFS together with the horoscope document.
+    ---
+    Args:
+        user_input (UserInput): Validated request of the user.
+        db (AsyncIOMotorDatabase): Database to store the horoscope to.
+        validation_code_id (ObjectId): Id of the used access code.
+        start_time (datetime): Start of the request processing.
+        pdf_stream (PdfStream): Receives the PDF chunks while they are stored.
+    """
+    llm_result = await generate_horoscope_content(user_input)
+    logger.info(f"LLM processing time: {datetime.now() - start_time}")
+
+    start_pdf = datetime.now()
+    started_at = time.perf_counter()
+
+    # Process html and generate PDF
+    report_stage("render")
+    html_content = await render_horoscope_html(llm_result)
+    filename = horoscope_filename(user_input.name, start_time)
+    metadata = {"validation_code_id": validation_code_id}
+    horoscope_document = horoscope_document_factory(
+        llm_result, validation_code_id, start_time
+    )
+
+    # PDF goes from the renderer to the client chunk by chunk, it is stored to
+    # MongoDB gridfs at the same time or by the write-behind queue afterwards
+    chunks = tee_pdf_stream(generate_pdf_stream(html_content), filename, pdf_stream)
+    try:
+        if PERSISTENCE_QUEUE.enabled:
+            file_id = await store_pdf_write_behind(
+                chunks, filename, metadata, horoscope_document
+            )
+        else:
+            file_id = await store_pdf(
+                db, chunks, filename, metadata, horoscope_document
+            )
+    except BaseException as err:
+        if pdf_stream is not None:
+            pdf_stream.fail(err)
+        raise
+
+    if pdf_stream is not None:
+        await pdf_stream.finish()
+    await SECTION_CHECKPOINTS.release(llm_result)
+
+    logger.info(f"PDF processing time: {datetime.now() - start_pdf}")
+    HOROSCOPE_PHASE_SECONDS.observe(
+        time.perf_counter() - started_at,
+        horoscope_type=user_input.horoscope_type.value,
+        phase="pdf",
+    )
+
+    return HoroscopePdf(filename=filename, file_id=file_id)
+
+
+async def generate_horoscope_content(user_input: UserInput) -> HoroscopeState:
+    """Runs the LangGraph flow (validation, enrichment, section generation).
+    A crashed flow ends with HTTP 500, invalid input or failed sections with HTTP 400,
+    unless the partial render policy allows to leave the failed sections out.
+
+    :return: state with the generated sections
+    """
+    horoscope_type = user_input.horoscope_type.value
+    started_at = time.perf_counter()
+    try:
+        llm_result = await run_horoscope_flow(
+            name=user_input.name,
+            dob=user_input.dob,
+            horoscope_type=user_input.horoscope_type,
+            request_id=(
+                checkpoint_request_id(*request_key(user_input))
+                if SECTION_CHECKPOINTS.enabled
+                else None
+            ),
+        )
+    except Exception as e:
+        logger.error(f"Error during horoscope generation: {e}")
+        raise HTTPException(
+            status_code=500,
+            detail=GENERATION_ERROR,
+        )
+    """
+    llm_result = debug_llm_result()
+    """
+
+    HOROSCOPE_PHASE_SECONDS.observe(
+        time.perf_counter() - started_at, horoscope_type=horoscope_type, phase="llm"
+    )
+    record_token_usage(llm_result, horoscope_type)
+
+    if llm_result.error:
+        if not partial_render_allowed(llm_result):
+            raise HTTPException(status_code=400, detail=llm_result.error)
+        logger.warning(
+            f"Rendering horoscope without failed sections {llm_result.failed_sections}"
+        )
+        PARTIAL_RENDERS.inc(horoscope_type=horoscope_type)
+    return llm_result
+
+
+def partial_render_allowed(llm_result: HoroscopeState) -> bool:
+    """Only failed sections (not invalid input), none of them critical and
+    at least one section generated."""
+    return (
+        SERVER_SETTINGS.PARTIAL_RENDER_ENABLED
+        and bool(llm_result.failed_sections)
+        and bool(llm_result.results)
+        and not set(llm_result.failed_sections)
+        & set(SERVER_SETTINGS.PARTIAL_RENDER_CRITICAL_SECTIONS)
+    )
+
+
+async def render_horoscope_html(llm_result: HoroscopeState) -> str:
+    return await generate_html(
+        {
+            **llm_result.model_dump(exclude_none=True),
+            "zodiac_cz": (
+                llm_result.zodiac.get_czech_name() if llm_result.zodiac else "Unknown"
+            ),
+        },
+        template_name="basic_template.html",
+    )
+
+
+def horoscope_document_factory(
+    llm_result: HoroscopeState, validation_code_id: ObjectId, start_time: datetime
+) -> Callable[[ObjectId], dict]:
+    """Horoscope document of the PDF, created once the file id is known."""
+
+    def horoscope_document(file_id: ObjectId) -> dict:
+        return HoroscopeDB(
+            **llm_result.model_dump(exclude_none=True),
+            processing_time=(datetime.now() - start_time).total_seconds(),
+            validation_code_id=validation_code_id,
+            file_id=file_id,
+        ).model_dump(exclude_none=True)
+
+    return horoscope_document
+
+
+def record_token_usage(llm_result: HoroscopeState, horoscope_type: str) -> None:
+    """Counts tokens and their price of the generated sections."""
+    INPUT_TOKENS.inc(llm_result.total_input_tokens, horoscope_type=horoscope_type)
+    OUTPUT_TOKENS.inc(llm_result.total_output_tokens, horoscope_type=horoscope_type)
+    TOKEN_COST.inc(
+        sum(
+            token_cost(section.model, section.input_tokens, section.output_tokens)
+            * (SERVER_SETTINGS.GEMINI_BATCH_PRICE_FACTOR if section.batch else 1.0)
+            for section in llm_result.results
+        ),
+        horoscope_type=horoscope_type,
+    )
+
+
+async def tee_pdf_stream(
+    chunks: AsyncIterator[bytes], filename: str, pdf_stream: Optional[PdfStream]
+) -> AsyncIterator[bytes]:
+    """Passes PDF chunks on, each one is sent to the client first."""
+    async for chunk in chunks:
+        if pdf_stream is not None:
+            if not pdf_stream.started.is_set():
+                pdf_stream.start(filename)
+            await pdf_stream.put(chunk)
+        yield chunk
+
+
+async def store_pdf(
+    db: AsyncIOMotorDatabase,
+    chunks: AsyncIterator[bytes],
+    filename: str,
+    metadata: dict,
+    horoscope_document: Callable[[ObjectId], dict],
+) -> ObjectId:
+    """Uploads PDF to GridFS as it is rendered, then inserts the horoscope document.
+
+    :return: GridFS file id
+    """
+    fs = AsyncIOMotorGridFSBucket(db, bucket_name=DB_NAMES.HOROSCOPES_PDF)
+    grid_in = fs.open_upload_stream(
+        filename, chunk_size_bytes=SERVER_SETTINGS.PDF_CHUNK_SIZE, metadata=metadata
+    )
+    # the upload runs along the render, only the time spent writing is measured
+    upload_seconds = 0.0
+    try:
+        async for chunk in chunks:
+            started_at = time.perf_counter()
+            await grid_in.write(chunk)
+            upload_seconds += time.perf_counter() - started_at
+        started_at = time.perf_counter()
+        await grid_in.close()
+        upload_seconds += time.perf_counter() - started_at
+    except BaseException:
+        await grid_in.abort()
+        raise
+    GRIDFS_UPLOAD_SECONDS.observe(upload_seconds, mode="inline")
+
+    report_stage("store")
+    with MONGO_INSERT_SECONDS.time(collection=DB_NAMES.HOROSCOPES):
+        await db[DB_NAMES.HOROSCOPES].insert_one(horoscope_document(grid_in._id))
+    return grid_in._id
+
+
+async def store_pdf_write_behind(
+    chunks: AsyncIterator[bytes],
+    filename: str,
+    metadata: dict,
+    horoscope_document: Callable[[ObjectId], dict],
+) -> ObjectId:
+    """Collects the PDF and hands it over to the write-behind queue.
+
+    :return: GridFS file id the PDF will be stored under
+    """
+    pdf = bytearray()
+    async for chunk in chunks:
+        pdf += chunk
+
+    report_stage("store")
+    file_id = ObjectId()
+    await PERSISTENCE_QUEUE.submit(
+        PendingHoroscope(
+            file_id=file_id,
+            filename=filename,
+            metadata=metadata,
+            document=horoscope_document(file_id),
+            pdf=bytes(pdf),
+            enqueued_at=time.time(),
+        )
+    )
+    return file_id
+
+
+async def create_horoscope_once(
+    user_input: UserInput,
+    db: AsyncIOMotorDatabase,
+    validation_code_id: ObjectId,
+    start_time: datetime,
+    pdf_stream: Optional[PdfStream] = None,
+) -> HoroscopePdf:
+    """Like `create_horoscope`, but identical concurrent requests share one generation
+    and a repeated request within the result window gets the already stored PDF.
+    Only the request starting the generation gets the PDF chunks to `pdf_stream`,
+    the others read the stored PDF from GridFS. Progress of the shared generation
+    is reported to the `PROGRESS` of every request.
+    """
+    key = request_key(user_input)
+
+    recent = HOROSCOPE_FLIGHTS.recent(key)
+    if recent is not None:
+        logger.info(f"Returning recently generated horoscope {recent.file_id}")
+        return recent
+
+    # no await until the flight starts, it exists exactly while the fanout does
+    fanout = FLIGHT_PROGRESS.setdefault(key, ProgressFanout())
+    listener = PROGRESS.get()
+    fanout.add(listener)
+
+    async def generate() -> HoroscopePdf:
+        PROGRESS.set(fanout)
+        try:
+            with HOROSCOPES_IN_FLIGHT.track_in_progress(
+                horoscope_type=user_input.horoscope_type.value
+            ):
+                return await create_horoscope(
+                    user_input, db, validation_code_id, start_time, pdf_stream
+                )
+        finally:
+            FLIGHT_PROGRESS.pop(key, None)
+
+    try:
+        return await HOROSCOPE_FLIGHTS.run(key, generate)
+    finally:
+        fanout.remove(listener)
+
+
+async def open_horoscope_pdf(
+    db: AsyncIOMotorDatabase, file_id: ObjectId, validation_code_id: ObjectId
+) -> tuple[str, AsyncIterator[bytes]]:
+    """Opens stored horoscope PDF for streaming, PDFs still waiting in the write-behind
+    queue are served from it. Raises `NoFile` if the PDF does not exist or was
+    generated with another access code.
+
+    :return: filename and PDF chunks
+    """
+    pending = await PERSISTENCE_QUEUE.pending_pdf(file_id)
+    if pending is not None:
+        if pending.metadata.get("validation_code_id") != validation_code_id:
+            raise NoFile(f"Horoscope PDF {file_id} not found")
+        return pending.filename, iter_pdf_bytes(
+            pending.pdf, SERVER_SETTINGS.PDF_CHUNK_SIZE
+        )
+
+    fs = AsyncIOMotorGridFSBucket(db, bucket_name=DB_NAMES.HOROSCOPES_PDF)
+    grid_out = await fs.open_download_stream(file_id)
+    if (grid_out.metadata or {}).get("validation_code_id") != validation_code_id:
+        raise NoFile(f"Horoscope PDF {file_id} not found")
+    return grid_out.filename, iter_grid_out(grid_out)
+
+
+async def iter_grid_out(grid_out: AsyncIOMotorGridOut) -> AsyncIterator[bytes]:
+    """Yields GridFS file chunk by chunk."""
+    while chunk := await grid_out.readchunk():
+        yield chunk
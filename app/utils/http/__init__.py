@@ -0,0 +1,24 @@
+from app.config import SERVER_SETTINGS
+from app.utils.http.http_client import HttpClientPool
+
+GEMINI_CLIENT = HttpClientPool(
+    name="gemini",
+    limit=SERVER_SETTINGS.GEMINI_HTTP_POOL_LIMIT,
+    limit_per_host=SERVER_SETTINGS.GEMINI_HTTP_POOL_LIMIT_PER_HOST,
+    keepalive_timeout=SERVER_SETTINGS.HTTP_KEEPALIVE_TIMEOUT,
+    dns_cache_ttl=SERVER_SETTINGS.HTTP_DNS_CACHE_TTL,
+    total_timeout=SERVER_SETTINGS.GEMINI_HTTP_TIMEOUT,
+    connect_timeout=SERVER_SETTINGS.HTTP_CONNECT_TIMEOUT,
+)
+
+GOTENBERG_CLIENT = HttpClientPool(
+    name="gotenberg",
+    limit=SERVER_SETTINGS.GOTENBERG_HTTP_POOL_LIMIT,
+    limit_per_host=SERVER_SETTINGS.GOTENBERG_HTTP_POOL_LIMIT,
+    keepalive_timeout=SERVER_SETTINGS.HTTP_KEEPALIVE_TIMEOUT,
+    dns_cache_ttl=SERVER_SETTINGS.HTTP_DNS_CACHE_TTL,
+    total_timeout=SERVER_SETTINGS.GOTENBERG_HTTP_TIMEOUT,
+    connect_timeout=SERVER_SETTINGS.HTTP_CONNECT_TIMEOUT,
+)
+
+HTTP_CLIENTS = [GEMINI_CLIENT, GOTENBERG_CLIENT]
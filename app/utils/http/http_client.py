@@ -0,0 +1,159 @@
+import time
+from types import SimpleNamespace
+from typing import Optional
+
+import aiohttp
+from loguru import logger
+
+
+class HttpClientPool:
+    """
+    Long-lived aiohttp session with its own connection pool for one upstream service.
+    The session is created in application startup and closed in shutdown, so TCP/TLS
+    handshakes are paid once per worker instead of once per request.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        limit: int,
+        limit_per_host: int,
+        keepalive_timeout: float,
+        dns_cache_ttl: int,
+        total_timeout: float,
+        connect_timeout: float,
+    ) -> None:
+        self.name = name
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.dns_cache_ttl = dns_cache_ttl
+        self.total_timeout = total_timeout
+        self.connect_timeout = connect_timeout
+
+        self._session: Optional[aiohttp.ClientSession] = None
+
+        # pool statistics
+        self.requests_total = 0
+        self.requests_in_flight = 0
+        self.request_errors = 0
+        self.connections_created = 0
+        self.connections_reused = 0
+        self.queued_total = 0
+        self.queued_now = 0
+        self.queue_wait_seconds = 0.0
+        self.dns_cache_hits = 0
+        self.dns_cache_misses = 0
+
+    async def start(self) -> None:
+        """
+        Create the session and its connector (idempotent)
+        """
+        if self._session is not None and not self._session.closed:
+            return
+
+        connector = aiohttp.TCPConnector(
+            limit=self.limit,
+            limit_per_host=self.limit_per_host,
+            keepalive_timeout=self.keepalive_timeout,
+            ttl_dns_cache=self.dns_cache_ttl,
+            use_dns_cache=self.dns_cache_ttl > 0,
+        )
+        self._session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(
+                total=self.total_timeout, connect=self.connect_timeout
+            ),
+            trace_configs=[self._trace_config()],
+        )
+        logger.info(
+            f"HTTP pool '{self.name}' started (limit={self.limit}, "
+            f"limit_per_host={self.limit_per_host}, keepalive={self.keepalive_timeout}s)"
+        )
+
+    async def close(self) -> None:
+        """
+        Close the session and release all pooled connections
+        """
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+            logger.info(f"HTTP pool '{self.name}' closed")
+        self._session = None
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        """
+        Shared session of the pool. Raises if the pool was not started.
+        """
+        if self._session is None or self._session.closed:
+            raise RuntimeError(f"HTTP pool '{self.name}' is not started")
+        return self._session
+
+    def stats(self) -> dict:
+        """
+        Pool counters, `queued_*` values show how often the pool was saturated
+
+        :return: dict with statistics
+        """
+        return {
+            "name": self.name,
+            "started": self._session is not None and not self._session.closed,
+            "limit": self.limit,
+            "limit_per_host": self.limit_per_host,
+            "requests_total": self.requests_total,
+            "requests_in_flight": self.requests_in_flight,
+            "request_errors": self.request_errors,
+            "connections_created": self.connections_created,
+            "connections_reused": self.connections_reused,
+            "queued_total": self.queued_total,
+            "queued_now": self.queued_now,
+            "queue_wait_seconds": round(self.queue_wait_seconds, 6),
+            "dns_cache_hits": self.dns_cache_hits,
+            "dns_cache_misses": self.dns_cache_misses,
+        }
+
+    def _trace_config(self) -> aiohttp.TraceConfig:
+        trace_config = aiohttp.TraceConfig()
+
+        async def on_request_start(session, ctx: SimpleNamespace, params) -> None:
+            self.requests_total += 1
+            self.requests_in_flight += 1
+
+        async def on_request_end(session, ctx: SimpleNamespace, params) -> None:
+            self.requests_in_flight -= 1
+
+        async def on_request_exception(session, ctx: SimpleNamespace, params) -> None:
+            self.requests_in_flight -= 1
+            self.request_errors += 1
+
+        async def on_queued_start(session, ctx: SimpleNamespace, params) -> None:
+            self.queued_total += 1
+            self.queued_now += 1
+            ctx.queued_at = time.perf_counter()
+
+        async def on_queued_end(session, ctx: SimpleNamespace, params) -> None:
+            self.queued_now -= 1
+            self.queue_wait_seconds += time.perf_counter() - ctx.queued_at
+
+        async def on_connection_create_end(session, ctx, params) -> None:
+            self.connections_created += 1
+
+        async def on_connection_reuseconn(session, ctx, params) -> None:
+            self.connections_reused += 1
+
+        async def on_dns_cache_hit(session, ctx, params) -> None:
+            self.dns_cache_hits += 1
+
+        async def on_dns_cache_miss(session, ctx, params) -> None:
+            self.dns_cache_misses += 1
+
+        trace_config.on_request_start.append(on_request_start)
+        trace_config.on_request_end.append(on_request_end)
+        trace_config.on_request_exception.append(on_request_exception)
+        trace_config.on_connection_queued_start.append(on_queued_start)
+        trace_config.on_connection_queued_end.append(on_queued_end)
+        trace_config.on_connection_create_end.append(on_connection_create_end)
+        trace_config.on_connection_reuseconn.append(on_connection_reuseconn)
+        trace_config.on_dns_cache_hit.append(on_dns_cache_hit)
+        trace_config.on_dns_cache_miss.append(on_dns_cache_miss)
+        return trace_config
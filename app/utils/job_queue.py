@@ -0,0 +1,312 @@
+import asyncio
+from datetime import datetime, timedelta
+from typing import Optional
+
+from bson import ObjectId
+from fastapi import HTTPException
+from loguru import logger
+from motor.motor_asyncio import AsyncIOMotorCollection
+from pymongo.errors import PyMongoError
+
+from app.config import DB_NAMES, SERVER_SETTINGS
+from app.models.horoscop import ContentResponse, JobStatus, UserInput
+from app.utils.database import DB
+from app.utils.horoscope_service import GENERATION_ERROR, create_horoscope_once
+from app.utils.progress import PROGRESS, HoroscopeProgress
+
+JOB_INTERRUPTED_ERROR = "Server se restartoval. Zkuste to prosím znovu."
+UNFINISHED_STATUSES = [JobStatus.QUEUED, JobStatus.RUNNING]
+
+
+class JobQueueFull(Exception):
+    pass
+
+
+class JobProgress(HoroscopeProgress):
+    """
+    Mirrors generation progress into the job document. Updates are written in the
+    background and guarded by a sequence number, so a late write never overwrites
+    a newer state.
+    """
+
+    def __init__(self, collection: AsyncIOMotorCollection, job_id: ObjectId) -> None:
+        super().__init__()
+        self.collection = collection
+        self.job_id = job_id
+        self._seq = 0
+        self._pending: set[asyncio.Task] = set()
+
+    def on_stage(self, stage: str) -> None:
+        self.push()
+
+    def on_section(self, response: ContentResponse) -> None:
+        self.push()
+
+    def push(self) -> None:
+        self._seq += 1
+        task = asyncio.create_task(
+            self._write(
+                self._seq,
+                {
+                    "stage": self.stage,
+                    "sections_done": self.sections_done,
+                    "sections_total": self.sections_total,
+                },
+            )
+        )
+        self._pending.add(task)
+        task.add_done_callback(self._pending.discard)
+
+    async def flush(self) -> None:
+        if self._pending:
+            await asyncio.gather(*self._pending, return_exceptions=True)
+
+    async def _write(self, seq: int, fields: dict) -> None:
+        try:
+            await self.collection.update_one(
+                {"_id": self.job_id, "progress_seq": {"$lt": seq}},
+                {"$set": {**fields, "progress_seq": seq, "updated_at": datetime.now()}},
+            )
+        except PyMongoError as err:
+            logger.warning(f"Failed to update progress of job {self.job_id}: {err}")
+
+
+class HoroscopeJobQueue:
+    """
+    Local worker pool running horoscope generation jobs from a bounded queue.
+    Job state lives in MongoDB, so any worker process can answer status requests.
+
+    Unfinished jobs carry the id of their process, which keeps their `heartbeat_at`
+    fresh. Jobs whose process died (crash, kill) stop getting heartbeats and are
+    failed by the sweep of any other (or the restarted) process.
+    """
+
+    def __init__(self, workers: int, max_size: int, stale_after: float) -> None:
+        self.workers = workers
+        self.max_size = max_size
+        self.stale_after = stale_after
+        self.owner = ObjectId()
+
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: list[asyncio.Task] = []
+        self._heartbeat_task: Optional[asyncio.Task] = None
+        # places taken by submits still inserting their job document
+        self._reserved = 0
+
+        self.submitted = 0
+        self.rejected = 0
+        self.completed = 0
+        self.failed = 0
+        self.orphaned = 0
+
+    def _collection(self) -> AsyncIOMotorCollection:
+        return DB.get_database()[DB_NAMES.HOROSCOPE_JOBS]
+
+    async def start(self) -> None:
+        # jobs left unfinished by a crashed process
+        await self.sweep_orphaned()
+
+        self._queue = asyncio.Queue(maxsize=self.max_size)
+        self._tasks = [
+            asyncio.create_task(self._worker(), name=f"horoscope-job-worker-{i}")
+            for i in range(self.workers)
+        ]
+        self._heartbeat_task = asyncio.create_task(
+            self._heartbeat_loop(), name="horoscope-job-heartbeat"
+        )
+        logger.info(f"Job queue started with {self.workers} workers")
+
+    async def stop(self) -> None:
+        if self._heartbeat_task is not None:
+            self._heartbeat_task.cancel()
+            await asyncio.gather(self._heartbeat_task, return_exceptions=True)
+            self._heartbeat_task = None
+
+        # running jobs are failed by their workers when cancelled
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+        # jobs still waiting in the queue would never finish
+        while self._queue is not None and not self._queue.empty():
+            job_id, _, _ = self._queue.get_nowait()
+            await self._finish(
+                job_id, {"status": JobStatus.FAILED, "error": JOB_INTERRUPTED_ERROR}
+            )
+        logger.info("Job queue stopped")
+
+    async def sweep_orphaned(self) -> None:
+        """
+        Fail unfinished jobs without a heartbeat for `stale_after` seconds
+        """
+        now = datetime.now()
+        try:
+            result = await self._collection().update_many(
+                {
+                    "status": {"$in": UNFINISHED_STATUSES},
+                    "heartbeat_at": {"$lt": now - timedelta(seconds=self.stale_after)},
+                },
+                {
+                    "$set": {
+                        "status": JobStatus.FAILED,
+                        "error": JOB_INTERRUPTED_ERROR,
+                        "updated_at": now,
+                    }
+                },
+            )
+        except PyMongoError as err:
+            logger.warning(f"Failed to sweep orphaned jobs: {err}")
+            return
+
+        if result.modified_count:
+            self.orphaned += result.modified_count
+            logger.warning(
+                f"{result.modified_count} jobs of a stopped process marked as failed"
+            )
+
+    async def _heartbeat_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.stale_after / 4)
+            try:
+                await self._collection().update_many(
+                    {"owner": self.owner, "status": {"$in": UNFINISHED_STATUSES}},
+                    {"$set": {"heartbeat_at": datetime.now()}},
+                )
+            except PyMongoError as err:
+                logger.warning(f"Failed to update heartbeat of jobs: {err}")
+            await self.sweep_orphaned()
+
+    async def submit(self, user_input: UserInput, validation_code_id: ObjectId) -> dict:
+        """
+        Create job document and enqueue the job
+
+        :return: inserted job document
+        """
+        if self._queue is None or self._full():
+            self.rejected += 1
+            raise JobQueueFull()
+        # reserved before the insert, concurrent submits cannot overfill the queue
+        self._reserved += 1
+        try:
+            job = await self._insert(user_input, validation_code_id)
+            self._queue.put_nowait((job["_id"], user_input, validation_code_id))
+        finally:
+            self._reserved -= 1
+        self.submitted += 1
+        return job
+
+    def _full(self) -> bool:
+        assert self._queue is not None
+        if self.max_size <= 0:
+            return False
+        return self._queue.qsize() + self._reserved >= self.max_size
+
+    async def _insert(
+        self, user_input: UserInput, validation_code_id: ObjectId
+    ) -> dict:
+        now = datetime.now()
+        job = {
+            "_id": ObjectId(),
+            "status": JobStatus.QUEUED,
+            "stage": None,
+            "sections_done": 0,
+            "sections_total": len(user_input.horoscope_type.get_prompts()),
+            "horoscope_type": user_input.horoscope_type,
+            "validation_code_id": validation_code_id,
+            "progress_seq": 0,
+            "owner": self.owner,
+            "heartbeat_at": now,
+            "created_at": now,
+            "updated_at": now,
+        }
+        await self._collection().insert_one(job)
+        return job
+
+    async def get(
+        self, job_id: ObjectId, validation_code_id: ObjectId
+    ) -> Optional[dict]:
+        """
+        Job submitted with the access code, jobs of other codes are not found
+        """
+        return await self._collection().find_one(
+            {"_id": job_id, "validation_code_id": validation_code_id}
+        )
+
+    async def _worker(self) -> None:
+        assert self._queue is not None
+        while True:
+            job_id, user_input, validation_code_id = await self._queue.get()
+            try:
+                await self._run(job_id, user_input, validation_code_id)
+            except asyncio.CancelledError:
+                # shutdown in the middle of the job, it would stay running forever
+                self.failed += 1
+                await self._finish(
+                    job_id, {"status": JobStatus.FAILED, "error": JOB_INTERRUPTED_ERROR}
+                )
+                raise
+            except Exception as err:
+                logger.exception(f"Job {job_id} crashed: {err}")
+            finally:
+                self._queue.task_done()
+
+    async def _run(
+        self, job_id: ObjectId, user_input: UserInput, validation_code_id: ObjectId
+    ) -> None:
+        progress = JobProgress(self._collection(), job_id)
+        progress.sections_total = len(user_input.horoscope_type.get_prompts())
+        token = PROGRESS.set(progress)
+        await self._collection().update_one(
+            {"_id": job_id},
+            {"$set": {"status": JobStatus.RUNNING, "updated_at": datetime.now()}},
+        )
+
+        try:
+            horoscope_pdf = await create_horoscope_once(
+                user_input, DB.get_database(), validation_code_id, datetime.now()
+            )
+        except HTTPException as err:
+            self.failed += 1
+            result = {"status": JobStatus.FAILED, "error": err.detail}
+        except Exception as err:
+            logger.error(f"Error during horoscope job {job_id}: {err}")
+            self.failed += 1
+            result = {"status": JobStatus.FAILED, "error": GENERATION_ERROR}
+        else:
+            self.completed += 1
+            result = {
+                "status": JobStatus.DONE,
+                "file_id": horoscope_pdf.file_id,
+                "filename": horoscope_pdf.filename,
+            }
+        finally:
+            PROGRESS.reset(token)
+
+        await progress.flush()
+        await self._finish(job_id, result)
+
+    async def _finish(self, job_id: ObjectId, fields: dict) -> None:
+        await self._collection().update_one(
+            {"_id": job_id},
+            {"$set": {**fields, "updated_at": datetime.now()}},
+        )
+
+    def stats(self) -> dict:
+        return {
+            "workers": len(self._tasks),
+            "queue_size": self._queue.qsize() if self._queue is not None else 0,
+            "queue_max_size": self.max_size,
+            "submitted": self.submitted,
+            "rejected": self.rejected,
+            "completed": self.completed,
+            "failed": self.failed,
+            "orphaned": self.orphaned,
+        }
+
+
+JOB_QUEUE = HoroscopeJobQueue(
+    workers=SERVER_SETTINGS.JOB_WORKERS,
+    max_size=SERVER_SETTINGS.JOB_QUEUE_SIZE,
+    stale_after=SERVER_SETTINGS.JOB_STALE_AFTER,
+)
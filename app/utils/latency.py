@@ -0,0 +1,40 @@
+import math
+from collections import deque
+from typing import Optional
+
+
+class LatencyWindow:
+    """
+    Rolling window of the last `size` latencies (in seconds).
+    """
+
+    def __init__(self, size: int) -> None:
+        self._samples: deque[float] = deque(maxlen=size)
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def record(self, seconds: float) -> None:
+        self._samples.append(seconds)
+
+    def percentile(self, q: float) -> Optional[float]:
+        """
+        Nearest-rank percentile of the window
+
+        :param q: percentile in range 0-100
+        :return: latency in seconds or None for an empty window
+        """
+        if not self._samples:
+            return None
+        ordered = sorted(self._samples)
+        index = min(max(math.ceil(q / 100 * len(ordered)) - 1, 0), len(ordered) - 1)
+        return ordered[index]
+
+    def stats(self) -> dict:
+        p50 = self.percentile(50)
+        p95 = self.percentile(95)
+        return {
+            "samples": len(self._samples),
+            "p50": round(p50, 3) if p50 is not None else None,
+            "p95": round(p95, 3) if p95 is not None else None,
+        }
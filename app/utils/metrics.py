@@ -0,0 +1,374 @@
+import functools
+import inspect
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Iterator, Optional, TypeVar
+
+from app.config import SERVER_SETTINGS
+
+# seconds, from a template render up to a whole horoscope
+LATENCY_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+    120.0,
+)
+
+
+def format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if value == int(value):
+        return str(int(value))
+    return repr(value)
+
+
+def escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_labels(names: tuple[str, ...], values: tuple[str, ...]) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(
+        f'{name}="{escape_label(value)}"' for name, value in zip(names, values)
+    )
+    return f"{{{pairs}}}"
+
+
+class Metric:
+    """
+    Metric in the Prometheus text format, values are kept per combination of labels.
+    Updates are locked, templates are also rendered in worker threads.
+    """
+
+    type = ""
+
+    def __init__(
+        self, name: str, documentation: str, labelnames: tuple[str, ...] = ()
+    ) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict[str, str]) -> tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(
+                f"Metric {self.name} expects labels {self.labelnames}, got {tuple(labels)}"
+            )
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self) -> Iterator[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type}",
+            *self.samples(),
+        ]
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(
+        self, name: str, documentation: str, labelnames: tuple[str, ...] = ()
+    ) -> None:
+        super().__init__(name, documentation, labelnames)
+        self._values: dict[tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels: str) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def totals(self) -> dict[tuple[str, ...], float]:
+        with self._lock:
+            return dict(self._values)
+
+    def samples(self) -> Iterator[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        for key, value in values:
+            labels = format_labels(self.labelnames, key)
+            yield f"{self.name}{labels} {format_value(value)}"
+
+
+class Gauge(Counter):
+    type = "gauge"
+
+    def dec(self, amount: float = 1.0, **labels: str) -> None:
+        self.inc(-amount, **labels)
+
+    @contextmanager
+    def track_in_progress(self, **labels: str) -> Iterator[None]:
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+
+class Histogram(Metric):
+    """Cumulative histogram, observations are seconds of a monotonic clock."""
+
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = LATENCY_BUCKETS,
+    ) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        # per labels - count of each bucket (not cumulative), sum, count
+        self._values: dict[tuple[str, ...], tuple[list[int], list[float]]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        index = next(i for i, bound in enumerate(self.buckets) if value <= bound)
+        with self._lock:
+            if key not in self._values:
+                self._values[key] = ([0] * len(self.buckets), [0.0, 0.0])
+            counts, totals = self._values[key]
+            counts[index] += 1
+            totals[0] += value
+            totals[1] += 1
+
+    @contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        """Observe duration of the block, also when it raises."""
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started_at, **labels)
+
+    def count(self, **labels: str) -> int:
+        values = self._values.get(self._key(labels))
+        return int(values[1][1]) if values is not None else 0
+
+    def totals(self) -> dict[tuple[str, ...], tuple[float, int]]:
+        """
+        Sum and count of observations
+
+        :return: per label values
+        """
+        with self._lock:
+            return {
+                key: (totals[0], int(totals[1]))
+                for key, (_, totals) in self._values.items()
+            }
+
+    def samples(self) -> Iterator[str]:
+        with self._lock:
+            values = [
+                (key, list(counts), tuple(totals))
+                for key, (counts, totals) in sorted(self._values.items())
+            ]
+        for key, counts, (total, count) in values:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                labels = format_labels(
+                    self.labelnames + ("le",), key + (format_value(bound),)
+                )
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = format_labels(self.labelnames, key)
+            yield f"{self.name}_sum{labels} {format_value(total)}"
+            yield f"{self.name}_count{labels} {format_value(count)}"
+
+
+M = TypeVar("M", bound=Metric)
+
+
+class MetricsRegistry:
+    """
+    Metrics of the application exposed by `/status/metrics`.
+
+    Values live in the process memory and are reset by a restart, every worker
+    process of the server exposes its own values.
+    """
+
+    def __init__(self) -> None:
+        self._metrics: dict[str, Metric] = {}
+
+    def _register(self, metric: M) -> M:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(
+        self, name: str, documentation: str, labelnames: tuple[str, ...] = ()
+    ) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(
+        self, name: str, documentation: str, labelnames: tuple[str, ...] = ()
+    ) -> Gauge:
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = LATENCY_BUCKETS,
+    ) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        return "\n".join(metric.render() for metric in self._metrics.values()) + "\n"
+
+
+def timed(histogram: Histogram, **labels: str) -> Callable[[Callable], Callable]:
+    """Decorator observing duration of each call, sync or async."""
+
+    def decorator(func: Callable) -> Callable:
+        if inspect.iscoroutinefunction(func):
+
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with histogram.time(**labels):
+                    return await func(*args, **kwargs)
+
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with histogram.time(**labels):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def token_cost(model: Optional[str], input_tokens: int, output_tokens: int) -> float:
+    """
+    Price of the tokens by `GEMINI_TOKEN_PRICES`
+
+    :return: USD, 0 for models without a price
+    """
+    prices = SERVER_SETTINGS.GEMINI_TOKEN_PRICES.get(model or "")
+    if not prices:
+        return 0.0
+    return (
+        input_tokens * prices.get("input", 0.0)
+        + output_tokens * prices.get("output", 0.0)
+    ) / 1_000_000
+
+
+class InFlightMiddleware:
+    """ASGI middleware counting HTTP requests until their response is fully sent."""
+
+    def __init__(self, app) -> None:
+        self.app = app
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        with HTTP_IN_FLIGHT.track_in_progress():
+            await self.app(scope, receive, send)
+
+
+METRICS = MetricsRegistry()
+
+HTTP_IN_FLIGHT = METRICS.gauge(
+    "http_requests_in_flight", "HTTP requests being processed."
+)
+HOROSCOPES_IN_FLIGHT = METRICS.gauge(
+    "horoscope_generations_in_flight",
+    "Horoscopes being generated.",
+    ("horoscope_type",),
+)
+HOROSCOPE_PHASE_SECONDS = METRICS.histogram(
+    "horoscope_phase_seconds",
+    "Duration of the LLM generation and the PDF processing of a horoscope.",
+    ("horoscope_type", "phase"),
+)
+NODE_SECONDS = METRICS.histogram(
+    "horoscope_node_seconds",
+    "Duration of the LangGraph nodes of the horoscope workflow.",
+    ("node",),
+)
+SECTION_SECONDS = METRICS.histogram(
+    "horoscope_section_seconds",
+    "Duration of a section generation (cache, Gemini calls, retries, fallbacks).",
+    ("key",),
+)
+GEMINI_ATTEMPTS = METRICS.histogram(
+    "gemini_call_attempts",
+    "Gemini requests made by one generateContent call, 1 means no retry.",
+    ("key",),
+    buckets=tuple(range(1, SERVER_SETTINGS.REQUEST_RETRY_COUNT + 1)),
+)
+GEMINI_RETRIES = METRICS.counter(
+    "gemini_retries_total",
+    "Retried Gemini requests by the reason (HTTP status or connection error).",
+    ("key", "reason"),
+)
+GEMINI_BATCH_JOB_SECONDS = METRICS.histogram(
+    "gemini_batch_job_seconds",
+    "Duration of Gemini batch jobs from submission to their final state.",
+    ("state",),
+    buckets=(10, 30, 60, 300, 900, 1800, 3600, 4 * 3600, 12 * 3600, 24 * 3600),
+)
+TEMPLATE_RENDER_SECONDS = METRICS.histogram(
+    "template_render_seconds", "Duration of Jinja template rendering.", ("template",)
+)
+PDF_RENDER_SECONDS = METRICS.histogram(
+    "pdf_render_seconds",
+    "Duration of HTML to PDF conversion, without the wait for a free slot.",
+    ("backend",),
+)
+GRIDFS_UPLOAD_SECONDS = METRICS.histogram(
+    "gridfs_upload_seconds",
+    "Time spent writing a PDF to GridFS.",
+    ("mode",),
+)
+MONGO_INSERT_SECONDS = METRICS.histogram(
+    "mongo_insert_seconds", "Duration of document inserts.", ("collection",)
+)
+PARTIAL_RENDERS = METRICS.counter(
+    "horoscope_partial_renders_total",
+    "Horoscopes rendered without their failed non-critical sections.",
+    ("horoscope_type",),
+)
+INPUT_TOKENS = METRICS.counter(
+    "horoscope_input_tokens_total",
+    "Gemini input tokens of generated horoscopes.",
+    ("horoscope_type",),
+)
+OUTPUT_TOKENS = METRICS.counter(
+    "horoscope_output_tokens_total",
+    "Gemini output tokens of generated horoscopes.",
+    ("horoscope_type",),
+)
+TOKEN_COST = METRICS.counter(
+    "horoscope_token_cost_usd_total",
+    "Price of Gemini tokens of generated horoscopes by GEMINI_TOKEN_PRICES.",
+    ("horoscope_type",),
+)
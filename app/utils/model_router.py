@@ -0,0 +1,219 @@
+import json
+from pathlib import Path
+from typing import Optional
+
+from loguru import logger
+from pydantic import BaseModel, Field
+
+from app.config import SERVER_SETTINGS
+from app.utils.gemini_api import gemini_model
+from app.utils.latency import LatencyWindow
+
+# statuses meaning the model is overloaded or out of quota, another model may still work
+MODEL_FALLBACK_STATUSES = {429, 503}
+
+
+def latency_key(model: str, kind: str) -> str:
+    """
+    Key of the latency window, calls other than sections (e.g. the structured call
+    generating all sections at once) are kept apart from the section calls of the model
+    """
+    return model if kind == "section" else f"{model}:{kind}"
+
+
+class GeminiModelUnavailable(Exception):
+    """Model answered 429/503, the call should move on to a fallback model."""
+
+    def __init__(self, model: str, status: int) -> None:
+        super().__init__(f"Model {model} unavailable (status {status})")
+        self.model = model
+        self.status = status
+
+
+class GeminiModelInfo(BaseModel):
+    """Entry of the Gemini model catalog (`gemini_models.json`)."""
+
+    name: str
+    display_name: str = Field(default="", validation_alias="displayName")
+    input_token_limit: int = Field(default=0, validation_alias="inputTokenLimit")
+    output_token_limit: int = Field(default=0, validation_alias="outputTokenLimit")
+    supported_generation_methods: list[str] = Field(
+        default=[], validation_alias="supportedGenerationMethods"
+    )
+
+    @property
+    def model_id(self) -> str:
+        return self.name.removeprefix("models/")
+
+
+class ModelStats:
+    def __init__(self, window: int) -> None:
+        self.latency = LatencyWindow(window)
+        self.calls = 0
+        self.errors = 0
+        self.unavailable = 0
+
+    def stats(self) -> dict:
+        return {
+            **self.latency.stats(),
+            "calls": self.calls,
+            "errors": self.errors,
+            "unavailable": self.unavailable,
+        }
+
+
+class ModelRouter:
+    """
+    Chooses the Gemini model of each section.
+
+    - the model comes from `MODEL_ROUTING_SECTIONS` (per section key) or the default
+      model, followed by its `MODEL_ROUTING_FALLBACKS`
+    - only models of the catalog supporting `generateContent` are used
+    - a model whose rolling p95 latency breaches `MODEL_LATENCY_SLO` is moved behind
+      its first fallback still within the SLO, except for occasional probe calls
+    - callers move on to the next candidate on 429/503 (`GeminiModelUnavailable`)
+    """
+
+    def __init__(self, window: int, min_samples: int, probe_every: int = 10) -> None:
+        self.window = window
+        self.min_samples = min_samples
+        self.probe_every = probe_every
+        self._decisions = 0
+        self.catalog: dict[str, GeminiModelInfo] = {}
+        self._stats: dict[str, ModelStats] = {}
+        self.fallbacks_used = 0
+        self.slo_reroutes = 0
+
+    @property
+    def enabled(self) -> bool:
+        return SERVER_SETTINGS.MODEL_ROUTING_ENABLED
+
+    def load(self, path: str) -> None:
+        """
+        Load model catalog, configured models missing from it are reported
+        """
+        try:
+            data = json.loads(Path(path).read_text(encoding="utf-8"))
+        except (OSError, ValueError) as err:
+            logger.warning(f"Gemini model catalog '{path}' not loaded: {err}")
+            return
+
+        models = [GeminiModelInfo.model_validate(item) for item in data["models"]]
+        self.catalog = {
+            model.model_id: model
+            for model in models
+            if "generateContent" in model.supported_generation_methods
+        }
+        logger.info(f"Gemini model catalog loaded, {len(self.catalog)} models")
+
+        configured = {
+            self.default_model(),
+            *SERVER_SETTINGS.MODEL_ROUTING_SECTIONS.values(),
+            *(m for ms in SERVER_SETTINGS.MODEL_ROUTING_FALLBACKS.values() for m in ms),
+        }
+        for model in sorted(configured - set(self.catalog)):
+            logger.warning(f"Configured Gemini model '{model}' is not in the catalog")
+
+    def default_model(self) -> str:
+        return SERVER_SETTINGS.MODEL_ROUTING_DEFAULT or gemini_model()
+
+    def _usable(self, model: str) -> bool:
+        if not self.catalog:
+            return True
+        info = self.catalog.get(model)
+        return (
+            info is not None
+            and info.output_token_limit
+            >= SERVER_SETTINGS.GEMINI_ESTIMATED_OUTPUT_TOKENS
+        )
+
+    def _breaches_slo(self, model: str) -> bool:
+        stats = self._stats.get(model)
+        if stats is None or len(stats.latency) < self.min_samples:
+            return False
+        return stats.latency.percentile(95) > SERVER_SETTINGS.MODEL_LATENCY_SLO
+
+    def _configured(self, section_key: str) -> list[str]:
+        if not self.enabled:
+            return [gemini_model()]
+
+        preferred = SERVER_SETTINGS.MODEL_ROUTING_SECTIONS.get(
+            section_key, self.default_model()
+        )
+        models: list[str] = []
+        for model in [
+            preferred,
+            *SERVER_SETTINGS.MODEL_ROUTING_FALLBACKS.get(preferred, []),
+        ]:
+            if model not in models and self._usable(model):
+                models.append(model)
+        return models or [gemini_model()]
+
+    def routed_model(self, section_key: str) -> str:
+        """
+        Model configured for the section, regardless of latency reroutes and fallbacks
+        """
+        return self._configured(section_key)[0]
+
+    def candidates(self, section_key: str) -> list[str]:
+        """
+        Models to try for the section in order
+
+        :return: preferred model followed by its fallbacks
+        """
+        models = self._configured(section_key)
+        if not self.enabled:
+            return models
+
+        self._decisions += 1
+        # every `probe_every`-th call keeps the preferred model to refresh its latency
+        if self._breaches_slo(models[0]) and self._decisions % self.probe_every:
+            healthy = next((m for m in models[1:] if not self._breaches_slo(m)), None)
+            if healthy is not None:
+                self.slo_reroutes += 1
+                models.remove(healthy)
+                models.insert(0, healthy)
+        return models
+
+    def _model_stats(self, model: str) -> ModelStats:
+        if model not in self._stats:
+            self._stats[model] = ModelStats(self.window)
+        return self._stats[model]
+
+    def record(
+        self, model: str, seconds: float, ok: bool, kind: str = "section"
+    ) -> None:
+        stats = self._model_stats(latency_key(model, kind))
+        stats.calls += 1
+        if ok:
+            stats.latency.record(seconds)
+        else:
+            stats.errors += 1
+
+    def record_unavailable(self, model: str) -> None:
+        self._model_stats(model).unavailable += 1
+        self.fallbacks_used += 1
+
+    def samples(self, model: str) -> int:
+        stats = self._stats.get(model)
+        return len(stats.latency) if stats is not None else 0
+
+    def percentile(self, model: str, q: float) -> Optional[float]:
+        stats = self._stats.get(model)
+        return stats.latency.percentile(q) if stats is not None else None
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "default_model": self.default_model(),
+            "catalog_models": len(self.catalog),
+            "fallbacks_used": self.fallbacks_used,
+            "slo_reroutes": self.slo_reroutes,
+            "models": {model: stats.stats() for model, stats in self._stats.items()},
+        }
+
+
+MODEL_ROUTER = ModelRouter(
+    window=SERVER_SETTINGS.MODEL_LATENCY_WINDOW,
+    min_samples=SERVER_SETTINGS.MODEL_LATENCY_MIN_SAMPLES,
+)
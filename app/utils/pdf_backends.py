@@ -0,0 +1,210 @@
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import AsyncIterator, Optional
+
+import aiohttp
+
+from app.config import SERVER_SETTINGS
+from app.utils.http import GOTENBERG_CLIENT
+from app.utils.template_engine import TEMPLATE_DIR
+
+
+class PdfRenderError(Exception):
+    """Conversion failed, `detail` ends up in the HTTP error of the request."""
+
+    def __init__(self, detail: str) -> None:
+        super().__init__(detail)
+        self.detail = detail
+
+
+class PdfBackend:
+    """
+    HTML to PDF converter used by the render pool.
+
+    - `options()` are part of the PDF cache key
+    - `max_concurrency` is the number of conversions the backend handles at once
+    """
+
+    name: str = ""
+    max_concurrency: int = 1
+
+    async def start(self) -> None:
+        pass
+
+    async def close(self) -> None:
+        pass
+
+    def options(self) -> dict[str, str]:
+        return {}
+
+    async def convert(self, html_content: str, options: dict[str, str]) -> bytes:
+        raise NotImplementedError
+
+    async def convert_stream(
+        self, html_content: str, options: dict[str, str], chunk_size: int
+    ) -> AsyncIterator[bytes]:
+        """
+        Converted PDF in chunks of at most `chunk_size` bytes, backends without
+        a streamed output convert the whole document first
+        """
+        pdf = await self.convert(html_content, options)
+        for start in range(0, len(pdf), chunk_size):
+            yield pdf[start : start + chunk_size]
+
+
+def gotenberg_options() -> dict[str, str]:
+    """
+    Form fields of the Chromium route configured in `Settings`,
+    documentation: https://gotenberg.dev/docs/routes#page-properties-chromium
+
+    :return: options without the ones left to Gotenberg defaults
+    """
+    options = {
+        "paperWidth": SERVER_SETTINGS.PDF_PAPER_WIDTH,
+        "paperHeight": SERVER_SETTINGS.PDF_PAPER_HEIGHT,
+        "pdfa": SERVER_SETTINGS.PDF_PDFA,
+        **SERVER_SETTINGS.GOTENBERG_EXTRA_OPTIONS,
+    }
+    return {name: value for name, value in options.items() if value}
+
+
+class GotenbergBackend(PdfBackend):
+    """Conversion by the Chromium route of Gotenberg."""
+
+    name = "gotenberg"
+
+    def __init__(self, max_concurrency: int) -> None:
+        self.max_concurrency = max_concurrency
+
+    def options(self) -> dict[str, str]:
+        return gotenberg_options()
+
+    def _form_data(
+        self, html_content: str, options: dict[str, str]
+    ) -> aiohttp.FormData:
+        # documentation: https://gotenberg.dev/docs/routes
+        form_data = aiohttp.FormData()
+        form_data.add_field(
+            "files", html_content, filename="index.html", content_type="text/html"
+        )
+        for name, value in options.items():
+            form_data.add_field(name, value)
+        return form_data
+
+    def _post(self, html_content: str, options: dict[str, str]):
+        return GOTENBERG_CLIENT.session.post(
+            SERVER_SETTINGS.GOTENBERG_API_URL,
+            data=self._form_data(html_content, options),
+            auth=aiohttp.BasicAuth(
+                SERVER_SETTINGS.GOTENBERG_AUTH_USERNAME,
+                SERVER_SETTINGS.GOTENBERG_AUTH_PASSWORD,
+            ),
+        )
+
+    async def convert(self, html_content: str, options: dict[str, str]) -> bytes:
+        try:
+            async with self._post(html_content, options) as response:
+                if response.status != 200:
+                    raise PdfRenderError(str(response.status))
+                return await response.read()
+        except aiohttp.ClientError as err:
+            raise PdfRenderError(repr(err))
+
+    async def convert_stream(
+        self, html_content: str, options: dict[str, str], chunk_size: int
+    ) -> AsyncIterator[bytes]:
+        try:
+            async with self._post(html_content, options) as response:
+                if response.status != 200:
+                    raise PdfRenderError(str(response.status))
+                async for chunk in response.content.iter_chunked(chunk_size):
+                    yield chunk
+        except aiohttp.ClientError as err:
+            raise PdfRenderError(repr(err))
+
+
+def weasyprint_version() -> str:
+    # imported in the worker processes only, the API process does not load WeasyPrint
+    import weasyprint
+
+    return weasyprint.__version__
+
+
+def weasyprint_render(html_content: str, options: dict[str, str]) -> bytes:
+    """Render HTML to PDF with WeasyPrint, runs in a worker process."""
+    from weasyprint import CSS, HTML
+
+    stylesheets = []
+    if options.get("paperWidth") and options.get("paperHeight"):
+        stylesheets.append(
+            CSS(
+                string=f"@page {{ size: {options['paperWidth']}in "
+                f"{options['paperHeight']}in; }}"
+            )
+        )
+
+    return HTML(string=html_content, base_url=str(TEMPLATE_DIR)).write_pdf(
+        stylesheets=stylesheets,
+        pdf_variant=options.get("pdfa", "").lower() or None,
+    )
+
+
+class WeasyPrintBackend(PdfBackend):
+    """
+    In-process conversion with WeasyPrint in a pool of `workers` processes, so the
+    event loop never blocks on layout. WeasyPrint is an optional dependency,
+    the backend refuses to start without it.
+    """
+
+    name = "weasyprint"
+
+    def __init__(self, workers: int) -> None:
+        self.max_concurrency = workers
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    async def start(self) -> None:
+        # spawned workers, forking a process running the event loop is not safe
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.max_concurrency,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+        try:
+            await asyncio.get_running_loop().run_in_executor(
+                self._executor, weasyprint_version
+            )
+        except (ImportError, OSError) as err:
+            await self.close()
+            raise RuntimeError(
+                f"PDF_BACKEND=weasyprint requires WeasyPrint and its system "
+                f"libraries (pango): {err}"
+            ) from err
+
+    async def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def options(self) -> dict[str, str]:
+        options = {
+            "paperWidth": SERVER_SETTINGS.PDF_PAPER_WIDTH,
+            "paperHeight": SERVER_SETTINGS.PDF_PAPER_HEIGHT,
+            "pdfa": SERVER_SETTINGS.PDF_PDFA,
+        }
+        return {name: value for name, value in options.items() if value}
+
+    async def convert(self, html_content: str, options: dict[str, str]) -> bytes:
+        if self._executor is None:
+            raise RuntimeError("WeasyPrint backend not started")
+        try:
+            return await asyncio.get_running_loop().run_in_executor(
+                self._executor, weasyprint_render, html_content, options
+            )
+        except (ValueError, OSError) as err:
+            raise PdfRenderError(repr(err))
+
+
+def create_pdf_backend(name: str) -> PdfBackend:
+    if name == "weasyprint":
+        return WeasyPrintBackend(SERVER_SETTINGS.PDF_PROCESS_WORKERS)
+    return GotenbergBackend(SERVER_SETTINGS.GOTENBERG_MAX_CONCURRENT_RENDERS)
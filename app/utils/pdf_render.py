@@ -0,0 +1,247 @@
+import asyncio
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional
+
+from fastapi import HTTPException
+from loguru import logger
+
+from app.config import SERVER_SETTINGS
+from app.utils.latency import LatencyWindow
+from app.utils.metrics import PDF_RENDER_SECONDS
+from app.utils.pdf_backends import PdfBackend, PdfRenderError, create_pdf_backend
+from app.utils.single_flight import SingleFlight
+
+
+class PdfRenderPool:
+    """
+    Bounded HTML to PDF conversions with a `PdfBackend` (Gotenberg or WeasyPrint).
+
+    - at most `backend.max_concurrency` conversions run at once, the rest wait in the queue
+    - identical renders (same HTML and options) in flight share one conversion,
+      finished PDFs are kept in an LRU cache bounded by count and total size
+    - each conversion is limited by `timeout` seconds
+    - `render_stream` passes the PDF on in chunks of `chunk_size` bytes as the backend
+      returns it, the slot is released once the backend response is read; these
+      renders are served from the cache but not stored to it or shared
+    """
+
+    def __init__(
+        self,
+        backend: PdfBackend,
+        timeout: float,
+        cache_size: int,
+        cache_max_bytes: int,
+        chunk_size: int = 255 * 1024,
+    ) -> None:
+        self.backend = backend
+        self.max_concurrency = backend.max_concurrency
+        self.timeout = timeout
+        self.chunk_size = chunk_size
+        self.cache_size = cache_size
+        self.cache_max_bytes = cache_max_bytes
+
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._flights: SingleFlight[bytes] = SingleFlight("pdf-render", 0)
+        self._cache: OrderedDict[str, bytes] = OrderedDict()
+        self._cache_bytes = 0
+
+        self.waiting = 0
+        self.rendering = 0
+        self.renders = 0
+        self.failures = 0
+        self.timeouts = 0
+        self.cache_hits = 0
+        self.queue_wait_seconds = 0.0
+        self.queue_wait_max = 0.0
+        self.render_latency = LatencyWindow(200)
+
+    async def start(self) -> None:
+        await self.backend.start()
+        logger.info(f"PDF backend '{self.backend.name}' started")
+
+    async def close(self) -> None:
+        await self.backend.close()
+
+    def cache_key(self, html_content: str, options: dict[str, str]) -> str:
+        digest = hashlib.sha256(self.backend.name.encode("utf-8"))
+        digest.update(html_content.encode("utf-8"))
+        digest.update(json.dumps(options, sort_keys=True).encode("utf-8"))
+        return digest.hexdigest()
+
+    def _cache_get(self, key: str) -> Optional[bytes]:
+        pdf = self._cache.get(key)
+        if pdf is not None:
+            self._cache.move_to_end(key)
+        return pdf
+
+    def _cache_put(self, key: str, pdf: bytes) -> None:
+        if self.cache_size <= 0 or len(pdf) > self.cache_max_bytes:
+            return
+        if key in self._cache:
+            return
+        self._cache[key] = pdf
+        self._cache_bytes += len(pdf)
+        while (
+            len(self._cache) > self.cache_size
+            or self._cache_bytes > self.cache_max_bytes
+        ):
+            _, evicted = self._cache.popitem(last=False)
+            self._cache_bytes -= len(evicted)
+
+    async def render(self, html_content: str) -> bytes:
+        """
+        Convert HTML to PDF, served from the cache for an already rendered HTML
+
+        :return: PDF bytes
+        """
+        options = self.backend.options()
+        key = self.cache_key(html_content, options)
+
+        pdf = self._cache_get(key)
+        if pdf is not None:
+            self.cache_hits += 1
+            logger.debug(f"PDF served from render cache ({key[:12]})")
+            return pdf
+
+        return await self._flights.run(
+            key, lambda: self._render(key, html_content, options)
+        )
+
+    @asynccontextmanager
+    async def _slot(self) -> AsyncIterator[None]:
+        """Wait for a free conversion slot, tracks queue wait and render latency."""
+        queued_at = time.perf_counter()
+        self.waiting += 1
+        acquired = False
+        try:
+            async with self._semaphore:
+                acquired = True
+                self.waiting -= 1
+                waited = time.perf_counter() - queued_at
+                self.queue_wait_seconds += waited
+                self.queue_wait_max = max(self.queue_wait_max, waited)
+
+                self.rendering += 1
+                started_at = time.perf_counter()
+                try:
+                    yield
+                finally:
+                    self.rendering -= 1
+                elapsed = time.perf_counter() - started_at
+                self.render_latency.record(elapsed)
+                PDF_RENDER_SECONDS.observe(elapsed, backend=self.backend.name)
+        finally:
+            if not acquired:
+                # cancelled while waiting in the queue
+                self.waiting -= 1
+
+    async def _render(
+        self, key: str, html_content: str, options: dict[str, str]
+    ) -> bytes:
+        async with self._slot():
+            try:
+                async with asyncio.timeout(self.timeout):
+                    pdf = await self.backend.convert(html_content, options)
+            except (TimeoutError, PdfRenderError) as err:
+                raise self._failed(err)
+
+        self.renders += 1
+        self._cache_put(key, pdf)
+        return pdf
+
+    async def render_stream(self, html_content: str) -> AsyncIterator[bytes]:
+        """
+        Convert HTML to PDF chunk by chunk as the backend returns it. The chunks are read
+        by a background task holding the conversion slot only until the backend response
+        is read, chunks a slow consumer did not take yet wait in memory.
+
+        :return: PDF chunks
+        """
+        options = self.backend.options()
+        key = self.cache_key(html_content, options)
+
+        pdf = self._cache_get(key)
+        if pdf is not None:
+            self.cache_hits += 1
+            logger.debug(f"PDF streamed from render cache ({key[:12]})")
+            for start in range(0, len(pdf), self.chunk_size):
+                yield pdf[start : start + self.chunk_size]
+            return
+
+        # chunks, then None at the end or the exception the conversion failed with
+        chunks: asyncio.Queue[Optional[bytes] | Exception] = asyncio.Queue()
+        reader = asyncio.create_task(self._read_stream(html_content, options, chunks))
+        try:
+            while (chunk := await chunks.get()) is not None:
+                if isinstance(chunk, Exception):
+                    raise chunk
+                yield chunk
+        finally:
+            # consumer gone before the end, stop reading from the backend
+            reader.cancel()
+            await asyncio.gather(reader, return_exceptions=True)
+
+    async def _read_stream(
+        self,
+        html_content: str,
+        options: dict[str, str],
+        chunks: asyncio.Queue[Optional[bytes] | Exception],
+    ) -> None:
+        try:
+            async with self._slot():
+                async with asyncio.timeout(self.timeout):
+                    async for chunk in self.backend.convert_stream(
+                        html_content, options, self.chunk_size
+                    ):
+                        chunks.put_nowait(chunk)
+        except (TimeoutError, PdfRenderError) as err:
+            chunks.put_nowait(self._failed(err))
+            return
+        except Exception as err:
+            chunks.put_nowait(err)
+            return
+
+        self.renders += 1
+        chunks.put_nowait(None)
+
+    def _failed(self, err: Exception) -> HTTPException:
+        self.failures += 1
+        if isinstance(err, TimeoutError):
+            self.timeouts += 1
+            return HTTPException(
+                status_code=500, detail="PDF generation failed - timeout"
+            )
+        return HTTPException(
+            status_code=500, detail=f"PDF generation failed - {err.detail}"
+        )
+
+    def stats(self) -> dict:
+        return {
+            "backend": self.backend.name,
+            "max_concurrency": self.max_concurrency,
+            "waiting": self.waiting,
+            "rendering": self.rendering,
+            "renders": self.renders,
+            "failures": self.failures,
+            "timeouts": self.timeouts,
+            "cache_hits": self.cache_hits,
+            "coalesced": self._flights.coalesced,
+            "cache_entries": len(self._cache),
+            "cache_bytes": self._cache_bytes,
+            "queue_wait_seconds": round(self.queue_wait_seconds, 3),
+            "queue_wait_max": round(self.queue_wait_max, 3),
+            "render_latency": self.render_latency.stats(),
+        }
+
+
+RENDER_POOL = PdfRenderPool(
+    backend=create_pdf_backend(SERVER_SETTINGS.PDF_BACKEND),
+    timeout=SERVER_SETTINGS.PDF_RENDER_TIMEOUT,
+    cache_size=SERVER_SETTINGS.PDF_CACHE_SIZE,
+    cache_max_bytes=SERVER_SETTINGS.PDF_CACHE_MAX_BYTES,
+    chunk_size=SERVER_SETTINGS.PDF_CHUNK_SIZE,
+)
@@ -0,0 +1,354 @@
+import asyncio
+import os
+import time
+from pathlib import Path
+from typing import AsyncIterator, Optional
+
+from bson import ObjectId, json_util
+from gridfs.errors import NoFile
+from loguru import logger
+from motor.motor_asyncio import AsyncIOMotorGridFSBucket
+from pydantic import BaseModel, ConfigDict
+
+from app.config import DB_NAMES, SERVER_SETTINGS
+from app.utils.database import DB
+from app.utils.latency import LatencyWindow
+from app.utils.metrics import GRIDFS_UPLOAD_SECONDS, MONGO_INSERT_SECONDS
+
+
+class PendingHoroscope(BaseModel):
+    """Horoscope PDF and document waiting to be stored."""
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    file_id: ObjectId
+    filename: str
+    metadata: dict
+    document: dict
+    pdf: bytes = b""
+    # wall clock, the item may come back from the journal after a restart
+    enqueued_at: float
+    attempts: int = 0
+
+
+class WriteBehindQueue:
+    """
+    Stores generated horoscopes (GridFS file + horoscope document) in the background,
+    so the response does not wait for MongoDB.
+
+    - at most `max_size` horoscopes wait in memory, others go to the journal
+    - a failed store is retried `retries` times with exponential backoff, then the
+      horoscope is spilled to the on-disk journal (`journal_dir`)
+    - the journal is replayed at startup and every `replay_interval` seconds
+    - `stop` drains the queue for up to `drain_timeout` seconds, the rest is journaled
+    - horoscopes the journal cannot be written for (full disk) stay in memory and
+      are retried by the replay
+    - stores are idempotent, the file id is assigned before enqueueing
+    """
+
+    def __init__(
+        self,
+        max_size: int,
+        workers: int,
+        retries: int,
+        backoff_base: float,
+        backoff_max: float,
+        journal_dir: str,
+        replay_interval: float,
+        drain_timeout: float,
+    ) -> None:
+        self.max_size = max_size
+        self.workers = workers
+        self.retries = retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.journal_dir = Path(journal_dir)
+        self.replay_interval = replay_interval
+        self.drain_timeout = drain_timeout
+
+        self._queue: Optional[asyncio.Queue[PendingHoroscope]] = None
+        self._tasks: list[asyncio.Task] = []
+        self._pending: dict[ObjectId, PendingHoroscope] = {}
+        # pending horoscopes the journal write failed for, kept in memory only
+        self._unjournaled: set[ObjectId] = set()
+
+        self.submitted = 0
+        self.stored = 0
+        self.retried = 0
+        self.spilled = 0
+        self.replayed = 0
+        self.store_lag = LatencyWindow(200)
+
+    @property
+    def enabled(self) -> bool:
+        return SERVER_SETTINGS.PERSISTENCE_WRITE_BEHIND
+
+    async def start(self) -> None:
+        if not self.enabled:
+            journaled = len(self._journal_ids())
+            if journaled:
+                logger.warning(
+                    f"Write-behind persistence disabled, {journaled} journaled "
+                    "horoscopes are not replayed"
+                )
+            return
+
+        self._queue = asyncio.Queue(maxsize=self.max_size)
+        self._tasks = [
+            asyncio.create_task(self._worker(), name=f"persistence-worker-{i}")
+            for i in range(self.workers)
+        ]
+        self._tasks.append(
+            asyncio.create_task(self._replay_loop(), name="persistence-replay")
+        )
+        logger.info(
+            f"Write-behind queue started with {self.workers} workers, "
+            f"{len(self._journal_ids())} horoscopes in the journal"
+        )
+
+    async def stop(self) -> None:
+        if self._queue is None:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), self.drain_timeout)
+        except TimeoutError:
+            logger.warning(
+                f"Write-behind queue not drained in {self.drain_timeout}s, "
+                f"{len(self._pending)} horoscopes go to the journal"
+            )
+
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+        for item in list(self._pending.values()):
+            await self._spill(item)
+        if self._unjournaled:
+            logger.error(
+                f"{len(self._unjournaled)} horoscopes could not be journaled and are lost"
+            )
+        self._queue = None
+        logger.info("Write-behind queue stopped")
+
+    async def submit(self, item: PendingHoroscope) -> None:
+        """
+        Enqueue horoscope to be stored, journaled right away when the queue is full
+        """
+        self.submitted += 1
+        self._pending[item.file_id] = item
+        if self._queue is None or self._queue.full():
+            await self._spill(item)
+            return
+        self._queue.put_nowait(item)
+
+    async def pending_pdf(self, file_id: ObjectId) -> Optional[PendingHoroscope]:
+        """
+        Horoscope with its PDF not stored to GridFS yet
+
+        :return: pending horoscope, or None
+        """
+        item = self._pending.get(file_id)
+        if item is not None:
+            return item
+        return await asyncio.to_thread(self._journal_load, file_id)
+
+    async def _worker(self) -> None:
+        assert self._queue is not None
+        while True:
+            item = await self._queue.get()
+            try:
+                await self._store_with_retry(item)
+            except Exception as err:
+                logger.exception(f"Storing horoscope {item.file_id} crashed: {err}")
+                await self._spill(item)
+            finally:
+                self._queue.task_done()
+
+    async def _store_with_retry(self, item: PendingHoroscope) -> None:
+        for attempt in range(self.retries + 1):
+            item.attempts += 1
+            try:
+                await self._store(item)
+            except Exception as err:
+                if attempt == self.retries:
+                    logger.error(
+                        f"Storing horoscope {item.file_id} failed "
+                        f"{item.attempts} times, journaled: {err!r}"
+                    )
+                    await self._spill(item)
+                    return
+                self.retried += 1
+                delay = min(self.backoff_base * 2**attempt, self.backoff_max)
+                logger.warning(
+                    f"Storing horoscope {item.file_id} failed, "
+                    f"retry in {delay:.1f}s: {err!r}"
+                )
+                await asyncio.sleep(delay)
+            else:
+                await self._stored(item)
+                return
+
+    async def _store(self, item: PendingHoroscope) -> None:
+        db = DB.get_database()
+        fs = AsyncIOMotorGridFSBucket(db, bucket_name=DB_NAMES.HOROSCOPES_PDF)
+        try:
+            # leftovers of an interrupted attempt
+            await fs.delete(item.file_id)
+        except NoFile:
+            pass
+        with GRIDFS_UPLOAD_SECONDS.time(mode="write_behind"):
+            await fs.upload_from_stream_with_id(
+                item.file_id,
+                item.filename,
+                item.pdf,
+                chunk_size_bytes=SERVER_SETTINGS.PDF_CHUNK_SIZE,
+                metadata=item.metadata,
+            )
+        # the document is inserted once, also when only the upsert was retried
+        document = {k: v for k, v in item.document.items() if k != "file_id"}
+        with MONGO_INSERT_SECONDS.time(collection=DB_NAMES.HOROSCOPES):
+            await db[DB_NAMES.HOROSCOPES].update_one(
+                {"file_id": item.file_id}, {"$setOnInsert": document}, upsert=True
+            )
+
+    async def _stored(self, item: PendingHoroscope) -> None:
+        self.stored += 1
+        self.store_lag.record(time.time() - item.enqueued_at)
+        self._pending.pop(item.file_id, None)
+        self._unjournaled.discard(item.file_id)
+        try:
+            await asyncio.to_thread(self._journal_remove, item.file_id)
+        except OSError as err:
+            # stores are idempotent, a replay of the leftover does no harm
+            logger.warning(f"Removing journaled horoscope {item.file_id} failed: {err}")
+
+    # journal - `<file_id>.pdf` with the PDF and `<file_id>.json` with the rest,
+    # the json file is written last and marks a complete entry
+
+    def _journal_path(self, file_id: ObjectId, suffix: str) -> Path:
+        return self.journal_dir / f"{file_id}{suffix}"
+
+    async def _spill(self, item: PendingHoroscope) -> None:
+        try:
+            written = await asyncio.to_thread(self._journal_write, item)
+        except Exception as err:
+            # kept in memory, the replay keeps trying to store it
+            logger.error(f"Journaling horoscope {item.file_id} failed: {err!r}")
+            self._pending[item.file_id] = item
+            self._unjournaled.add(item.file_id)
+            return
+        if written:
+            self.spilled += 1
+        # the PDF is read back from the journal when needed
+        self._pending.pop(item.file_id, None)
+        self._unjournaled.discard(item.file_id)
+
+    def _journal_write(self, item: PendingHoroscope) -> bool:
+        meta_path = self._journal_path(item.file_id, ".json")
+        if meta_path.exists():
+            return False
+        self.journal_dir.mkdir(parents=True, exist_ok=True)
+        self._journal_path(item.file_id, ".pdf").write_bytes(item.pdf)
+        tmp_path = self._journal_path(item.file_id, ".json.tmp")
+        tmp_path.write_text(
+            json_util.dumps(item.model_dump(exclude={"pdf"})), encoding="utf-8"
+        )
+        os.replace(tmp_path, meta_path)
+        return True
+
+    def _journal_ids(self) -> list[ObjectId]:
+        if not self.journal_dir.is_dir():
+            return []
+        return [
+            ObjectId(path.stem)
+            for path in sorted(self.journal_dir.glob("*.json"))
+            if ObjectId.is_valid(path.stem)
+        ]
+
+    def _journal_load(self, file_id: ObjectId) -> Optional[PendingHoroscope]:
+        try:
+            meta = json_util.loads(
+                self._journal_path(file_id, ".json").read_text(encoding="utf-8")
+            )
+            pdf = self._journal_path(file_id, ".pdf").read_bytes()
+        except (OSError, ValueError):
+            return None
+        return PendingHoroscope.model_validate({**meta, "pdf": pdf})
+
+    def _journal_remove(self, file_id: ObjectId) -> None:
+        for suffix in (".json", ".pdf"):
+            self._journal_path(file_id, suffix).unlink(missing_ok=True)
+
+    async def _replay_loop(self) -> None:
+        while True:
+            try:
+                await self._replay()
+            except Exception as err:
+                logger.exception(f"Journal replay failed: {err}")
+            await asyncio.sleep(self.replay_interval)
+
+    async def _replay(self) -> None:
+        """
+        Store horoscopes the journal failed for and journaled horoscopes one by one,
+        stops at the first failure.
+        """
+        for item in [self._pending[file_id] for file_id in self._unjournaled]:
+            if not await self._replay_item(item):
+                return
+        for file_id in self._journal_ids():
+            if file_id in self._pending:
+                continue
+            item = await asyncio.to_thread(self._journal_load, file_id)
+            if item is not None and not await self._replay_item(item):
+                return
+
+    async def _replay_item(self, item: PendingHoroscope) -> bool:
+        try:
+            await self._store(item)
+        except Exception as err:
+            logger.warning(f"Journal replay postponed, MongoDB failing: {err!r}")
+            return False
+        self.replayed += 1
+        await self._stored(item)
+        return True
+
+    def stats(self) -> dict:
+        now = time.time()
+        oldest = min(
+            (item.enqueued_at for item in self._pending.values()), default=None
+        )
+        return {
+            "enabled": self.enabled,
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            "queue_max_size": self.max_size,
+            "pending_in_memory": len(self._pending),
+            "unjournaled": len(self._unjournaled),
+            "journal_entries": len(self._journal_ids()),
+            "oldest_pending_seconds": (
+                round(now - oldest, 3) if oldest is not None else None
+            ),
+            "submitted": self.submitted,
+            "stored": self.stored,
+            "retried": self.retried,
+            "spilled": self.spilled,
+            "replayed": self.replayed,
+            "store_lag": self.store_lag.stats(),
+        }
+
+
+async def iter_pdf_bytes(pdf: bytes, chunk_size: int) -> AsyncIterator[bytes]:
+    for start in range(0, len(pdf), chunk_size):
+        yield pdf[start : start + chunk_size]
+
+
+PERSISTENCE_QUEUE = WriteBehindQueue(
+    max_size=SERVER_SETTINGS.PERSISTENCE_QUEUE_SIZE,
+    workers=SERVER_SETTINGS.PERSISTENCE_WORKERS,
+    retries=SERVER_SETTINGS.PERSISTENCE_RETRIES,
+    backoff_base=SERVER_SETTINGS.PERSISTENCE_BACKOFF_BASE,
+    backoff_max=SERVER_SETTINGS.PERSISTENCE_BACKOFF_MAX,
+    journal_dir=SERVER_SETTINGS.PERSISTENCE_JOURNAL_DIR,
+    replay_interval=SERVER_SETTINGS.PERSISTENCE_REPLAY_INTERVAL,
+    drain_timeout=SERVER_SETTINGS.PERSISTENCE_DRAIN_TIMEOUT,
+)
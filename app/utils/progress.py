@@ -0,0 +1,154 @@
+import asyncio
+from contextvars import ContextVar
+from typing import Callable, Optional
+
+from app.models.horoscop import ContentResponse
+
+STAGES = ["validate", "enrich", "generate", "render", "store"]
+
+
+class HoroscopeProgress:
+    """
+    Receives progress of one horoscope generation, the base class ignores it.
+    Subclasses are installed with `PROGRESS.set(...)` before running the pipeline.
+    Hooks are always called on the event loop the listener was created on, even when
+    reported from a synchronous graph node running in a worker thread.
+    """
+
+    def __init__(self) -> None:
+        self.stage: str = ""
+        self.sections_done = 0
+        self.sections_total = 0
+        try:
+            self.loop: Optional[asyncio.AbstractEventLoop] = asyncio.get_running_loop()
+        except RuntimeError:
+            self.loop = None
+
+    def on_stage(self, stage: str) -> None:
+        pass
+
+    def on_section(self, response: ContentResponse) -> None:
+        pass
+
+    def on_section_delta(self, key: str, title: str, text: str, reset: bool) -> None:
+        pass
+
+    def dispatch(self, fn: Callable, *args) -> None:
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+
+        if self.loop is None or running is self.loop:
+            fn(*args)
+        else:
+            self.loop.call_soon_threadsafe(fn, *args)
+
+
+class ProgressFanout(HoroscopeProgress):
+    """
+    Progress of a generation shared by several requests (single-flight), forwarded
+    to the progress of each of them. A listener added later first gets the current
+    stage and the sections finished so far.
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.sections: list[ContentResponse] = []
+        self._listeners: list[HoroscopeProgress] = []
+
+    def add(self, listener: HoroscopeProgress) -> None:
+        if listener is _NO_PROGRESS:
+            return
+        self._listeners.append(listener)
+        listener.dispatch(self._replay, listener, self.stage, list(self.sections))
+
+    def remove(self, listener: HoroscopeProgress) -> None:
+        if listener in self._listeners:
+            self._listeners.remove(listener)
+
+    def _replay(
+        self,
+        listener: HoroscopeProgress,
+        stage: str,
+        sections: list[ContentResponse],
+    ) -> None:
+        if stage:
+            self._stage(listener, stage)
+        for response in sections:
+            self._section(listener, response)
+
+    def _stage(self, listener: HoroscopeProgress, stage: str) -> None:
+        listener.stage = stage
+        listener.sections_total = self.sections_total or listener.sections_total
+        listener.on_stage(stage)
+
+    def _section(self, listener: HoroscopeProgress, response: ContentResponse) -> None:
+        listener.sections_done += 1
+        listener.sections_total = self.sections_total or listener.sections_total
+        listener.on_section(response)
+
+    def on_stage(self, stage: str) -> None:
+        for listener in list(self._listeners):
+            listener.dispatch(self._stage, listener, stage)
+
+    def on_section(self, response: ContentResponse) -> None:
+        self.sections.append(response)
+        for listener in list(self._listeners):
+            listener.dispatch(self._section, listener, response)
+
+    def on_section_delta(self, key: str, title: str, text: str, reset: bool) -> None:
+        for listener in list(self._listeners):
+            listener.dispatch(listener.on_section_delta, key, title, text, reset)
+
+
+_NO_PROGRESS = HoroscopeProgress()
+
+PROGRESS: ContextVar[HoroscopeProgress] = ContextVar(
+    "horoscope_progress", default=_NO_PROGRESS
+)
+
+
+def report_stage(stage: str) -> None:
+    progress = PROGRESS.get()
+    if progress is _NO_PROGRESS:
+        return
+
+    def apply() -> None:
+        progress.stage = stage
+        progress.on_stage(stage)
+
+    progress.dispatch(apply)
+
+
+def report_sections_total(total: int) -> None:
+    progress = PROGRESS.get()
+    if progress is _NO_PROGRESS:
+        return
+
+    def apply() -> None:
+        progress.sections_total = total
+
+    progress.dispatch(apply)
+
+
+def report_section(response: ContentResponse) -> None:
+    progress = PROGRESS.get()
+    if progress is _NO_PROGRESS:
+        return
+
+    def apply() -> None:
+        progress.sections_done += 1
+        progress.on_section(response)
+
+    progress.dispatch(apply)
+
+
+def report_section_delta(key: str, title: str, text: str, reset: bool = False) -> None:
+    """Reports a chunk of text of a section still being streamed, with `reset` the text
+    replaces the chunks reported so far (the stream was interrupted and regenerated)."""
+    progress = PROGRESS.get()
+    if progress is _NO_PROGRESS:
+        return
+
+    progress.dispatch(progress.on_section_delta, key, title, text, reset)
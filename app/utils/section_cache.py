@@ -0,0 +1,223 @@
+import hashlib
+import random
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Optional
+
+from loguru import logger
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo.errors import DuplicateKeyError, PyMongoError
+
+from app.config import DB_NAMES, SERVER_SETTINGS
+from app.models.horoscop import (
+    SIGN_PROMPT_TEMPLATE,
+    SYSTEM_PROMPT,
+    ContentResponse,
+    HoroscopeSign,
+)
+from app.utils.database import DB
+
+
+def prompt_version(section_prompt: str, model: str) -> str:
+    """
+    Short hash of everything that shapes a cached section, any change of the
+    prompts or of the model invalidates previously cached texts.
+
+    :return: version string
+    """
+    digest = hashlib.sha256(
+        "\n".join(
+            [
+                SERVER_SETTINGS.GEMINI_API_URL,
+                model,
+                SYSTEM_PROMPT,
+                SIGN_PROMPT_TEMPLATE,
+                section_prompt,
+            ]
+        ).encode("utf-8")
+    )
+    return digest.hexdigest()[:12]
+
+
+def section_cache_key(
+    zodiac: HoroscopeSign,
+    astro_number: int,
+    section_key: str,
+    section_prompt: str,
+    model: str,
+) -> str:
+    """
+    :param model: model routed to the call generating the section
+    """
+    version = prompt_version(section_prompt, model)
+    return f"{zodiac.value}:{astro_number}:{section_key}:{version}"
+
+
+class SectionCache:
+    """
+    Two-tier cache of generated section texts shared by all users with the same
+    zodiac sign and astrological number.
+
+    Each key holds a pool of up to `variants` texts, while the pool is not full a lookup
+    is a miss (so a new variant gets generated), afterwards a random variant is returned.
+    The first tier is an in-process LRU with TTL holding only full pools, the second
+    is a MongoDB collection with a TTL index, one document per variant slot.
+    """
+
+    def __init__(
+        self,
+        variants: int,
+        memory_size: int,
+        memory_ttl: int,
+        db_ttl: int,
+    ) -> None:
+        self.variants = variants
+        self.memory_size = memory_size
+        self.memory_ttl = memory_ttl
+        self.db_ttl = db_ttl
+
+        self._memory: OrderedDict[str, tuple[float, list[dict]]] = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+        self.memory_hits = 0
+        self.db_loads = 0
+        self.stores = 0
+
+    @property
+    def enabled(self) -> bool:
+        return SERVER_SETTINGS.SECTION_CACHE_ENABLED
+
+    def _collection(self, db: Optional[AsyncIOMotorDatabase] = None):
+        db = db if db is not None else DB.get_database()
+        return db[DB_NAMES.SECTION_CACHE]
+
+    async def ensure_indexes(self, db: Optional[AsyncIOMotorDatabase] = None) -> None:
+        """
+        Create lookup index and TTL index expiring cached variants
+        """
+        collection = self._collection(db)
+        await collection.create_index("key")
+        await collection.create_index("created_at", expireAfterSeconds=self.db_ttl)
+
+    def _memory_get(self, key: str) -> Optional[list[dict]]:
+        entry = self._memory.get(key)
+        if entry is None:
+            return None
+        expires_at, variants = entry
+        if expires_at < time.monotonic():
+            del self._memory[key]
+            return None
+        self._memory.move_to_end(key)
+        return variants
+
+    def _memory_set(self, key: str, variants: list[dict]) -> None:
+        self._memory[key] = (time.monotonic() + self.memory_ttl, variants)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_size:
+            self._memory.popitem(last=False)
+
+    async def _variants(self, key: str) -> list[dict]:
+        variants = self._memory_get(key)
+        if variants is not None:
+            self.memory_hits += 1
+            return variants
+
+        self.db_loads += 1
+        variants = []
+        async for doc in (
+            self._collection()
+            .find({"key": key}, {"_id": 0, "content": 1, "model": 1})
+            .limit(self.variants)
+        ):
+            variants.append(doc)
+        # partial pools are read again until the missing variants are stored
+        if len(variants) >= self.variants:
+            self._memory_set(key, variants)
+        return variants
+
+    async def get(self, key: str, section_key: str) -> Optional[ContentResponse]:
+        """
+        Get a random cached variant, `None` while the variant pool is not full
+
+        :return: cached section without token usage or None
+        """
+        try:
+            variants = await self._variants(key)
+        except PyMongoError as err:
+            logger.warning(f"Section cache lookup for '{key}' failed: {err}")
+            variants = self._memory_get(key) or []
+
+        if len(variants) < self.variants:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        variant = random.choice(variants)
+        return ContentResponse(
+            key=section_key,
+            content=variant["content"],
+            cached=True,
+            model=variant.get("model"),
+        )
+
+    async def put(self, key: str, response: ContentResponse) -> None:
+        """
+        Add generated section to a free slot of the variant pool of the key,
+        sections generated concurrently for a full pool are not stored
+        """
+        if self._memory_get(key) is not None:
+            return
+
+        doc = {
+            "key": key,
+            "content": response.content,
+            "input_tokens": response.input_tokens,
+            "output_tokens": response.output_tokens,
+            "model": response.model,
+            "created_at": datetime.now(),
+        }
+        try:
+            stored = (
+                await self._collection()
+                .find({"key": key}, {"_id": 0, "slot": 1})
+                .to_list(None)
+            )
+            if len(stored) >= self.variants:
+                return
+            taken = {variant["slot"] for variant in stored if "slot" in variant}
+            for slot in range(self.variants):
+                if slot in taken:
+                    continue
+                try:
+                    # the slot id makes the insert conditional on the slot being free
+                    await self._collection().insert_one(
+                        {**doc, "_id": f"{key}:{slot}", "slot": slot}
+                    )
+                except DuplicateKeyError:
+                    continue
+                self.stores += 1
+                return
+        except PyMongoError as err:
+            logger.warning(f"Section cache store for '{key}' failed: {err}")
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "variants": self.variants,
+            "hits": self.hits,
+            "misses": self.misses,
+            "memory_hits": self.memory_hits,
+            "db_loads": self.db_loads,
+            "stores": self.stores,
+            "memory_keys": len(self._memory),
+        }
+
+
+SECTION_CACHE = SectionCache(
+    variants=SERVER_SETTINGS.SECTION_CACHE_VARIANTS,
+    memory_size=SERVER_SETTINGS.SECTION_CACHE_MEMORY_SIZE,
+    memory_ttl=SERVER_SETTINGS.SECTION_CACHE_MEMORY_TTL,
+    db_ttl=SERVER_SETTINGS.SECTION_CACHE_TTL,
+)
@@ -0,0 +1,173 @@
+import hashlib
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from typing import AsyncIterator, Optional
+
+from loguru import logger
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo.errors import PyMongoError
+
+from app.config import DB_NAMES, SERVER_SETTINGS
+from app.models.horoscop import ContentResponse, HoroscopeState
+from app.utils.database import DB
+
+# checkpoint of the running generation (request id, saved sections by key)
+ACTIVE_CHECKPOINT: ContextVar[Optional[tuple[str, dict[str, dict]]]] = ContextVar(
+    "section_checkpoint", default=None
+)
+
+
+def checkpoint_request_id(code: str, name: str, dob: str, horoscope_type: str) -> str:
+    """
+    Id of the request, the same input (incl. the access code) resumes its checkpoint
+
+    :return: hex digest
+    """
+    return hashlib.sha256(
+        "\n".join([code, name, dob, horoscope_type]).encode("utf-8")
+    ).hexdigest()[:32]
+
+
+class SectionCheckpoints:
+    """
+    Checkpoints of generated sections of a request, one document per request id
+    with the successful sections (paid for already) by key.
+
+    A request failed in some sections leaves its checkpoint behind, a retry with the
+    same input restores the saved sections and generates only the missing ones.
+    A completed horoscope removes its checkpoint, forgotten ones expire by TTL index.
+    """
+
+    def __init__(self, ttl: int) -> None:
+        self.ttl = ttl
+
+        self.resumed = 0
+        self.restored = 0
+        self.saved = 0
+        self.save_failures = 0
+        self.load_failures = 0
+        self.released = 0
+
+    @property
+    def enabled(self) -> bool:
+        return SERVER_SETTINGS.SECTION_CHECKPOINT_ENABLED
+
+    def _collection(self, db: Optional[AsyncIOMotorDatabase] = None):
+        db = db if db is not None else DB.get_database()
+        return db[DB_NAMES.SECTION_CHECKPOINTS]
+
+    async def ensure_indexes(self, db: Optional[AsyncIOMotorDatabase] = None) -> None:
+        """
+        Create TTL index expiring abandoned checkpoints
+        """
+        await self._collection(db).create_index(
+            "updated_at", expireAfterSeconds=self.ttl
+        )
+
+    @asynccontextmanager
+    async def resume(self, request_id: Optional[str]) -> AsyncIterator[None]:
+        """
+        Load the checkpoint of the request for the duration of its generation
+        """
+        if not self.enabled or request_id is None:
+            yield
+            return
+
+        try:
+            doc = await self._collection().find_one(
+                {"_id": request_id}, {"sections": 1}
+            )
+        except PyMongoError as err:
+            self.load_failures += 1
+            logger.warning(f"Loading section checkpoint {request_id} failed: {err}")
+            doc = None
+
+        sections: dict[str, dict] = (doc or {}).get("sections", {})
+        if sections:
+            self.resumed += 1
+            logger.info(
+                f"Resuming request {request_id}, sections {list(sections)} restored"
+            )
+
+        token = ACTIVE_CHECKPOINT.set((request_id, sections))
+        try:
+            yield
+        finally:
+            ACTIVE_CHECKPOINT.reset(token)
+
+    def restore(self, key: str) -> Optional[ContentResponse]:
+        """
+        Section saved by an earlier attempt of the running request
+
+        :return: section without token usage (already counted) or None
+        """
+        active = ACTIVE_CHECKPOINT.get()
+        if active is None:
+            return None
+        _, sections = active
+        section = sections.get(key)
+        if section is None:
+            return None
+        self.restored += 1
+        return ContentResponse(
+            key=key, content=section["content"], model=section.get("model")
+        )
+
+    async def save(self, response: ContentResponse) -> None:
+        """
+        Add a successful section to the checkpoint of the running request
+        """
+        active = ACTIVE_CHECKPOINT.get()
+        if active is None or response.error is not None or not response.content:
+            return
+        request_id, sections = active
+        if response.key in sections:
+            return
+
+        section = {"content": response.content, "model": response.model}
+        sections[response.key] = section
+        now = datetime.now()
+        try:
+            await self._collection().update_one(
+                {"_id": request_id},
+                {
+                    "$set": {f"sections.{response.key}": section, "updated_at": now},
+                    "$setOnInsert": {"created_at": now},
+                },
+                upsert=True,
+            )
+            self.saved += 1
+        except PyMongoError as err:
+            self.save_failures += 1
+            logger.warning(
+                f"Saving section '{response.key}' of {request_id} failed: {err}"
+            )
+
+    async def release(self, state: HoroscopeState) -> None:
+        """
+        Remove the checkpoint of a horoscope stored with all its sections
+        """
+        if not self.enabled or state.request_id is None or state.failed_sections:
+            return
+        try:
+            await self._collection().delete_one({"_id": state.request_id})
+            self.released += 1
+        except PyMongoError as err:
+            logger.warning(
+                f"Removing section checkpoint {state.request_id} failed: {err}"
+            )
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "resumed": self.resumed,
+            "restored": self.restored,
+            "saved": self.saved,
+            "save_failures": self.save_failures,
+            "load_failures": self.load_failures,
+            "released": self.released,
+        }
+
+
+SECTION_CHECKPOINTS = SectionCheckpoints(ttl=SERVER_SETTINGS.SECTION_CHECKPOINT_TTL)
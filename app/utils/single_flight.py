@@ -0,0 +1,98 @@
+import asyncio
+import time
+from typing import Awaitable, Callable, Generic, Hashable, Optional, TypeVar
+
+from loguru import logger
+
+T = TypeVar("T")
+
+
+class SingleFlight(Generic[T]):
+    """
+    Coalesces concurrent calls with the same key into one execution.
+
+    The first caller (leader) starts the work as a separate task, every caller with
+    the same key arriving before it finishes awaits the same task. Successful results
+    are remembered for `result_window` seconds so immediate retries get them too.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        result_window: float,
+        remember: Callable[[T], T] = lambda result: result,
+    ) -> None:
+        self.name = name
+        self.result_window = result_window
+        # reduces the result before it is kept for the result window
+        self.remember = remember
+
+        self._in_flight: dict[Hashable, asyncio.Task] = {}
+        self._recent: dict[Hashable, tuple[float, T]] = {}
+
+        self.leaders = 0
+        self.coalesced = 0
+        self.window_hits = 0
+        self.failures = 0
+
+    def recent(self, key: Hashable) -> Optional[T]:
+        """
+        Result finished within the result window for the key
+
+        :return: remembered result or None
+        """
+        now = time.monotonic()
+        for expired in [k for k, (exp, _) in self._recent.items() if exp < now]:
+            del self._recent[expired]
+
+        entry = self._recent.get(key)
+        if entry is None:
+            return None
+        self.window_hits += 1
+        return entry[1]
+
+    async def run(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> T:
+        """
+        Run `fn` once for all concurrent callers with the same key
+
+        :return: result of the shared execution
+        """
+        task = self._in_flight.get(key)
+        if task is not None:
+            self.coalesced += 1
+            logger.info(f"Single-flight '{self.name}': joined in-flight execution")
+        else:
+            self.leaders += 1
+            task = asyncio.create_task(self._execute(key, fn))
+            # retrieve the exception even if every caller went away
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+            self._in_flight[key] = task
+
+        # a disconnected caller must not cancel the work shared with others
+        return await asyncio.shield(task)
+
+    async def _execute(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> T:
+        try:
+            result = await fn()
+        except BaseException:
+            self.failures += 1
+            raise
+        else:
+            if self.result_window > 0:
+                self._recent[key] = (
+                    time.monotonic() + self.result_window,
+                    self.remember(result),
+                )
+            return result
+        finally:
+            self._in_flight.pop(key, None)
+
+    def stats(self) -> dict:
+        return {
+            "name": self.name,
+            "in_flight": len(self._in_flight),
+            "leaders": self.leaders,
+            "coalesced": self.coalesced,
+            "window_hits": self.window_hits,
+            "failures": self.failures,
+        }
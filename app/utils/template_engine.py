@@ -0,0 +1,171 @@
+import asyncio
+import re
+import time
+from pathlib import Path
+from typing import Optional
+
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader
+from loguru import logger
+
+from app.config import SERVER_SETTINGS
+from app.utils.latency import LatencyWindow
+from app.utils.metrics import TEMPLATE_RENDER_SECONDS
+
+TEMPLATE_DIR = Path(__file__).parent / "templates"
+
+_STYLE_BLOCK = re.compile(r"(<style[^>]*>)(.*?)(</style>)", re.DOTALL | re.IGNORECASE)
+_CSS_COMMENT = re.compile(r"/\*.*?\*/", re.DOTALL)
+_CSS_SPACE_AROUND = re.compile(r"\s*([{};,>])\s*")
+_CSS_SPACE_AFTER_COLON = re.compile(r":\s+")
+_CSS_STRING = re.compile(r"(\"(?:[^\"\\]|\\.)*\"|'(?:[^'\\]|\\.)*')")
+
+
+def _minify_css_code(css: str) -> str:
+    css = " ".join(_CSS_COMMENT.sub("", css).split())
+    css = _CSS_SPACE_AROUND.sub(r"\1", css)
+    return _CSS_SPACE_AFTER_COLON.sub(":", css).replace(";}", "}")
+
+
+def minify_css(css: str) -> str:
+    # odd parts of the split are quoted strings, these are kept as they are
+    parts = _CSS_STRING.split(css)
+    return "".join(
+        part if index % 2 else _minify_css_code(part)
+        for index, part in enumerate(parts)
+    )
+
+
+def minify_template_source(source: str) -> str:
+    """
+    Minify the static part of a template once, before it is compiled -
+    `<style>` blocks are minified and markup indentation is dropped
+
+    :return: template source producing the same document with less bytes
+    """
+    if "<pre" in source or "<textarea" in source:
+        # indentation is significant there
+        return _STYLE_BLOCK.sub(
+            lambda m: m.group(1) + minify_css(m.group(2)) + m.group(3), source
+        )
+
+    parts = []
+    position = 0
+    for match in _STYLE_BLOCK.finditer(source):
+        parts.append(_strip_indentation(source[position : match.start()]))
+        parts.append(match.group(1) + minify_css(match.group(2)) + match.group(3))
+        position = match.end()
+    parts.append(_strip_indentation(source[position:]))
+    return "".join(parts)
+
+
+def _strip_indentation(markup: str) -> str:
+    return "\n".join(line.strip() for line in markup.splitlines() if line.strip())
+
+
+class MinifyingLoader(FileSystemLoader):
+    """File system loader returning minified sources, up-to-date checks are kept."""
+
+    def get_source(self, environment, template):
+        source, filename, uptodate = super().get_source(environment, template)
+        return minify_template_source(source), filename, uptodate
+
+
+class TemplateEngine:
+    """
+    Jinja2 templates of the PDF documents.
+
+    - templates are compiled at startup (`warm_up`) and the bytecode is kept in
+      a `FileSystemBytecodeCache`, so restarts skip the compilation as well
+    - templates are checked for changes on disk only with `APP_DEBUG`
+    - documents with at least `thread_min_sections` sections render in a thread,
+      smaller ones directly on the event loop
+    """
+
+    def __init__(
+        self,
+        template_dir: Path,
+        auto_reload: bool,
+        minify: bool,
+        bytecode_cache_dir: str,
+        thread_min_sections: int,
+    ) -> None:
+        self.template_dir = template_dir
+        self.minify = minify
+        self.thread_min_sections = thread_min_sections
+
+        if bytecode_cache_dir:
+            Path(bytecode_cache_dir).mkdir(parents=True, exist_ok=True)
+        loader_class = MinifyingLoader if minify else FileSystemLoader
+        self.env = Environment(
+            loader=loader_class(template_dir),
+            bytecode_cache=FileSystemBytecodeCache(bytecode_cache_dir or None),
+            auto_reload=auto_reload,
+        )
+
+        self.renders = 0
+        self.threaded_renders = 0
+        self.render_latency = LatencyWindow(200)
+        self.source_bytes: dict[str, dict] = {}
+
+    def warm_up(self) -> None:
+        """
+        Compile all templates, bytecode of unchanged templates comes from the cache
+        """
+        started_at = time.perf_counter()
+        for name in self.env.list_templates(extensions=["html"]):
+            self.env.get_template(name)
+            if self.minify:
+                original = (self.template_dir / name).read_text(encoding="utf-8")
+                self.source_bytes[name] = {
+                    "original": len(original.encode("utf-8")),
+                    "minified": len(minify_template_source(original).encode("utf-8")),
+                }
+        logger.info(
+            f"Templates compiled in {time.perf_counter() - started_at:.3f}s "
+            f"({len(self.env.list_templates(extensions=['html']))} templates)"
+        )
+
+    def render(self, template_name: str, data: dict) -> str:
+        started_at = time.perf_counter()
+        html_content = self.env.get_template(template_name).render(data)
+        elapsed = time.perf_counter() - started_at
+        self.render_latency.record(elapsed)
+        TEMPLATE_RENDER_SECONDS.observe(elapsed, template=template_name)
+        self.renders += 1
+        return html_content
+
+    async def render_async(
+        self, template_name: str, data: dict, sections: Optional[int] = None
+    ) -> str:
+        """
+        Render the template, in a thread for documents with many sections
+
+        :param sections: number of sections, defaults to length of `results`
+        :return: HTML document
+        """
+        if sections is None:
+            sections = len(data.get("results") or [])
+        if sections < self.thread_min_sections:
+            return self.render(template_name, data)
+
+        self.threaded_renders += 1
+        return await asyncio.to_thread(self.render, template_name, data)
+
+    def stats(self) -> dict:
+        return {
+            "auto_reload": self.env.auto_reload,
+            "minify": self.minify,
+            "renders": self.renders,
+            "threaded_renders": self.threaded_renders,
+            "render_latency": self.render_latency.stats(),
+            "templates": self.source_bytes,
+        }
+
+
+TEMPLATE_ENGINE = TemplateEngine(
+    template_dir=TEMPLATE_DIR,
+    auto_reload=SERVER_SETTINGS.APP_DEBUG,
+    minify=SERVER_SETTINGS.TEMPLATE_MINIFY,
+    bytecode_cache_dir=SERVER_SETTINGS.TEMPLATE_BYTECODE_CACHE_DIR,
+    thread_min_sections=SERVER_SETTINGS.TEMPLATE_THREAD_MIN_SECTIONS,
+)
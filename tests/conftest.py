@@ -0,0 +1,21 @@
+import pytest
+
+from tools.stubs.mongo_stub import FILES
+
+
+@pytest.fixture
+def anyio_backend() -> str:
+    return "asyncio"
+
+
+@pytest.fixture
+def memory_db():
+    """Fresh in-memory MongoDB and GridFS for the test."""
+    pytest.importorskip("mongomock_motor")
+    from app.utils.database import DB
+    from tools.stubs.mongo_stub import install_memory_mongo
+
+    FILES.clear()
+    install_memory_mongo()
+    yield DB.get_database()
+    FILES.clear()
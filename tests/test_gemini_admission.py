@@ -0,0 +1,98 @@
+import asyncio
+
+import pytest
+
+from app.utils.gemini_admission import (
+    CircuitState,
+    GeminiAdmissionController,
+    GeminiUnavailableError,
+    TokenBucket,
+)
+
+pytestmark = pytest.mark.anyio
+
+
+def make_controller(open_seconds: float = 0.05) -> GeminiAdmissionController:
+    return GeminiAdmissionController(
+        rpm_limit=0,
+        tpm_limit=0,
+        backoff_base=0.1,
+        backoff_max=1.0,
+        max_admission_wait=0.0,
+        failure_threshold=3,
+        open_seconds=open_seconds,
+    )
+
+
+async def open_circuit(controller: GeminiAdmissionController) -> None:
+    for _ in range(controller.failure_threshold):
+        await controller.acquire(100)
+        controller.record_failure()
+
+
+async def test_circuit_opens_after_consecutive_failures():
+    controller = make_controller()
+    for _ in range(2):
+        await controller.acquire(100)
+        controller.record_failure()
+    # errors not caused by the upstream health do not count
+    controller.record_failure(count=False)
+    assert controller.state == CircuitState.CLOSED
+
+    await controller.acquire(100)
+    controller.record_failure()
+    assert controller.state == CircuitState.OPEN
+    with pytest.raises(GeminiUnavailableError):
+        await controller.acquire(100)
+    assert controller.circuit_opened == 1
+
+
+async def test_half_open_admits_one_probe_and_closes_on_success():
+    controller = make_controller()
+    await open_circuit(controller)
+    await asyncio.sleep(0.06)
+    assert controller.state == CircuitState.HALF_OPEN
+
+    await controller.acquire(100)
+    # only the probe goes through until it settles
+    with pytest.raises(GeminiUnavailableError):
+        await controller.acquire(100)
+
+    controller.record_success(100, 120)
+    assert controller.state == CircuitState.CLOSED
+    await controller.acquire(100)
+
+
+async def test_failed_probe_opens_circuit_again():
+    controller = make_controller()
+    await open_circuit(controller)
+    await asyncio.sleep(0.06)
+
+    await controller.acquire(100)
+    controller.record_failure()
+    assert controller.state == CircuitState.OPEN
+    assert controller.circuit_opened == 2
+
+
+async def test_probe_never_settled_expires():
+    controller = make_controller()
+    await open_circuit(controller)
+    await asyncio.sleep(0.06)
+
+    # the probe was cancelled and reports neither success nor failure
+    await controller.acquire(100)
+    with pytest.raises(GeminiUnavailableError):
+        await controller.acquire(100)
+    await asyncio.sleep(0.06)
+    await controller.acquire(100)
+
+
+def test_token_bucket_wait_and_debt():
+    bucket = TokenBucket(per_minute=60)
+    assert bucket.wait_time(60) == 0.0
+    bucket.take(60)
+    assert bucket.wait_time(1) == pytest.approx(1.0, abs=0.05)
+    # usage above the estimate is taken as a debt
+    bucket.take(30)
+    assert bucket.wait_time(1) == pytest.approx(31.0, abs=0.05)
+    assert TokenBucket(per_minute=0).wait_time(1_000_000) == 0.0
@@ -0,0 +1,80 @@
+import json
+
+import aiohttp
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from app.config import SERVER_SETTINGS
+from app.utils.horoscope_process import generate_content_streaming
+
+pytestmark = pytest.mark.anyio
+
+STREAMED = "Hvězdy "
+
+
+def reply(text: str, finish_reason: str | None = None) -> dict:
+    candidate: dict = {"content": {"role": "model", "parts": [{"text": text}]}}
+    if finish_reason is not None:
+        candidate["finishReason"] = finish_reason
+    return {"candidates": [candidate], "usageMetadata": {"promptTokenCount": 10}}
+
+
+@pytest.fixture
+async def gemini(monkeypatch):
+    """Gemini whose stream breaks after the first chunk, `full_text` is the reply
+    of the non-streaming request the generation falls back to."""
+
+    async def stream(request: web.Request) -> web.StreamResponse:
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        await response.write(f"data: {json.dumps(reply(STREAMED))}\r\n\r\n".encode())
+        # connection lost before the final chunk with the finish reason
+        await response.write_eof()
+        return response
+
+    async def generate(request: web.Request) -> web.Response:
+        return web.json_response(reply(server.full_text, "STOP"))
+
+    async def route(request: web.Request) -> web.StreamResponse:
+        if request.match_info["method"] == "streamGenerateContent":
+            return await stream(request)
+        return await generate(request)
+
+    app = web.Application()
+    app.router.add_post("/v1beta/models/{model}:{method}", route)
+    server = TestServer(app)
+    await server.start_server()
+    monkeypatch.setattr(
+        SERVER_SETTINGS,
+        "GEMINI_API_URL",
+        str(server.make_url("/v1beta/models/gemini-test:generateContent")),
+    )
+    async with aiohttp.ClientSession() as session:
+        yield server, session
+    await server.close()
+
+
+@pytest.mark.parametrize(
+    "full_text, expected",
+    [
+        # the regenerated text continues the streamed one, only the rest is sent
+        (STREAMED + "přejí.", [(STREAMED, False), ("přejí.", False)]),
+        # another text replaces the streamed one
+        ("Jiný text.", [(STREAMED, False), ("Jiný text.", True)]),
+    ],
+)
+async def test_interrupted_stream_does_not_repeat_text(gemini, full_text, expected):
+    server, session = gemini
+    server.full_text = full_text
+    sent: list[tuple[str, bool]] = []
+
+    response = await generate_content_streaming(
+        session,
+        "career",
+        "prompt",
+        on_text=lambda text, reset: sent.append((text, reset)),
+    )
+
+    assert response.content == full_text
+    assert sent == expected
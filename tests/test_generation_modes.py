@@ -0,0 +1,71 @@
+import asyncio
+
+import pytest
+
+from app.config import SERVER_SETTINGS, Settings
+from app.models.horoscop import ContentResponse, HoroscopeState, HoroscopeType
+from app.utils import horoscope_process
+from app.utils.horoscope_process import generate_sections_parallel
+
+pytestmark = pytest.mark.anyio
+
+
+def test_sequential_generation_is_default():
+    assert Settings.model_fields["GENERATION_MODE"].default == "sequential"
+
+
+async def test_parallel_sections_keep_order_and_request_limit(monkeypatch):
+    monkeypatch.setattr(SERVER_SETTINGS, "GENERATION_MAX_CONCURRENCY_PER_REQUEST", 2)
+    prompts = HoroscopeType.PROFI.get_prompts()
+    # later sections finish first
+    delays = {key: 0.005 * (len(prompts) - i) for i, key in enumerate(prompts)}
+    running = 0
+    max_running = 0
+
+    async def generate_section(session, state, key, data, base_prompt):
+        nonlocal running, max_running
+        running += 1
+        max_running = max(max_running, running)
+        await asyncio.sleep(delays[key])
+        running -= 1
+        return ContentResponse(key=key, content=key)
+
+    monkeypatch.setattr(horoscope_process, "generate_section", generate_section)
+    state = HoroscopeState(
+        name="Jana", dob="01.02.1990", horoscope_type=HoroscopeType.PROFI
+    )
+
+    responses = await generate_sections_parallel(None, state, prompts, "prompt")
+
+    assert [response.key for response in responses] == list(prompts)
+    assert max_running == 2
+
+
+async def test_cancelled_parallel_generation_cancels_sections(monkeypatch):
+    started = asyncio.Event()
+    cancelled: list[str] = []
+
+    async def generate_section(session, state, key, data, base_prompt):
+        started.set()
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(key)
+            raise
+
+    monkeypatch.setattr(horoscope_process, "generate_section", generate_section)
+    monkeypatch.setattr(SERVER_SETTINGS, "GENERATION_MAX_CONCURRENCY_PER_REQUEST", 2)
+    prompts = HoroscopeType.PROFI.get_prompts()
+    state = HoroscopeState(
+        name="Jana", dob="01.02.1990", horoscope_type=HoroscopeType.PROFI
+    )
+
+    generation = asyncio.create_task(
+        generate_sections_parallel(None, state, prompts, "prompt")
+    )
+    await started.wait()
+    generation.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await generation
+
+    assert len(cancelled) == 2
@@ -0,0 +1,65 @@
+import asyncio
+
+import pytest
+
+from app.config import SERVER_SETTINGS
+from app.models.horoscop import ContentResponse
+from app.utils import hedging
+from app.utils.hedging import HedgingPolicy
+from app.utils.model_router import ModelRouter
+
+pytestmark = pytest.mark.anyio
+
+MODEL = "gemini-test"
+
+
+@pytest.fixture
+def router(monkeypatch) -> ModelRouter:
+    monkeypatch.setattr(SERVER_SETTINGS, "GEMINI_HEDGING_ENABLED", True)
+    router = ModelRouter(window=50, min_samples=5)
+    monkeypatch.setattr(hedging, "MODEL_ROUTER", router)
+    return router
+
+
+def slow_primary(calls: list[bool], seconds: float):
+    async def call(primary: bool) -> ContentResponse:
+        calls.append(primary)
+        await asyncio.sleep(seconds if primary else 0.0)
+        return ContentResponse(key="career", content="primary" if primary else "hedge")
+
+    return call
+
+
+async def test_structured_latency_does_not_delay_section_hedges(router):
+    for _ in range(5):
+        router.record(MODEL, 0.01, ok=True)
+        router.record(MODEL, 30.0, ok=True, kind="structured")
+
+    policy = HedgingPolicy(percentile=95.0, min_delay=0.01, budget=1.0)
+    assert policy.delay(MODEL) == 0.01
+    assert policy.delay(MODEL, "structured") == 30.0
+
+    calls: list[bool] = []
+    response = await policy.run(MODEL, slow_primary(calls, 0.5))
+    assert response.content == "hedge"
+    assert calls == [True, False]
+    assert router.stats()["models"].keys() == {MODEL, f"{MODEL}:structured"}
+
+
+async def test_hedge_budget_is_kept_per_kind(router):
+    for _ in range(5):
+        router.record(MODEL, 0.01, ok=True)
+        router.record(MODEL, 0.01, ok=True, kind="structured")
+
+    policy = HedgingPolicy(percentile=95.0, min_delay=0.01, budget=0.5)
+    # structured calls earn credits only for structured hedges
+    for _ in range(2):
+        calls: list[bool] = []
+        await policy.run(MODEL, slow_primary(calls, 0.05), "structured")
+    assert calls == [True, False]
+
+    calls = []
+    response = await policy.run(MODEL, slow_primary(calls, 0.05))
+    assert response.content == "primary"
+    assert calls == [True]
+    assert policy.budget_exhausted == 2
@@ -0,0 +1,38 @@
+import httpx
+import pytest
+from bson import ObjectId
+
+from app.config import DB_NAMES
+from app.main import app
+from app.models.horoscop import HoroscopePdf
+from app.routers import horoscop
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+async def client(memory_db):
+    await memory_db[DB_NAMES.ACCESS_CODES].insert_one({"code": "ABC123"})
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        yield client
+
+
+async def test_shared_generation_without_stored_pdf_is_not_found(client, monkeypatch):
+    async def create_horoscope_once(user_input, db, validation_code_id, *args):
+        # the leader's PDF is gone by the time this request reads it
+        return HoroscopePdf(filename="Jana_horoskop.pdf", file_id=ObjectId())
+
+    monkeypatch.setattr(horoscop, "create_horoscope_once", create_horoscope_once)
+
+    response = await client.post(
+        "/api/horoscope/horoscope-pdf",
+        json={
+            "name": "Jana",
+            "dob": "01.02.1990",
+            "code": "ABC123",
+            "horoscope_type": "HoroscopeBasic",
+        },
+    )
+    assert response.status_code == 404
+    assert response.json()["detail"] == "Horoskop nebyl nalezen."
@@ -0,0 +1,85 @@
+import asyncio
+
+import pytest
+from bson import ObjectId
+
+from app.config import DB_NAMES
+from app.models.horoscop import HoroscopeType, JobStatus, UserInput
+from app.utils.job_queue import HoroscopeJobQueue, JobQueueFull
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+async def job_queue(memory_db):
+    # no workers, submitted jobs stay in the queue
+    queue = HoroscopeJobQueue(workers=0, max_size=2, stale_after=60.0)
+    await queue.start()
+    yield queue
+    await queue.stop()
+
+
+def user_input() -> UserInput:
+    return UserInput(
+        name="Jana",
+        dob="01.02.1990",
+        code="ABC123",
+        horoscope_type=HoroscopeType.BASIC,
+    )
+
+
+async def test_concurrent_submits_do_not_overfill_queue(
+    job_queue, memory_db, monkeypatch
+):
+    collection = memory_db[DB_NAMES.HOROSCOPE_JOBS]
+    insert_one = collection.insert_one
+
+    async def slow_insert_one(document):
+        await asyncio.sleep(0.01)
+        return await insert_one(document)
+
+    monkeypatch.setattr(type(collection), "insert_one", staticmethod(slow_insert_one))
+
+    results = await asyncio.gather(
+        *(job_queue.submit(user_input(), ObjectId()) for _ in range(5)),
+        return_exceptions=True,
+    )
+
+    jobs = [result for result in results if isinstance(result, dict)]
+    rejected = [result for result in results if isinstance(result, JobQueueFull)]
+    assert len(jobs) == 2 and len(rejected) == 3
+    # every stored job is queued, none waits forever
+    assert await collection.count_documents({}) == 2
+    assert job_queue._queue.qsize() == 2
+
+
+async def test_submit_after_failed_insert_releases_reservation(
+    job_queue, memory_db, monkeypatch
+):
+    async def failing_insert_one(document):
+        raise RuntimeError("insert failed")
+
+    collection = memory_db[DB_NAMES.HOROSCOPE_JOBS]
+    with monkeypatch.context() as patch:
+        patch.setattr(type(collection), "insert_one", staticmethod(failing_insert_one))
+        for _ in range(3):
+            with pytest.raises(RuntimeError):
+                await job_queue.submit(user_input(), ObjectId())
+
+    job = await job_queue.submit(user_input(), ObjectId())
+    assert job["status"] == JobStatus.QUEUED
+
+
+async def test_sweep_fails_jobs_of_dead_process(job_queue, memory_db):
+    validation_code_id = ObjectId()
+    job = await job_queue.submit(user_input(), validation_code_id)
+
+    # another process, the job got no heartbeat for longer than its `stale_after`
+    await asyncio.sleep(0.01)
+    other = HoroscopeJobQueue(workers=0, max_size=2, stale_after=0.0)
+    await other.sweep_orphaned()
+
+    stored = await job_queue.get(job["_id"], validation_code_id)
+    assert stored["status"] == JobStatus.FAILED
+    assert other.orphaned == 1
+    assert await job_queue.get(job["_id"], ObjectId()) is None
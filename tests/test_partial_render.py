@@ -0,0 +1,96 @@
+from datetime import datetime
+
+import pytest
+from bson import ObjectId
+from fastapi import HTTPException
+
+from app.config import DB_NAMES, SERVER_SETTINGS
+from app.models.horoscop import ContentResponse, HoroscopeType, UserInput
+from app.utils import horoscope_process
+from app.utils.gemini_admission import GeminiUnavailableError
+from app.utils.horoscope_service import create_horoscope, open_horoscope_pdf
+from app.utils.http import GEMINI_CLIENT
+from app.utils.pdf_backends import PdfBackend
+from app.utils.pdf_render import RENDER_POOL
+from app.utils.section_checkpoints import SECTION_CHECKPOINTS
+
+pytestmark = pytest.mark.anyio
+
+FAILING_SECTION = "love"
+
+
+class HtmlPdfBackend(PdfBackend):
+    """The "PDF" is the rendered HTML, enough to see which sections made it in."""
+
+    name = "test"
+    max_concurrency = 2
+
+    async def convert(self, html_content: str, options: dict[str, str]) -> bytes:
+        return b"%PDF-1.4\n" + html_content.encode("utf-8")
+
+
+@pytest.fixture
+async def pipeline(memory_db, monkeypatch):
+    async def generate_content_cached(session, key, base_prompt, prompt, **kwargs):
+        if key == FAILING_SECTION:
+            raise GeminiUnavailableError("Gemini circuit breaker is open")
+        return ContentResponse(key=key, content=f"<p>section-{key}</p>")
+
+    monkeypatch.setattr(
+        horoscope_process, "generate_content_cached", generate_content_cached
+    )
+    monkeypatch.setattr(RENDER_POOL, "backend", HtmlPdfBackend())
+    monkeypatch.setattr(SERVER_SETTINGS, "PIPELINE_EXECUTOR", "native")
+    await GEMINI_CLIENT.start()
+    yield memory_db
+    await GEMINI_CLIENT.close()
+
+
+def user_input() -> UserInput:
+    return UserInput(
+        name="Jana",
+        dob="01.02.1990",
+        code="ABC123",
+        horoscope_type=HoroscopeType.PROFI,
+    )
+
+
+@pytest.mark.parametrize("mode", ["sequential", "parallel", "structured"])
+async def test_failed_section_renders_partial_pdf(pipeline, monkeypatch, mode):
+    monkeypatch.setattr(SERVER_SETTINGS, "GENERATION_MODE", mode)
+    monkeypatch.setattr(SERVER_SETTINGS, "PARTIAL_RENDER_ENABLED", True)
+    validation_code_id = ObjectId()
+
+    horoscope_pdf = await create_horoscope(
+        user_input(), pipeline, validation_code_id, datetime.now()
+    )
+
+    _, chunks = await open_horoscope_pdf(
+        pipeline, horoscope_pdf.file_id, validation_code_id
+    )
+    pdf = b"".join([chunk async for chunk in chunks])
+    assert pdf.startswith(b"%PDF")
+    for key in HoroscopeType.PROFI.get_prompts():
+        assert (f"section-{key}".encode() in pdf) == (key != FAILING_SECTION)
+
+    document = await pipeline[DB_NAMES.HOROSCOPES].find_one(
+        {"file_id": horoscope_pdf.file_id}
+    )
+    assert document is not None
+
+
+async def test_failed_section_without_partial_policy_keeps_checkpoint(
+    pipeline, monkeypatch
+):
+    monkeypatch.setattr(SERVER_SETTINGS, "GENERATION_MODE", "parallel")
+    monkeypatch.setattr(SERVER_SETTINGS, "PARTIAL_RENDER_ENABLED", False)
+    monkeypatch.setattr(SERVER_SETTINGS, "SECTION_CHECKPOINT_ENABLED", True)
+
+    with pytest.raises(HTTPException) as error:
+        await create_horoscope(user_input(), pipeline, ObjectId(), datetime.now())
+    assert error.value.status_code == 400
+
+    # sections paid for are saved, a retry generates only the failed one
+    checkpoint = await SECTION_CHECKPOINTS._collection().find_one({})
+    expected = set(HoroscopeType.PROFI.get_prompts()) - {FAILING_SECTION}
+    assert set(checkpoint["sections"]) == expected
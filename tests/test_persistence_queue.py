@@ -0,0 +1,128 @@
+import asyncio
+import time
+
+import pytest
+from bson import ObjectId
+
+from app.config import SERVER_SETTINGS
+from app.utils.persistence_queue import PendingHoroscope, WriteBehindQueue
+
+pytestmark = pytest.mark.anyio
+
+
+class FlakyStore:
+    """Replaces `WriteBehindQueue._store`, fails while `failing` is set."""
+
+    def __init__(self) -> None:
+        self.failing = False
+        self.stored: list[ObjectId] = []
+
+    async def __call__(self, item: PendingHoroscope) -> None:
+        if self.failing:
+            raise ConnectionError("MongoDB unavailable")
+        self.stored.append(item.file_id)
+
+
+@pytest.fixture
+def store(monkeypatch) -> FlakyStore:
+    monkeypatch.setattr(SERVER_SETTINGS, "PERSISTENCE_WRITE_BEHIND", True)
+    return FlakyStore()
+
+
+def make_queue(journal_dir, store: FlakyStore, max_size: int = 10) -> WriteBehindQueue:
+    queue = WriteBehindQueue(
+        max_size=max_size,
+        workers=1,
+        retries=0,
+        backoff_base=0.0,
+        backoff_max=0.0,
+        journal_dir=str(journal_dir),
+        replay_interval=3600.0,
+        drain_timeout=1.0,
+    )
+    queue._store = store
+    return queue
+
+
+def pending(pdf: bytes = b"%PDF-1.4") -> PendingHoroscope:
+    return PendingHoroscope(
+        file_id=ObjectId(),
+        filename="Jana_horoskop.pdf",
+        metadata={"validation_code_id": ObjectId()},
+        document={"name": "Jana"},
+        pdf=pdf,
+        enqueued_at=time.time(),
+    )
+
+
+async def drain(queue: WriteBehindQueue) -> None:
+    await asyncio.wait_for(queue._queue.join(), 1.0)
+
+
+async def test_failed_store_is_journaled_and_replayed(tmp_path, store):
+    queue = make_queue(tmp_path, store)
+    await queue.start()
+    store.failing = True
+    item = pending(b"%PDF-1.4 spilled")
+    await queue.submit(item)
+    await drain(queue)
+
+    assert queue.spilled == 1
+    assert item.file_id not in queue._pending
+    # served from the journal until stored
+    journaled = await queue.pending_pdf(item.file_id)
+    assert journaled.pdf == b"%PDF-1.4 spilled"
+
+    store.failing = False
+    await queue._replay()
+    assert store.stored == [item.file_id]
+    assert queue.replayed == 1
+    assert await queue.pending_pdf(item.file_id) is None
+    await queue.stop()
+
+
+async def test_journal_survives_restart(tmp_path, store):
+    queue = make_queue(tmp_path, store, max_size=1)
+    await queue.start()
+    store.failing = True
+    item = pending()
+    await queue.submit(item)
+    await drain(queue)
+    await queue.stop()
+
+    # a new process replays the journal at startup
+    store.failing = False
+    restarted = make_queue(tmp_path, store)
+    await restarted.start()
+    await asyncio.sleep(0.05)
+    assert store.stored == [item.file_id]
+    assert restarted.stats()["journal_entries"] == 0
+    await restarted.stop()
+
+
+async def test_worker_survives_failing_journal(tmp_path, store):
+    # the journal directory cannot be created
+    journal_dir = tmp_path / "journal"
+    journal_dir.write_text("not a directory")
+    queue = make_queue(journal_dir, store)
+    await queue.start()
+
+    store.failing = True
+    lost = pending()
+    await queue.submit(lost)
+    await drain(queue)
+    assert queue.stats()["unjournaled"] == 1
+    # still in memory, the PDF can be downloaded
+    assert await queue.pending_pdf(lost.file_id) is lost
+
+    store.failing = False
+    item = pending()
+    await queue.submit(item)
+    await drain(queue)
+    assert store.stored == [item.file_id]
+
+    await queue._replay()
+    assert store.stored == [item.file_id, lost.file_id]
+    assert queue.stats()["unjournaled"] == 0
+    assert queue.stats()["pending_in_memory"] == 0
+    await queue.stop()
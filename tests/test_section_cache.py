@@ -0,0 +1,54 @@
+import asyncio
+
+import pytest
+
+from app.config import DB_NAMES
+from app.models.horoscop import ContentResponse, HoroscopeSign
+from app.utils.section_cache import SectionCache, section_cache_key
+
+pytestmark = pytest.mark.anyio
+
+KEY = "beran:7:career:abc"
+
+
+def make_cache() -> SectionCache:
+    return SectionCache(variants=2, memory_size=10, memory_ttl=3600, db_ttl=3600)
+
+
+def response(content: str) -> ContentResponse:
+    return ContentResponse(key="career", content=content, model="gemini-test")
+
+
+async def test_partial_pool_is_not_kept_in_memory(memory_db):
+    cache = make_cache()
+    other_process = make_cache()
+
+    assert await cache.get(KEY, "career") is None
+    await other_process.put(KEY, response("first"))
+    await other_process.put(KEY, response("second"))
+
+    # the pool filled by another process is seen right away
+    cached = await cache.get(KEY, "career")
+    assert cached.content in {"first", "second"}
+    assert cached.cached
+
+
+async def test_concurrent_puts_do_not_overfill_pool(memory_db):
+    cache = make_cache()
+    await asyncio.gather(
+        *(make_cache().put(KEY, response(f"variant {i}")) for i in range(5))
+    )
+    await cache.put(KEY, response("late"))
+
+    stored = await memory_db[DB_NAMES.SECTION_CACHE].find({"key": KEY}).to_list(None)
+    assert sorted(doc["slot"] for doc in stored) == [0, 1]
+
+
+def test_cache_key_depends_on_model():
+    def key(model: str) -> str:
+        return section_cache_key(
+            HoroscopeSign.ARIES, 7, "career", "Popiš kariéru.", model
+        )
+
+    assert key("gemini-2.5-flash") != key("gemini-2.5-pro")
+    assert key("gemini-2.5-flash") == key("gemini-2.5-flash")
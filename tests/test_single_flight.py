@@ -0,0 +1,146 @@
+import asyncio
+from datetime import datetime
+
+import pytest
+from bson import ObjectId
+
+from app.models.horoscop import ContentResponse, HoroscopePdf, HoroscopeType, UserInput
+from app.utils import horoscope_service
+from app.utils.horoscope_service import FLIGHT_PROGRESS, create_horoscope_once
+from app.utils.progress import (
+    PROGRESS,
+    HoroscopeProgress,
+    report_section,
+    report_section_delta,
+    report_stage,
+)
+from app.utils.single_flight import SingleFlight
+
+pytestmark = pytest.mark.anyio
+
+
+class RecordingProgress(HoroscopeProgress):
+    def __init__(self) -> None:
+        super().__init__()
+        self.events: list[tuple] = []
+
+    def on_stage(self, stage: str) -> None:
+        self.events.append(("stage", stage))
+
+    def on_section(self, response: ContentResponse) -> None:
+        self.events.append(("section", response.key, self.sections_done))
+
+    def on_section_delta(self, key: str, title: str, text: str, reset: bool) -> None:
+        self.events.append(("delta", key, text))
+
+
+async def test_concurrent_calls_share_one_execution():
+    flights: SingleFlight[int] = SingleFlight(name="test", result_window=0.0)
+    calls = 0
+
+    async def work() -> int:
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return 42
+
+    results = await asyncio.gather(*(flights.run("key", work) for _ in range(5)))
+    assert results == [42] * 5
+    assert calls == 1
+    assert (flights.leaders, flights.coalesced) == (1, 4)
+    assert flights.stats()["in_flight"] == 0
+
+
+async def test_result_window_keeps_successful_results_only():
+    flights: SingleFlight[dict] = SingleFlight(
+        name="test", result_window=60.0, remember=lambda result: {"id": result["id"]}
+    )
+
+    async def work() -> dict:
+        return {"id": 1, "pdf": b"%PDF"}
+
+    async def failing() -> dict:
+        raise RuntimeError("generation failed")
+
+    assert flights.recent("key") is None
+    await flights.run("key", work)
+    assert flights.recent("key") == {"id": 1}
+    assert flights.window_hits == 1
+
+    with pytest.raises(RuntimeError):
+        await flights.run("other", failing)
+    assert flights.recent("other") is None
+    assert flights.failures == 1
+
+
+async def test_cancelled_caller_does_not_cancel_shared_work():
+    flights: SingleFlight[str] = SingleFlight(name="test", result_window=0.0)
+    release = asyncio.Event()
+
+    async def work() -> str:
+        await release.wait()
+        return "done"
+
+    leader = asyncio.create_task(flights.run("key", work))
+    follower = asyncio.create_task(flights.run("key", work))
+    await asyncio.sleep(0)
+    leader.cancel()
+    await asyncio.sleep(0)
+    release.set()
+
+    assert await follower == "done"
+    assert leader.cancelled()
+
+
+def user_input() -> UserInput:
+    return UserInput(
+        name="Jana",
+        dob="01.02.1990",
+        code="ABC123",
+        horoscope_type=HoroscopeType.BASIC,
+    )
+
+
+async def test_progress_of_shared_generation_reaches_every_request(monkeypatch):
+    file_id = ObjectId()
+    follower_joined = asyncio.Event()
+
+    async def create_horoscope(*args) -> HoroscopePdf:
+        report_stage("generate")
+        report_section(ContentResponse(key="definition", content="..."))
+        await follower_joined.wait()
+        report_section_delta("career", "Práce", "Kari")
+        report_section(ContentResponse(key="career", content="..."))
+        report_stage("render")
+        return HoroscopePdf(filename="Jana_horoskop.pdf", file_id=file_id)
+
+    monkeypatch.setattr(horoscope_service, "create_horoscope", create_horoscope)
+
+    async def request(progress: RecordingProgress) -> HoroscopePdf:
+        PROGRESS.set(progress)
+        return await create_horoscope_once(
+            user_input(), None, ObjectId(), datetime.now()
+        )
+
+    leader_progress, follower_progress = RecordingProgress(), RecordingProgress()
+    leader = asyncio.create_task(request(leader_progress))
+    await asyncio.sleep(0.01)
+    follower = asyncio.create_task(request(follower_progress))
+    await asyncio.sleep(0.01)
+    follower_joined.set()
+
+    results = await asyncio.gather(leader, follower)
+    assert [result.file_id for result in results] == [file_id, file_id]
+
+    expected = [
+        ("stage", "generate"),
+        ("section", "definition", 1),
+        ("delta", "career", "Kari"),
+        ("section", "career", 2),
+        ("stage", "render"),
+    ]
+    assert leader_progress.events == expected
+    # the follower joined late and got the state reached so far replayed
+    assert follower_progress.events == expected
+    assert follower_progress.sections_done == 2
+    assert not FLIGHT_PROGRESS
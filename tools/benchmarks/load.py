@@ -0,0 +1,481 @@
+"""
+End-to-end load benchmark of `/api/horoscope/horoscope-pdf` without real Gemini
+and Gotenberg - both are replaced by the local stubs (`tools.stubs`) started as
+subprocesses, the API runs in this process under uvicorn and is driven over HTTP.
+
+For every horoscope type and concurrency level a closed loop of `concurrency`
+clients sends `--requests` requests (distinct names, so no request is coalesced
+or served from the PDF cache) and the run reports requests per second,
+p50/p95/p99 latency, peak RSS of the API process and a per-stage breakdown taken
+from the application metrics (`app.utils.metrics`).
+
+Usage:
+    python -m tools.benchmarks.load --concurrency 1 4 16 --requests 40 \\
+        --gemini-latency 0.4 --latency-distribution lognormal --latency-jitter 0.5 \\
+        --output results/load.json
+
+    # compare with an earlier run, exits with 1 on a regression over the tolerance
+    python -m tools.benchmarks.load --compare results/load.json --tolerance 0.15
+
+MongoDB is in memory by default (`mongomock-motor` is required), `--mongo` with
+a connection string uses a real server and its `--db-name` database, which is
+dropped at the end. Application settings come from the environment as usual,
+only the upstream URLs and the database are set by the benchmark.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from typing import Optional
+
+import aiohttp
+from loguru import logger
+
+from tools.benchmarks.memory import RssSampler, rss_source
+from tools.stubs.latency import DISTRIBUTIONS
+
+HOROSCOPE_TYPES = ["HoroscopeBasic", "HoroscopeProfi"]
+ACCESS_CODE = "BENCHMARK"
+# settings worth knowing when two runs are compared
+REPORTED_SETTINGS = [
+    "PIPELINE_EXECUTOR",
+    "GENERATION_MODE",
+    "GENERATION_MAX_CONCURRENCY_GLOBAL",
+    "GENERATION_MAX_CONCURRENCY_PER_REQUEST",
+    "GEMINI_STREAMING",
+    "GEMINI_CONTEXT_CACHE_ENABLED",
+    "SECTION_CACHE_ENABLED",
+    "PDF_BACKEND",
+    "GOTENBERG_MAX_CONCURRENT_RENDERS",
+    "PERSISTENCE_WRITE_BEHIND",
+    "ACCESS_CODE_CACHE_ENABLED",
+    "TEMPLATE_MINIFY",
+]
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def wait_for_port(port: int, timeout: float = 15.0) -> None:
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            _, writer = await asyncio.open_connection("127.0.0.1", port)
+        except OSError:
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"Stub on port {port} did not start")
+            await asyncio.sleep(0.1)
+            continue
+        writer.close()
+        await writer.wait_closed()
+        return
+
+
+def stub_commands(
+    args: argparse.Namespace, gemini_port: int, gotenberg_port: int
+) -> list[list[str]]:
+    latency = [
+        "--latency-distribution",
+        args.latency_distribution,
+        "--latency-jitter",
+        str(args.latency_jitter),
+    ]
+    gemini = [
+        sys.executable,
+        "-m",
+        "tools.stubs.gemini_stub",
+        "--port",
+        str(gemini_port),
+        "--latency",
+        str(args.gemini_latency),
+        "--cached-latency",
+        str(args.gemini_latency),
+        "--fail-rate",
+        str(args.gemini_fail_rate),
+        "--rate-limit-rate",
+        str(args.gemini_rate_limit_rate),
+        "--retry-delay",
+        str(args.gemini_retry_delay),
+        "--response-chars",
+        str(args.gemini_response_chars),
+        *latency,
+    ]
+    gotenberg = [
+        sys.executable,
+        "-m",
+        "tools.stubs.gotenberg_stub",
+        "--port",
+        str(gotenberg_port),
+        "--latency",
+        str(args.gotenberg_latency),
+        "--max-concurrency",
+        str(args.gotenberg_max_concurrency),
+        "--fail-rate",
+        str(args.gotenberg_fail_rate),
+        "--pdf-bytes",
+        str(args.pdf_bytes),
+        *latency,
+    ]
+    return [gemini, gotenberg]
+
+
+def configure_environment(
+    args: argparse.Namespace, gemini_port: int, gotenberg_port: int
+) -> None:
+    # settings are read when `app.config` is imported, so before any app import
+    os.environ["GEMINI_API_URL"] = (
+        f"http://127.0.0.1:{gemini_port}/v1beta/models/"
+        f"{args.gemini_model}:generateContent"
+    )
+    os.environ["GOTENBERG_API_URL"] = (
+        f"http://127.0.0.1:{gotenberg_port}/forms/chromium/convert/html"
+    )
+    os.environ["MONGO_DB_NAME"] = args.db_name
+    if args.mongo != "memory":
+        os.environ["MONGO_DB_URL"] = args.mongo
+
+
+def stage_totals() -> dict[str, tuple[float, int]]:
+    """Sum and count of the stage histograms, summed over their other labels."""
+    from app.utils import metrics
+
+    stages = {
+        "node": (metrics.NODE_SECONDS, 0),
+        "phase": (metrics.HOROSCOPE_PHASE_SECONDS, 1),
+        "section": (metrics.SECTION_SECONDS, None),
+        "template_render": (metrics.TEMPLATE_RENDER_SECONDS, None),
+        "pdf_render": (metrics.PDF_RENDER_SECONDS, None),
+        "gridfs_upload": (metrics.GRIDFS_UPLOAD_SECONDS, None),
+        "mongo_insert": (metrics.MONGO_INSERT_SECONDS, None),
+    }
+    totals: dict[str, tuple[float, int]] = {}
+    for name, (histogram, label_index) in stages.items():
+        for labels, (total, count) in histogram.totals().items():
+            stage = name if label_index is None else f"{name}.{labels[label_index]}"
+            previous = totals.get(stage, (0.0, 0))
+            totals[stage] = (previous[0] + total, previous[1] + count)
+    return totals
+
+
+def stage_breakdown(
+    before: dict[str, tuple[float, int]], after: dict[str, tuple[float, int]]
+) -> dict[str, dict]:
+    breakdown = {}
+    for stage, (total, count) in sorted(after.items()):
+        previous_total, previous_count = before.get(stage, (0.0, 0))
+        count -= previous_count
+        if count:
+            breakdown[stage] = {
+                "count": count,
+                "mean_ms": round((total - previous_total) / count * 1000, 2),
+            }
+    return breakdown
+
+
+def counter_total(counter) -> float:
+    return sum(counter.totals().values())
+
+
+async def run_level(
+    session: aiohttp.ClientSession,
+    url: str,
+    horoscope_type: str,
+    concurrency: int,
+    requests: int,
+    label: str = "Benchmark",
+) -> dict:
+    from app.utils import metrics
+    from app.utils.latency import LatencyWindow
+
+    latency = LatencyWindow(requests)
+    statuses: dict[str, int] = {}
+    pdf_bytes = 0
+    next_request = 0
+
+    async def client() -> None:
+        nonlocal next_request, pdf_bytes
+        while next_request < requests:
+            index = next_request
+            next_request += 1
+            body = {
+                "name": f"{label} {horoscope_type} {concurrency} {index}",
+                "dob": f"{index % 28 + 1:02d}.{index % 12 + 1:02d}.1990",
+                "code": ACCESS_CODE,
+                "horoscope_type": horoscope_type,
+            }
+            started_at = time.perf_counter()
+            try:
+                async with session.post(url, json=body) as response:
+                    content = await response.read()
+                    status = str(response.status)
+            except aiohttp.ClientError as err:
+                status = type(err).__name__
+                content = b""
+            statuses[status] = statuses.get(status, 0) + 1
+            if status == "200":
+                latency.record(time.perf_counter() - started_at)
+                pdf_bytes += len(content)
+
+    stages_before = stage_totals()
+    retries_before = counter_total(metrics.GEMINI_RETRIES)
+    sampler = RssSampler(include_children=False)
+    sampler.start()
+    started_at = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started_at
+    peak_rss = await sampler.stop()
+    # the last stages are recorded just after the response is sent
+    while counter_total(metrics.HOROSCOPES_IN_FLIGHT) > 0:
+        await asyncio.sleep(0.01)
+
+    succeeded = statuses.get("200", 0)
+
+    def percentile(q: float) -> Optional[float]:
+        value = latency.percentile(q)
+        return round(value, 3) if value is not None else None
+
+    return {
+        "horoscope_type": horoscope_type,
+        "concurrency": concurrency,
+        "requests": requests,
+        "succeeded": succeeded,
+        "statuses": statuses,
+        "seconds": round(elapsed, 3),
+        "requests_per_second": round(succeeded / elapsed, 3) if elapsed else 0.0,
+        "latency": {
+            "p50": percentile(50),
+            "p95": percentile(95),
+            "p99": percentile(99),
+        },
+        "avg_pdf_bytes": pdf_bytes // succeeded if succeeded else 0,
+        "peak_rss_mb": round(peak_rss / 1024**2, 1),
+        "gemini_retries": int(counter_total(metrics.GEMINI_RETRIES) - retries_before),
+        "stages": stage_breakdown(stages_before, stage_totals()),
+    }
+
+
+async def run_benchmark(args: argparse.Namespace) -> dict:
+    gemini_port, gotenberg_port, api_port = free_port(), free_port(), free_port()
+    configure_environment(args, gemini_port, gotenberg_port)
+
+    stubs = [
+        subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        for command in stub_commands(args, gemini_port, gotenberg_port)
+    ]
+    try:
+        await wait_for_port(gemini_port)
+        await wait_for_port(gotenberg_port)
+        return await run_api(args, api_port)
+    finally:
+        for stub in stubs:
+            stub.terminate()
+            stub.wait()
+
+
+async def run_api(args: argparse.Namespace, api_port: int) -> dict:
+    # the application is imported only now, after `configure_environment`
+    import uvicorn
+
+    from app.config import DB_NAMES, SERVER_SETTINGS
+    from app.main import app
+    from app.utils.database import DB
+
+    if args.mongo == "memory":
+        from tools.stubs.mongo_stub import install_memory_mongo
+
+        install_memory_mongo()
+
+    server = uvicorn.Server(
+        uvicorn.Config(
+            app, host="127.0.0.1", port=api_port, log_level="warning", lifespan="on"
+        )
+    )
+    serving = asyncio.create_task(server.serve())
+    while not server.started:
+        if serving.done():
+            serving.result()
+        await asyncio.sleep(0.05)
+
+    db = DB.get_database()
+    await db[DB_NAMES.ACCESS_CODES].update_one(
+        {"code": ACCESS_CODE}, {"$setOnInsert": {"code": ACCESS_CODE}}, upsert=True
+    )
+
+    url = f"http://127.0.0.1:{api_port}/api/horoscope/horoscope-pdf"
+    results = []
+    try:
+        async with aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=0),
+            timeout=aiohttp.ClientTimeout(total=args.timeout),
+        ) as session:
+            for horoscope_type in args.types:
+                # connections, templates and context caches are warm for every level
+                await run_level(
+                    session, url, horoscope_type, 1, args.warmup, label="Warm-up"
+                )
+                for concurrency in args.concurrency:
+                    result = await run_level(
+                        session, url, horoscope_type, concurrency, args.requests
+                    )
+                    print(format_result(result), file=sys.stderr)
+                    results.append(result)
+    finally:
+        if args.mongo != "memory":
+            await DB.mongo_client.drop_database(args.db_name)
+        server.should_exit = True
+        await serving
+
+    return {
+        "meta": {
+            "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "git_commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "rss_source": rss_source(),
+            "mongo": "memory" if args.mongo == "memory" else "server",
+            "stubs": {
+                name: value
+                for name, value in vars(args).items()
+                if name.startswith(("gemini_", "gotenberg_", "latency_", "pdf_"))
+            },
+            "settings": {
+                name: getattr(SERVER_SETTINGS, name) for name in REPORTED_SETTINGS
+            },
+        },
+        "results": results,
+    }
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def format_result(result: dict) -> str:
+    latency = result["latency"]
+    return (
+        f"{result['horoscope_type']:>15} c={result['concurrency']:<3} "
+        f"{result['requests_per_second']:>7.2f} req/s  "
+        f"p50={latency['p50']}s p95={latency['p95']}s p99={latency['p99']}s  "
+        f"ok={result['succeeded']}/{result['requests']}  "
+        f"rss={result['peak_rss_mb']}MB"
+    )
+
+
+def compare(baseline: dict, current: dict, tolerance: float) -> list[str]:
+    """
+    Throughput drops and p95 latency increases over `tolerance` (relative)
+
+    :return: descriptions of the regressions
+    """
+    previous = {
+        (result["horoscope_type"], result["concurrency"]): result
+        for result in baseline["results"]
+    }
+    regressions = []
+    for result in current["results"]:
+        old = previous.get((result["horoscope_type"], result["concurrency"]))
+        if old is None:
+            continue
+        name = f"{result['horoscope_type']} c={result['concurrency']}"
+        old_rps, rps = old["requests_per_second"], result["requests_per_second"]
+        if old_rps and rps < old_rps * (1 - tolerance):
+            regressions.append(f"{name}: {old_rps} -> {rps} req/s")
+        old_p95, p95 = old["latency"]["p95"], result["latency"]["p95"]
+        if old_p95 and p95 and p95 > old_p95 * (1 + tolerance):
+            regressions.append(f"{name}: p95 {old_p95}s -> {p95}s")
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="End-to-end load benchmark")
+    parser.add_argument(
+        "--types", nargs="+", choices=HOROSCOPE_TYPES, default=HOROSCOPE_TYPES
+    )
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[1, 4, 16])
+    parser.add_argument(
+        "--requests", type=int, default=32, help="requests per concurrency level"
+    )
+    parser.add_argument(
+        "--warmup", type=int, default=2, help="requests before each horoscope type"
+    )
+    parser.add_argument(
+        "--timeout", type=float, default=300.0, help="seconds per request"
+    )
+    parser.add_argument(
+        "--mongo",
+        default="memory",
+        help="'memory' (mongomock) or MongoDB connection string",
+    )
+    parser.add_argument("--db-name", default="horoscope_benchmark")
+
+    stubs = parser.add_argument_group("stubs")
+    stubs.add_argument("--gemini-model", default="gemini-2.5-flash-lite")
+    stubs.add_argument("--gemini-latency", type=float, default=0.5)
+    stubs.add_argument("--gemini-fail-rate", type=float, default=0.0)
+    stubs.add_argument("--gemini-rate-limit-rate", type=float, default=0.0)
+    stubs.add_argument("--gemini-retry-delay", type=float, default=1.0)
+    stubs.add_argument(
+        "--gemini-response-chars",
+        type=int,
+        default=2000,
+        help="length of a section reply",
+    )
+    stubs.add_argument("--gotenberg-latency", type=float, default=1.0)
+    stubs.add_argument("--gotenberg-max-concurrency", type=int, default=6)
+    stubs.add_argument("--gotenberg-fail-rate", type=float, default=0.0)
+    stubs.add_argument("--pdf-bytes", type=int, default=200_000)
+    stubs.add_argument(
+        "--latency-distribution", choices=DISTRIBUTIONS, default="lognormal"
+    )
+    stubs.add_argument("--latency-jitter", type=float, default=0.3)
+
+    parser.add_argument("--output", help="write results as JSON to this file")
+    parser.add_argument("--compare", help="results of an earlier run to compare with")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.1,
+        help="relative change reported as a regression",
+    )
+    parser.add_argument("--log-level", default="WARNING")
+    args = parser.parse_args()
+
+    logger.remove()
+    logger.add(sys.stderr, level=args.log_level)
+
+    report = asyncio.run(run_benchmark(args))
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+    print(output, file=sys.stdout)
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            regressions = compare(json.load(f), report, args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
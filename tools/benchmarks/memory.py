@@ -0,0 +1,74 @@
+"""
+Memory sampling of the benchmarks - psutil when installed, otherwise the peak RSS
+reported by `resource` (process lifetime peak, it can not be reset between runs).
+"""
+
+import asyncio
+import resource
+from typing import Optional
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+
+def rss_source() -> str:
+    return "psutil" if psutil is not None else "getrusage"
+
+
+def peak_rss_fallback(include_children: bool) -> int:
+    # ru_maxrss is in kilobytes on Linux, children are the reaped worker processes
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if not include_children:
+        return own * 1024
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return (own + children) * 1024
+
+
+def current_rss() -> int:
+    """RSS of this process, the peak RSS when psutil is not installed."""
+    if psutil is None:
+        return peak_rss_fallback(include_children=False)
+    return psutil.Process().memory_info().rss
+
+
+class RssSampler:
+    """
+    Peak RSS of this process (and its children with `include_children`),
+    sampled every `interval` seconds.
+    """
+
+    def __init__(self, interval: float = 0.05, include_children: bool = True) -> None:
+        self.interval = interval
+        self.include_children = include_children
+        self.peak = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def sample(self) -> int:
+        process = psutil.Process()
+        total = process.memory_info().rss
+        if not self.include_children:
+            return total
+        for child in process.children(recursive=True):
+            try:
+                total += child.memory_info().rss
+            except psutil.Error:
+                pass
+        return total
+
+    async def _run(self) -> None:
+        while True:
+            self.peak = max(self.peak, self.sample())
+            await asyncio.sleep(self.interval)
+
+    def start(self) -> None:
+        if psutil is not None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> int:
+        if self._task is None:
+            return peak_rss_fallback(self.include_children)
+        self._task.cancel()
+        self.peak = max(self.peak, self.sample())
+        return self.peak
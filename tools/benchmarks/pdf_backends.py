@@ -0,0 +1,154 @@
+"""
+Compare PDF backends (Gotenberg vs. in-process WeasyPrint) on the same rendered
+horoscopes - throughput, render latency and memory of the API process incl. its
+worker processes.
+
+Horoscopes are rendered from `app/utils/debug_horoscope.json` with a distinct name
+each, the PDF cache is disabled so every render is a conversion.
+
+Usage:
+    python -m tools.stubs.gotenberg_stub --port 5001 --latency 0.5 &
+    GOTENBERG_API_URL=http://localhost:5001/forms/chromium/convert/html \\
+        python -m tools.benchmarks.pdf_backends --renders 40 --concurrency 8
+
+Memory is sampled with psutil when installed (RSS of the process and its children),
+otherwise the peak RSS reported by `resource` is used.
+"""
+
+import argparse
+import asyncio
+import json
+import sys
+import time
+
+from app.config import SERVER_SETTINGS
+from app.utils.helper import debug_llm_result
+from app.utils.http import GOTENBERG_CLIENT
+from app.utils.latency import LatencyWindow
+from app.utils.pdf_backends import GotenbergBackend, PdfBackend, WeasyPrintBackend
+from app.utils.pdf_render import PdfRenderPool
+from app.utils.template_engine import TEMPLATE_ENGINE
+from tools.benchmarks.memory import RssSampler, rss_source
+
+
+def rendered_horoscopes(count: int) -> list[str]:
+    horoscope = debug_llm_result()
+    data = {
+        **horoscope.model_dump(exclude_none=True),
+        "zodiac_cz": horoscope.zodiac.get_czech_name() if horoscope.zodiac else "",
+    }
+    return [
+        TEMPLATE_ENGINE.render(
+            "basic_template.html", {**data, "name": f"{horoscope.name} {index}"}
+        )
+        for index in range(count)
+    ]
+
+
+async def run_backend(
+    backend: PdfBackend, pages: list[str], concurrency: int, timeout: float
+) -> dict:
+    pool = PdfRenderPool(backend, timeout=timeout, cache_size=0, cache_max_bytes=0)
+    try:
+        await pool.start()
+    except RuntimeError as err:
+        return {"backend": backend.name, "error": str(err)}
+
+    sampler = RssSampler()
+    sampler.start()
+    latency = LatencyWindow(len(pages))
+    limit = asyncio.Semaphore(concurrency)
+    failures = 0
+    pdf_bytes = 0
+
+    async def render(html_content: str) -> None:
+        nonlocal failures, pdf_bytes
+        async with limit:
+            started_at = time.perf_counter()
+            try:
+                pdf = await pool.render(html_content)
+            except Exception:
+                failures += 1
+                return
+            latency.record(time.perf_counter() - started_at)
+            pdf_bytes += len(pdf)
+
+    started_at = time.perf_counter()
+    try:
+        await asyncio.gather(*(render(page) for page in pages))
+    finally:
+        elapsed = time.perf_counter() - started_at
+        peak_rss = await sampler.stop()
+        await pool.close()
+
+    rendered = len(pages) - failures
+    return {
+        "backend": backend.name,
+        "workers": backend.max_concurrency,
+        "renders": rendered,
+        "failures": failures,
+        "seconds": round(elapsed, 3),
+        "renders_per_second": round(rendered / elapsed, 2) if elapsed else 0.0,
+        "latency": {
+            **latency.stats(),
+            "p99": round(latency.percentile(99) or 0.0, 3),
+        },
+        "avg_pdf_bytes": pdf_bytes // rendered if rendered else 0,
+        "peak_rss_mb": round(peak_rss / 1024**2, 1),
+        "rss_source": rss_source(),
+    }
+
+
+async def main_async(args: argparse.Namespace) -> list[dict]:
+    pages = rendered_horoscopes(args.renders)
+    backends: dict[str, PdfBackend] = {
+        "gotenberg": GotenbergBackend(args.concurrency),
+        "weasyprint": WeasyPrintBackend(args.workers),
+    }
+
+    await GOTENBERG_CLIENT.start()
+    try:
+        results = []
+        for name in args.backends:
+            results.append(
+                await run_backend(backends[name], pages, args.concurrency, args.timeout)
+            )
+        return results
+    finally:
+        await GOTENBERG_CLIENT.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark of the PDF backends")
+    parser.add_argument(
+        "--backends",
+        nargs="+",
+        choices=["gotenberg", "weasyprint"],
+        default=["gotenberg", "weasyprint"],
+    )
+    parser.add_argument("--renders", type=int, default=20)
+    parser.add_argument(
+        "--concurrency", type=int, default=4, help="renders submitted at once"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=SERVER_SETTINGS.PDF_PROCESS_WORKERS,
+        help="WeasyPrint worker processes",
+    )
+    parser.add_argument(
+        "--timeout", type=float, default=SERVER_SETTINGS.PDF_RENDER_TIMEOUT
+    )
+    parser.add_argument("--output", help="write results as JSON to this file")
+    args = parser.parse_args()
+
+    results = asyncio.run(main_async(args))
+    report = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(report)
+    print(report, file=sys.stdout)
+
+
+if __name__ == "__main__":
+    main()
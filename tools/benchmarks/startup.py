@@ -0,0 +1,211 @@
+"""
+Cold start benchmark - import time and memory of the API for each
+`PIPELINE_EXECUTOR`, every run in a fresh interpreter.
+
+A run imports `app.main` (import time and RSS after it), with `--lifespan` it also
+goes through the application startup with in-memory MongoDB (`mongomock-motor`
+is required) and reports the startup time and RSS after it. With `--top` the
+packages taking most of the import time (by `python -X importtime`) are listed.
+
+Usage:
+    python -m tools.benchmarks.startup --runs 5 --top 10
+    python -m tools.benchmarks.startup --lifespan --budget 0.8 --output results/startup.json
+
+`--budget` is the import time budget in seconds, the benchmark exits with 1 when
+the median import time of a mode exceeds it. Only the standard library and
+`tools.benchmarks.memory` are imported before the measurement.
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+from tools.benchmarks.memory import current_rss, rss_source
+
+EXECUTORS = ["langgraph", "native"]
+MB = 1024 * 1024
+
+
+def measure(lifespan: bool) -> dict:
+    """Imports (and starts) the application in this process."""
+    result = {"base_rss_mb": round(current_rss() / MB, 1)}
+
+    started_at = time.perf_counter()
+    import app.main
+
+    result["import_seconds"] = round(time.perf_counter() - started_at, 4)
+    result["import_rss_mb"] = round(current_rss() / MB, 1)
+    result["langgraph_imported"] = "langgraph" in sys.modules
+    if not lifespan:
+        return result
+
+    import asyncio
+
+    from loguru import logger
+
+    from tools.stubs.mongo_stub import install_memory_mongo
+
+    logger.remove()
+    install_memory_mongo()
+
+    async def start() -> float:
+        started_at = time.perf_counter()
+        async with app.main.lifespan(app.main.app):
+            return time.perf_counter() - started_at
+
+    result["startup_seconds"] = round(asyncio.run(start()), 4)
+    result["startup_rss_mb"] = round(current_rss() / MB, 1)
+    result["langgraph_imported_at_startup"] = "langgraph" in sys.modules
+    return result
+
+
+def run_child(executor: str, lifespan: bool, importtime: bool = False) -> tuple:
+    command = [sys.executable]
+    if importtime:
+        command += ["-X", "importtime"]
+    command += ["-m", "tools.benchmarks.startup", "--child"]
+    if lifespan:
+        command.append("--lifespan")
+
+    process = subprocess.run(
+        command,
+        env={**os.environ, "PIPELINE_EXECUTOR": executor},
+        capture_output=True,
+        text=True,
+    )
+    if process.returncode != 0:
+        raise RuntimeError(
+            f"Startup run of '{executor}' failed:\n{process.stderr[-2000:]}"
+        )
+    lines = [line for line in process.stdout.splitlines() if line.strip()]
+    return json.loads(lines[-1]), process.stderr
+
+
+def slowest_packages(importtime_output: str, top: int) -> list[dict]:
+    """
+    Import time by top-level package, summed from the self times of its modules
+
+    :return: `top` slowest packages
+    """
+    packages: dict[str, int] = {}
+    for line in importtime_output.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, _, name = line[len("import time:") :].split("|")
+        root = name.strip().split(".")[0]
+        packages[root] = packages.get(root, 0) + int(self_us)
+    slowest = sorted(packages.items(), key=lambda item: item[1], reverse=True)
+    return [
+        {"package": name, "seconds": round(us / 1_000_000, 4)}
+        for name, us in slowest[:top]
+    ]
+
+
+def summarize(executor: str, runs: list[dict]) -> dict:
+    summary = {"executor": executor, "runs": len(runs)}
+    for name in runs[0]:
+        values = [run[name] for run in runs]
+        if isinstance(values[0], bool):
+            summary[name] = any(values)
+        else:
+            summary[name] = round(statistics.median(values), 4)
+            if name.endswith("_seconds"):
+                summary[f"{name}_min"] = min(values)
+    return summary
+
+
+def format_summary(summary: dict) -> str:
+    line = (
+        f"{summary['executor']:>10}  import={summary['import_seconds']}s "
+        f"(min {summary['import_seconds_min']}s)  "
+        f"rss={summary['import_rss_mb']}MB (interpreter {summary['base_rss_mb']}MB)  "
+        f"langgraph={'yes' if summary['langgraph_imported'] else 'no'}"
+    )
+    if "startup_seconds" in summary:
+        line += (
+            f"  startup={summary['startup_seconds']}s "
+            f"rss={summary['startup_rss_mb']}MB"
+        )
+    return line
+
+
+def run_benchmark(args: argparse.Namespace) -> dict:
+    from tools.benchmarks.load import git_commit
+
+    results = []
+    for executor in args.executors:
+        runs = [run_child(executor, args.lifespan)[0] for _ in range(args.runs)]
+        summary = summarize(executor, runs)
+        if args.top:
+            _, importtime_output = run_child(executor, False, importtime=True)
+            summary["slowest_packages"] = slowest_packages(importtime_output, args.top)
+        print(format_summary(summary), file=sys.stderr)
+        results.append(summary)
+
+    return {
+        "meta": {
+            "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "git_commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "rss_source": rss_source(),
+            "budget_seconds": args.budget,
+        },
+        "results": results,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Cold start benchmark")
+    parser.add_argument("--executors", nargs="+", choices=EXECUTORS, default=EXECUTORS)
+    parser.add_argument("--runs", type=int, default=5, help="runs per executor")
+    parser.add_argument(
+        "--lifespan",
+        action="store_true",
+        help="also run the application startup with in-memory MongoDB",
+    )
+    parser.add_argument(
+        "--top", type=int, default=0, help="list the N slowest imported packages"
+    )
+    parser.add_argument(
+        "--budget", type=float, help="import time budget in seconds (median)"
+    )
+    parser.add_argument("--output", help="write results as JSON to this file")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(measure(args.lifespan)))
+        return
+
+    report = run_benchmark(args)
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+    print(output, file=sys.stdout)
+
+    if args.budget is not None:
+        over = [
+            result
+            for result in report["results"]
+            if result["import_seconds"] > args.budget
+        ]
+        for result in over:
+            print(
+                f"OVER BUDGET {result['executor']}: import "
+                f"{result['import_seconds']}s > {args.budget}s",
+                file=sys.stderr,
+            )
+        if over:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,478 @@
+"""
+Local stand-in for the Gemini REST API, for offline development and benchmarks.
+
+Implements `models/{model}:generateContent`, `:streamGenerateContent` (SSE),
+the `cachedContents` endpoints (create, get, delete) with in-memory storage and TTL,
+and the Batch API - `models/{model}:batchGenerateContent` with inlined requests,
+`batches/{id}` (get, delete) and `batches/{id}:cancel`. Latency distribution,
+503/429 rates, the reply size and the duration and failure rate of batch jobs
+are configurable.
+
+Usage:
+    python -m tools.stubs.gemini_stub --port 8081 --latency 0.5
+
+and point the app at it:
+    GEMINI_API_URL=http://localhost:8081/v1beta/models/gemini-2.5-flash-lite:generateContent
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import re
+import time
+import uuid
+
+from aiohttp import web
+
+from tools.stubs.latency import LatencyModel, add_latency_arguments, latency_model
+
+API_PREFIX = "/v1beta"
+STREAM_CHUNKS = 4
+
+
+def count_tokens(text: str) -> int:
+    return max(len(text) // 4, 1)
+
+
+def parts_text(contents: list[dict]) -> str:
+    return "".join(
+        part.get("text", "")
+        for content in contents
+        for part in content.get("parts", [])
+    )
+
+
+class GeminiStub:
+    def __init__(
+        self,
+        latency: float,
+        cached_latency: float,
+        fail_rate: float,
+        stream_drop_rate: float = 0.0,
+        rate_limit_rate: float = 0.0,
+        retry_delay: float = 1.0,
+        response_chars: int = 0,
+        latency_model: LatencyModel = LatencyModel(),
+        batch_latency: float = 5.0,
+        batch_fail_rate: float = 0.0,
+    ) -> None:
+        self.latency = latency
+        self.cached_latency = cached_latency
+        self.fail_rate = fail_rate
+        self.stream_drop_rate = stream_drop_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_delay = retry_delay
+        self.response_chars = response_chars
+        self.latency_model = latency_model
+        self.batch_latency = batch_latency
+        self.batch_fail_rate = batch_fail_rate
+        # name -> (expires_at, cached content resource)
+        self.caches: dict[str, tuple[float, dict]] = {}
+        # name -> batch operation, its processing task
+        self.batches: dict[str, dict] = {}
+        self._batch_tasks: dict[str, asyncio.Task] = {}
+        self.calls = 0
+        self.rate_limited = 0
+
+    def _get_cache(self, name: str) -> dict | None:
+        entry = self.caches.get(name)
+        if entry is None:
+            return None
+        expires_at, cache = entry
+        if expires_at < time.time():
+            del self.caches[name]
+            return None
+        return cache
+
+    def _error(self, status: int, message: str) -> web.Response:
+        return web.json_response(
+            {"error": {"code": status, "message": message}}, status=status
+        )
+
+    async def generate_content(self, request: web.Request) -> web.Response:
+        model, _, method = request.match_info["model_method"].partition(":")
+        if method == "batchGenerateContent":
+            return await self.create_batch(request, model)
+        if method not in ("generateContent", "streamGenerateContent"):
+            return self._error(404, f"Method '{method}' is not supported")
+
+        body: dict = await request.json()
+        self.calls += 1
+
+        cached_tokens = 0
+        cached_content = body.get("cachedContent")
+        if cached_content:
+            cache = self._get_cache(cached_content)
+            if cache is None:
+                return self._error(403, f"CachedContent not found: {cached_content}")
+            if cache["model"] != f"models/{model}":
+                return self._error(400, "Model does not match the cached content")
+            if "systemInstruction" in body or "tools" in body:
+                return self._error(
+                    400,
+                    "CachedContent can not be used with systemInstruction or tools",
+                )
+            cached_tokens = cache["usageMetadata"]["totalTokenCount"]
+
+        if random.random() < self.rate_limit_rate:
+            self.rate_limited += 1
+            return self._rate_limited()
+        if random.random() < self.fail_rate:
+            return self._error(503, "The model is overloaded. Please try again later.")
+
+        # cached prefix shortens time to first token
+        latency = self.latency_model.sample(
+            self.cached_latency if cached_tokens else self.latency
+        )
+        if method == "generateContent":
+            await asyncio.sleep(latency)
+
+        text, usage = self._reply(body, cached_tokens)
+
+        if method == "streamGenerateContent":
+            return await self.stream(request, model, text, usage, latency)
+
+        return web.json_response(self._response(model, text, usage))
+
+    def _reply(self, body: dict, cached_tokens: int = 0) -> tuple[str, dict]:
+        """Text and usage metadata of the reply to a GenerateContentRequest."""
+        prompt = parts_text(body.get("contents", []))
+        system = parts_text([body.get("systemInstruction") or {}])
+        prompt_tokens = count_tokens(system + prompt) + cached_tokens
+
+        config = body.get("generationConfig") or {}
+        schema = config.get("responseSchema")
+        if config.get("responseMimeType") == "application/json" and schema:
+            text = json.dumps(
+                {
+                    key: f"<p>Stub text of section {key}. "
+                    + "Lorem ipsum " * 10
+                    + "</p>"
+                    for key in schema.get("properties", {})
+                },
+                ensure_ascii=False,
+            )
+        else:
+            text = f"<p>Stub response to: {prompt[-80:]}</p>"
+        if len(text) < self.response_chars:
+            text = self._padded(text)
+        output_tokens = count_tokens(text)
+
+        usage = {
+            "promptTokenCount": prompt_tokens,
+            "candidatesTokenCount": output_tokens,
+            "totalTokenCount": prompt_tokens + output_tokens,
+        }
+        if cached_tokens:
+            usage["cachedContentTokenCount"] = cached_tokens
+        return text, usage
+
+    def _response(self, model: str, text: str, usage: dict) -> dict:
+        return {
+            "candidates": [
+                {
+                    "content": {"role": "model", "parts": [{"text": text}]},
+                    "finishReason": "STOP",
+                }
+            ],
+            "usageMetadata": usage,
+            "modelVersion": model,
+        }
+
+    def _rate_limited(self) -> web.Response:
+        return web.json_response(
+            {
+                "error": {
+                    "code": 429,
+                    "message": "Resource has been exhausted (e.g. check quota).",
+                    "status": "RESOURCE_EXHAUSTED",
+                    "details": [
+                        {
+                            "@type": "type.googleapis.com/google.rpc.RetryInfo",
+                            "retryDelay": f"{self.retry_delay}s",
+                        }
+                    ],
+                }
+            },
+            status=429,
+        )
+
+    def _padded(self, text: str) -> str:
+        # pads the reply up to `response_chars`, JSON replies keep being valid JSON
+        filler = "Lorem ipsum dolor sit amet. "
+        missing = self.response_chars - len(text)
+        padding = (filler * (missing // len(filler) + 1))[:missing]
+        if text.startswith("{"):
+            data = json.loads(text)
+            share = max(missing // max(len(data), 1), 0)
+            return json.dumps(
+                {
+                    key: value.replace("</p>", padding[:share] + "</p>")
+                    for key, value in data.items()
+                },
+                ensure_ascii=False,
+            )
+        return text.replace("</p>", padding + "</p>")
+
+    async def stream(
+        self,
+        request: web.Request,
+        model: str,
+        text: str,
+        usage: dict,
+        latency: float,
+    ) -> web.StreamResponse:
+        """
+        Sends the reply as Server-Sent Events in `STREAM_CHUNKS` chunks spread over
+        the latency, usage and finish reason come with the last chunk
+        """
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+
+        size = -(-len(text) // STREAM_CHUNKS)
+        chunks = [text[i : i + size] for i in range(0, len(text), size)]
+        drop = random.random() < self.stream_drop_rate
+        try:
+            for index, chunk in enumerate(chunks):
+                await asyncio.sleep(latency / len(chunks))
+                last = index == len(chunks) - 1
+                if last and drop:
+                    # connection lost before the final chunk
+                    return response
+
+                candidate = {"content": {"role": "model", "parts": [{"text": chunk}]}}
+                data = {"candidates": [candidate], "modelVersion": model}
+                if last:
+                    candidate["finishReason"] = "STOP"
+                    data["usageMetadata"] = usage
+                await response.write(
+                    f"data: {json.dumps(data, ensure_ascii=False)}\r\n\r\n".encode()
+                )
+        except ConnectionResetError:
+            # client gave up (deadline or cancelled request)
+            return response
+
+        await response.write_eof()
+        return response
+
+    async def create_cache(self, request: web.Request) -> web.Response:
+        body: dict = await request.json()
+        if not str(body.get("model", "")).startswith("models/"):
+            return self._error(400, "Field 'model' must be 'models/{model}'")
+
+        match = re.fullmatch(r"(\d+(?:\.\d+)?)s", str(body.get("ttl", "3600s")))
+        if match is None:
+            return self._error(400, "Invalid ttl")
+        ttl = float(match.group(1))
+
+        name = f"cachedContents/{uuid.uuid4().hex[:16]}"
+        text = parts_text([body.get("systemInstruction") or {}]) + parts_text(
+            body.get("contents", [])
+        )
+        cache = {
+            "name": name,
+            "model": body["model"],
+            "expireTime": time.strftime(
+                "%Y-%m-%dT%H:%M:%SZ", time.gmtime(time.time() + ttl)
+            ),
+            "usageMetadata": {"totalTokenCount": count_tokens(text)},
+        }
+        self.caches[name] = (time.time() + ttl, cache)
+        return web.json_response(cache)
+
+    async def get_cache(self, request: web.Request) -> web.Response:
+        name = f"cachedContents/{request.match_info['cache_id']}"
+        cache = self._get_cache(name)
+        if cache is None:
+            return self._error(404, f"CachedContent not found: {name}")
+        return web.json_response(cache)
+
+    async def delete_cache(self, request: web.Request) -> web.Response:
+        name = f"cachedContents/{request.match_info['cache_id']}"
+        if self.caches.pop(name, None) is None:
+            return self._error(404, f"CachedContent not found: {name}")
+        return web.json_response({})
+
+    async def create_batch(self, request: web.Request, model: str) -> web.Response:
+        body: dict = await request.json()
+        batch: dict = body.get("batch") or {}
+        requests = (
+            ((batch.get("inputConfig") or {}).get("requests") or {}).get("requests")
+        ) or []
+        if not requests:
+            return self._error(400, "Batch must contain inlined requests")
+
+        if random.random() < self.rate_limit_rate:
+            self.rate_limited += 1
+            return self._rate_limited()
+
+        name = f"batches/{uuid.uuid4().hex[:16]}"
+        operation = {
+            "name": name,
+            "metadata": {
+                "@type": "type.googleapis.com/google.ai.generativelanguage.v1beta.GenerateContentBatch",
+                "name": name,
+                "model": f"models/{model}",
+                "displayName": batch.get("displayName", ""),
+                "state": "BATCH_STATE_PENDING",
+                "batchStats": {"requestCount": str(len(requests))},
+            },
+        }
+        self.batches[name] = operation
+        self._batch_tasks[name] = asyncio.create_task(
+            self._process_batch(operation, model, requests)
+        )
+        return web.json_response(operation)
+
+    async def _process_batch(
+        self, operation: dict, model: str, requests: list[dict]
+    ) -> None:
+        """Job is pending for a while, runs for the rest of `batch_latency`."""
+        duration = self.latency_model.sample(self.batch_latency)
+        await asyncio.sleep(duration / 4)
+        operation["metadata"]["state"] = "BATCH_STATE_RUNNING"
+        await asyncio.sleep(duration * 3 / 4)
+
+        responses = []
+        failed = 0
+        for item in requests:
+            self.calls += 1
+            if random.random() < self.batch_fail_rate:
+                failed += 1
+                responses.append(
+                    {
+                        "error": {"code": 13, "message": "Internal error"},
+                        "metadata": item.get("metadata", {}),
+                    }
+                )
+                continue
+            text, usage = self._reply(item.get("request") or {})
+            responses.append(
+                {
+                    "response": self._response(model, text, usage),
+                    "metadata": item.get("metadata", {}),
+                }
+            )
+
+        operation["metadata"]["state"] = "BATCH_STATE_SUCCEEDED"
+        operation["metadata"]["batchStats"].update(
+            successfulRequestCount=str(len(requests) - failed),
+            failedRequestCount=str(failed),
+        )
+        operation["done"] = True
+        operation["response"] = {
+            "@type": "type.googleapis.com/google.ai.generativelanguage.v1beta.GenerateContentBatchOutput",
+            "inlinedResponses": {"inlinedResponses": responses},
+        }
+
+    async def batch(self, request: web.Request) -> web.Response:
+        batch_id, _, method = request.match_info["batch_method"].partition(":")
+        name = f"batches/{batch_id}"
+        operation = self.batches.get(name)
+        if operation is None:
+            return self._error(404, f"Batch not found: {name}")
+
+        if request.method == "GET" and not method:
+            return web.json_response(operation)
+        if request.method == "DELETE" and not method:
+            self._batch_tasks.pop(name).cancel()
+            del self.batches[name]
+            return web.json_response({})
+        if request.method == "POST" and method == "cancel":
+            if not operation.get("done"):
+                self._batch_tasks[name].cancel()
+                operation["metadata"]["state"] = "BATCH_STATE_CANCELLED"
+                operation["done"] = True
+            return web.json_response({})
+        return self._error(404, f"Method '{method}' is not supported")
+
+    def app(self) -> web.Application:
+        app = web.Application(client_max_size=32 * 1024**2)
+        app.router.add_post(
+            API_PREFIX + "/models/{model_method}", self.generate_content
+        )
+        app.router.add_post(API_PREFIX + "/cachedContents", self.create_cache)
+        app.router.add_get(API_PREFIX + "/cachedContents/{cache_id}", self.get_cache)
+        app.router.add_delete(
+            API_PREFIX + "/cachedContents/{cache_id}", self.delete_cache
+        )
+        for method in ("GET", "POST", "DELETE"):
+            app.router.add_route(
+                method, API_PREFIX + "/batches/{batch_method}", self.batch
+            )
+        return app
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Offline Gemini API stub")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument(
+        "--latency", type=float, default=0.5, help="seconds per uncached call"
+    )
+    parser.add_argument(
+        "--cached-latency",
+        type=float,
+        default=0.3,
+        help="seconds per call referencing cached content",
+    )
+    parser.add_argument(
+        "--fail-rate", type=float, default=0.0, help="share of calls failing with 503"
+    )
+    parser.add_argument(
+        "--stream-drop-rate",
+        type=float,
+        default=0.0,
+        help="share of streamed replies cut before the final chunk",
+    )
+    parser.add_argument(
+        "--rate-limit-rate",
+        type=float,
+        default=0.0,
+        help="share of calls answered with 429 and a RetryInfo delay",
+    )
+    parser.add_argument(
+        "--retry-delay",
+        type=float,
+        default=1.0,
+        help="seconds of the RetryInfo delay of 429 replies",
+    )
+    parser.add_argument(
+        "--response-chars",
+        type=int,
+        default=0,
+        help="minimal length of the reply text, padded with filler text",
+    )
+    parser.add_argument(
+        "--batch-latency",
+        type=float,
+        default=5.0,
+        help="seconds from submitting a batch job to its completion",
+    )
+    parser.add_argument(
+        "--batch-fail-rate",
+        type=float,
+        default=0.0,
+        help="share of batch requests answered with an error",
+    )
+    add_latency_arguments(parser)
+    args = parser.parse_args()
+
+    stub = GeminiStub(
+        args.latency,
+        args.cached_latency,
+        args.fail_rate,
+        args.stream_drop_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        retry_delay=args.retry_delay,
+        response_chars=args.response_chars,
+        latency_model=latency_model(args),
+        batch_latency=args.batch_latency,
+        batch_fail_rate=args.batch_fail_rate,
+    )
+    web.run_app(stub.app(), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
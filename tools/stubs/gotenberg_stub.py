@@ -0,0 +1,176 @@
+"""
+Local stand-in for the Gotenberg Chromium HTML route, for offline development
+and benchmarks.
+
+Returns a small valid PDF (padded up to `--pdf-bytes`) after `--latency` seconds,
+answers 503 while more than `--max-concurrency` conversions run at once (like
+an overloaded Chromium), fails `--fail-rate` of conversions with 500 and checks
+basic auth when `--username` is given.
+
+Usage:
+    python -m tools.stubs.gotenberg_stub --port 5001 --latency 1.0
+
+and point the app at it:
+    GOTENBERG_API_URL=http://localhost:5001/forms/chromium/convert/html
+"""
+
+import argparse
+import asyncio
+import base64
+import hashlib
+import random
+
+from aiohttp import web
+
+from tools.stubs.latency import LatencyModel, add_latency_arguments, latency_model
+
+CONVERT_ROUTE = "/forms/chromium/convert/html"
+
+
+def minimal_pdf(text: str, size: int = 0) -> bytes:
+    """
+    One page PDF with the text, enough for PDF viewers and size checks,
+    padded with a comment in the page content up to about `size` bytes
+    """
+    stream = f"BT /F1 12 Tf 72 720 Td ({text}) Tj ET".encode("latin-1", "replace")
+    if size > 0:
+        stream += b"\n%" + b"x" * max(size - 700, 0)
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+        b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+        b"/Contents 4 0 R /Resources << /Font << /F1 5 0 R >> >> >>",
+        b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream",
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+
+    pdf = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(pdf))
+        pdf += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref = len(pdf)
+    pdf += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        pdf += b"%010d 00000 n \n" % offset
+    pdf += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (
+        len(objects) + 1,
+        xref,
+    )
+    return bytes(pdf)
+
+
+class GotenbergStub:
+    def __init__(
+        self,
+        latency: float,
+        max_concurrency: int,
+        username: str = "",
+        password: str = "",
+        fail_rate: float = 0.0,
+        pdf_bytes: int = 0,
+        latency_model: LatencyModel = LatencyModel(),
+    ) -> None:
+        self.latency = latency
+        self.max_concurrency = max_concurrency
+        self.username = username
+        self.password = password
+        self.fail_rate = fail_rate
+        self.pdf_bytes = pdf_bytes
+        self.latency_model = latency_model
+
+        self.running = 0
+        self.max_running = 0
+        self.conversions = 0
+        self.rejected = 0
+        self.failed = 0
+
+    def _authorized(self, request: web.Request) -> bool:
+        if not self.username:
+            return True
+        expected = base64.b64encode(
+            f"{self.username}:{self.password}".encode()
+        ).decode()
+        return request.headers.get("Authorization") == f"Basic {expected}"
+
+    async def convert_html(self, request: web.Request) -> web.Response:
+        if not self._authorized(request):
+            return web.Response(status=401, text="Unauthorized")
+
+        form = await request.post()
+        upload = form.get("files")
+        if not isinstance(upload, web.FileField) or upload.filename != "index.html":
+            return web.Response(status=400, text="Missing index.html")
+        html = upload.file.read()
+
+        if self.running >= self.max_concurrency:
+            self.rejected += 1
+            return web.Response(status=503, text="Too many concurrent conversions")
+
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        try:
+            await asyncio.sleep(self.latency_model.sample(self.latency))
+        finally:
+            self.running -= 1
+        if random.random() < self.fail_rate:
+            self.failed += 1
+            return web.Response(status=500, text="Chromium failed to convert")
+        self.conversions += 1
+
+        options = ", ".join(
+            f"{name}={value}" for name, value in form.items() if name != "files"
+        )
+        digest = hashlib.sha256(html).hexdigest()[:12]
+        return web.Response(
+            body=minimal_pdf(f"stub {digest} {len(html)}B {options}", self.pdf_bytes),
+            content_type="application/pdf",
+        )
+
+    def app(self) -> web.Application:
+        app = web.Application(client_max_size=64 * 1024**2)
+        app.router.add_post(CONVERT_ROUTE, self.convert_html)
+        return app
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Offline Gotenberg stub")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5001)
+    parser.add_argument(
+        "--latency", type=float, default=1.0, help="seconds per conversion"
+    )
+    parser.add_argument(
+        "--max-concurrency",
+        type=int,
+        default=6,
+        help="conversions above this limit are answered with 503",
+    )
+    parser.add_argument("--username", default="")
+    parser.add_argument("--password", default="")
+    parser.add_argument(
+        "--fail-rate",
+        type=float,
+        default=0.0,
+        help="share of conversions failing with 500",
+    )
+    parser.add_argument(
+        "--pdf-bytes", type=int, default=0, help="approximate size of returned PDFs"
+    )
+    add_latency_arguments(parser)
+    args = parser.parse_args()
+
+    stub = GotenbergStub(
+        args.latency,
+        args.max_concurrency,
+        args.username,
+        args.password,
+        fail_rate=args.fail_rate,
+        pdf_bytes=args.pdf_bytes,
+        latency_model=latency_model(args),
+    )
+    web.run_app(stub.app(), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
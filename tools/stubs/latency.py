@@ -0,0 +1,47 @@
+"""
+Latency distributions of the stubs, shared by their command line options.
+"""
+
+import argparse
+import random
+
+DISTRIBUTIONS = ("fixed", "uniform", "lognormal")
+
+
+class LatencyModel:
+    """
+    Draws latencies around a mean.
+
+    - `fixed` - always the mean
+    - `uniform` - mean * U(1 - jitter, 1 + jitter)
+    - `lognormal` - long tail with the same mean, `jitter` is sigma of the log
+    """
+
+    def __init__(self, distribution: str = "fixed", jitter: float = 0.0) -> None:
+        if distribution not in DISTRIBUTIONS:
+            raise ValueError(f"Unknown latency distribution '{distribution}'")
+        self.distribution = distribution
+        self.jitter = jitter
+
+    def sample(self, mean: float) -> float:
+        if mean <= 0 or self.distribution == "fixed" or self.jitter <= 0:
+            return max(mean, 0.0)
+        if self.distribution == "uniform":
+            return mean * random.uniform(max(1 - self.jitter, 0.0), 1 + self.jitter)
+        return mean * random.lognormvariate(-(self.jitter**2) / 2, self.jitter)
+
+
+def add_latency_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        "--latency-distribution", choices=DISTRIBUTIONS, default="fixed"
+    )
+    parser.add_argument(
+        "--latency-jitter",
+        type=float,
+        default=0.0,
+        help="relative spread (uniform) or sigma (lognormal) of the latency",
+    )
+
+
+def latency_model(args: argparse.Namespace) -> LatencyModel:
+    return LatencyModel(args.latency_distribution, args.latency_jitter)
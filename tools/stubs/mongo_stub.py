@@ -0,0 +1,130 @@
+"""
+In-memory stand-in for MongoDB, for benchmarks without a running database.
+
+Documents are kept by `mongomock_motor` (optional development dependency), GridFS
+files by `MemoryGridFSBucket` implementing the part of the motor bucket API the
+application uses.
+
+Usage (before the application starts):
+    from tools.stubs.mongo_stub import install_memory_mongo
+    install_memory_mongo()
+"""
+
+import sys
+from typing import Optional
+
+from bson import ObjectId
+from gridfs.errors import NoFile
+
+from app.config import SERVER_SETTINGS
+
+# bucket name -> file id -> (filename, data, metadata)
+FILES: dict[str, dict[ObjectId, tuple[str, bytes, Optional[dict]]]] = {}
+
+
+class MemoryGridIn:
+    def __init__(
+        self, files: dict, file_id: ObjectId, filename: str, metadata: Optional[dict]
+    ) -> None:
+        self._files = files
+        self._id = file_id
+        self.filename = filename
+        self.metadata = metadata
+        self._data = bytearray()
+
+    async def write(self, data: bytes) -> None:
+        self._data += data
+
+    async def close(self) -> None:
+        self._files[self._id] = (self.filename, bytes(self._data), self.metadata)
+
+    async def abort(self) -> None:
+        self._data.clear()
+
+
+class MemoryGridOut:
+    def __init__(
+        self,
+        file_id: ObjectId,
+        filename: str,
+        data: bytes,
+        chunk_size: int,
+        metadata: Optional[dict] = None,
+    ) -> None:
+        self._id = file_id
+        self.filename = filename
+        self.metadata = metadata
+        self.length = len(data)
+        self._data = data
+        self._chunk_size = chunk_size
+        self._position = 0
+
+    async def readchunk(self) -> bytes:
+        chunk = self._data[self._position : self._position + self._chunk_size]
+        self._position += len(chunk)
+        return chunk
+
+    async def read(self, size: int = -1) -> bytes:
+        end = self.length if size < 0 else self._position + size
+        data = self._data[self._position : end]
+        self._position += len(data)
+        return data
+
+
+class MemoryGridFSBucket:
+    def __init__(self, database, bucket_name: str = "fs", **kwargs) -> None:
+        self._files = FILES.setdefault(bucket_name, {})
+
+    def open_upload_stream(
+        self,
+        filename: str,
+        chunk_size_bytes: Optional[int] = None,
+        metadata: Optional[dict] = None,
+        **kwargs,
+    ) -> MemoryGridIn:
+        return MemoryGridIn(self._files, ObjectId(), filename, metadata)
+
+    async def upload_from_stream_with_id(
+        self,
+        file_id: ObjectId,
+        filename: str,
+        source: bytes,
+        chunk_size_bytes: Optional[int] = None,
+        metadata: Optional[dict] = None,
+        **kwargs,
+    ) -> None:
+        self._files[file_id] = (filename, bytes(source), metadata)
+
+    async def open_download_stream(self, file_id: ObjectId) -> MemoryGridOut:
+        if file_id not in self._files:
+            raise NoFile(f"no file in gridfs with _id {file_id!r}")
+        filename, data, metadata = self._files[file_id]
+        return MemoryGridOut(
+            file_id, filename, data, SERVER_SETTINGS.PDF_CHUNK_SIZE, metadata
+        )
+
+    async def delete(self, file_id: ObjectId) -> None:
+        if self._files.pop(file_id, None) is None:
+            raise NoFile(f"no file in gridfs with _id {file_id!r}")
+
+
+def install_memory_mongo() -> None:
+    """
+    Replace the database of the application with mongomock and GridFS buckets
+    of the imported `app` modules with `MemoryGridFSBucket`
+    """
+    try:
+        from mongomock_motor import AsyncMongoMockClient
+    except ImportError as err:
+        raise RuntimeError(
+            "In-memory MongoDB requires mongomock-motor (pip install mongomock-motor)"
+        ) from err
+
+    from app.utils.database import DB
+
+    DB.mongo_client = AsyncMongoMockClient()
+    DB.database = DB.mongo_client[SERVER_SETTINGS.MONGO_DB_NAME]
+
+    for name, module in list(sys.modules.items()):
+        if name.startswith("app.") and hasattr(module, "AsyncIOMotorGridFSBucket"):
+            module.AsyncIOMotorGridFSBucket = MemoryGridFSBucket